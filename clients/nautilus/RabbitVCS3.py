@@ -30,8 +30,11 @@ from __future__ import absolute_import
 from rabbitvcs.util.contextmenuitems import *
 import copy
 from rabbitvcs.services.checkerservice import StatusCheckerStub as StatusChecker
+from rabbitvcs.services.conditions import ConditionsCache
+from rabbitvcs.services.scheduler import PRIORITY_PREFETCH
 import rabbitvcs.services.service
 from rabbitvcs.util.settings import SettingsManager
+from rabbitvcs.util.updates import UpdateQueue
 from rabbitvcs import version as EXT_VERSION
 from rabbitvcs import gettext, get_icon_path
 from rabbitvcs.util.log import Log, reload_log_settings
@@ -50,10 +53,10 @@ from rabbitvcs.util.helper import get_file_extension, get_common_directory
 from rabbitvcs.util.helper import launch_ui_window, launch_diff_tool
 import rabbitvcs.vcs.status
 from rabbitvcs.vcs import VCS
-import pysvn
 from gi.repository import Nautilus, GObject, Gtk, GdkPixbuf
 from rabbitvcs.util import helper
 import datetime
+from functools import partial
 from os.path import isdir, isfile, realpath, basename, dirname
 import os.path
 import os
@@ -133,8 +136,8 @@ class RabbitVCS(
     always_invalidate = True
 
     #: When we get the statuses from the callback, put them here for further
-    #: use. This is of the form: [("path/to", {...status dict...}), ...]
-    statuses_from_callback = []
+    #: use. This is of the form: {"path/to": status object, ...}
+    statuses_from_callback = {}
 
     def get_local_path(self, item):
         if item.get_uri_scheme() != "file":
@@ -216,10 +219,22 @@ class RabbitVCS(
 
         self.status_checker.assert_version(EXT_VERSION)
 
-        self.items_cache = {}
+        # Statuses are applied a batch at a time once Nautilus is idle, so that
+        # a burst of them during a checkout does not hold it up
+        self.emblem_updates = UpdateQueue(self.update_emblem)
 
-        # Keep track of the emblems that we changed, to prevent double update requests
-        self.emblem_mod_cache = {}
+        # Let the checker tell us when statuses it reported change
+        self.status_checker.subscribe(self.cb_statuses)
+
+        # The menu conditions of recent selections, until something in
+        # their repositories changes
+        self.items_cache = ConditionsCache(
+            int(settings.get("checker", "max_cached_conditions"))
+        )
+
+        # The folder each window shows, so that requests made for a folder no
+        # window shows anymore can be cancelled
+        self.window_folders = {}
 
     def get_columns(self):
         """
@@ -305,31 +320,22 @@ class RabbitVCS(
 
         # Do our magic...
 
-        # I have added extra logic in cb_status, using a list
-        # (paths_from_callback) that should allow us to work around this for
+        # I have added extra logic in cb_status, using a dictionary
+        # (statuses_from_callback) that should allow us to work around this for
         # now. But it'd be good to have an actual status monitor.
 
-        found = False
-        status = None
-        # Could replace with (st for st in self.... if st.path ...).next()
-        # Need to catch exception
-        for idx in range(len(self.statuses_from_callback)):
-            found = (self.statuses_from_callback[idx].path) == path
-            if found:
-                break
-
-        if found:  # We're here because we were triggered by a callback
-            status = self.statuses_from_callback[idx]
-            del self.statuses_from_callback[idx]
+        # We're here if we were triggered by a callback
+        status = self.statuses_from_callback.pop(path, None)
 
         # Don't bother the checker if we already have the info from a callback
-        if not found:
+        if status is None:
             status = self.status_checker.check_status(
                 path,
                 recurse=True,
                 summary=True,
                 callback=self.cb_status,
                 invalidate=invalidate,
+                group=dirname(path),
             )
 
         # FIXME: when did this get disabled?
@@ -374,8 +380,6 @@ class RabbitVCS(
 
     def update_status(self, item, path, status):
         if status.summary in rabbitvcs.ui.STATUS_EMBLEMS:
-            # log.error ("Add emblem"+path)
-            self.emblem_mod_cache[path] = True
             item.add_emblem(rabbitvcs.ui.STATUS_EMBLEMS[status.summary])
 
     # ~ @disable
@@ -414,30 +418,28 @@ class RabbitVCS(
 
         # log.debug("get_file_items_full() called")
 
-        paths_str = "-".join(paths)
         base_dir = dirname(paths[0])
 
-        conditions_dict = None
-        if paths_str in self.items_cache:
-            conditions_dict = self.items_cache[paths_str]
-            if conditions_dict and conditions_dict != "in-progress":
-                conditions = NautilusMenuConditions(conditions_dict)
-                menu = NautilusMainContextMenu(
-                    self, base_dir, paths, conditions
-                ).get_menu()
-                return menu
-
-        if conditions_dict != "in-progress":
+        key = self.items_cache.key(paths)
+        conditions_dict = self.items_cache.get(key)
+        if conditions_dict:
+            conditions = NautilusMenuConditions(conditions_dict)
+            menu = NautilusMainContextMenu(self, base_dir, paths, conditions).get_menu()
+            return menu
+
+        if self.items_cache.begin(key):
             self.status_checker.generate_menu_conditions_async(
-                provider, base_dir, paths, self.update_file_items
+                provider,
+                base_dir,
+                paths,
+                partial(self.update_file_items, key),
+                group=base_dir,
             )
-            self.items_cache[path] = "in-progress"
 
         return ()
 
-    def update_file_items(self, provider, base_dir, paths, conditions_dict):
-        paths_str = "-".join(paths)
-        self.items_cache[paths_str] = conditions_dict
+    def update_file_items(self, key, provider, base_dir, paths, conditions_dict):
+        self.items_cache.put(key, conditions_dict)
         Nautilus.MenuProvider.emit_items_updated_signal(provider)
 
     # ~ @disable
@@ -479,42 +481,64 @@ class RabbitVCS(
         path = self.get_local_path(item)
         self.VFSFile_table[path] = item
 
+        # The requests made for the folder this window showed before are not
+        # needed anymore, unless another window shows it too
+        previous_folder = self.window_folders.get(window)
+        self.window_folders[window] = path
+        if (
+            previous_folder is not None
+            and previous_folder != path
+            and previous_folder not in list(self.window_folders.values())
+        ):
+            self.status_checker.cancel(previous_folder)
+
+        # Items whose status check was cancelled when we left this folder
+        # earlier still show a pending status
+        for cancelled_path in self.status_checker.cancelled_paths(path):
+            if cancelled_path in self.VFSFile_table:
+                self.VFSFile_table[cancelled_path].invalidate_extension_info()
+
+        # Check the folders the user may go on to while they look at this one
+        self.status_checker.prefetch(path)
+
         # Early exit when we are already waiting for new info on a path
-        if path in self.items_cache and self.items_cache[path] == "in-progress":
-            log.error("Sceduled task already pending, exit early, in progress")
+        key = self.items_cache.key([path])
+        conditions_dict = self.items_cache.get(key)
+        if conditions_dict is None and not self.items_cache.begin(key):
+            log.debug("Menu conditions of %s already pending" % path)
             return ()
 
         # Schedule menu conditions computation for directory contents.
         for file in os.listdir(path):
             subpath = os.path.join(path, file)
-            if not subpath in self.items_cache:
-                self.items_cache[subpath] = "in-progress"
+            subkey = self.items_cache.key([subpath])
+            if self.items_cache.get(subkey) is None and self.items_cache.begin(subkey):
                 self.status_checker.generate_menu_conditions_async(
-                    provider, path, [subpath], self.update_background_items
+                    provider,
+                    path,
+                    [subpath],
+                    partial(self.update_background_items, subkey),
+                    PRIORITY_PREFETCH,
+                    path,
                 )
 
-        conditions_dict = None
-        if path in self.items_cache:
-            conditions_dict = self.items_cache[path]
-            if conditions_dict and conditions_dict != "in-progress":
-                conditions = NautilusMenuConditions(conditions_dict)
-                menu = NautilusMainContextMenu(
-                    self, path, [path], conditions
-                ).get_menu()
-                return menu
-
-        if conditions_dict != "in-progress":
-            self.status_checker.generate_menu_conditions_async(
-                provider, path, [path], self.update_background_items
-            )
-            self.items_cache[path] = "in-progress"
+        if conditions_dict is not None:
+            conditions = NautilusMenuConditions(conditions_dict)
+            menu = NautilusMainContextMenu(self, path, [path], conditions).get_menu()
+            return menu
+
+        self.status_checker.generate_menu_conditions_async(
+            provider,
+            path,
+            [path],
+            partial(self.update_background_items, key),
+            group=path,
+        )
 
         return ()
 
-    def update_background_items(self, provider, base_dir, paths, conditions_dict):
-        paths_str = "-".join(paths)
-        conditions = NautilusMenuConditions(conditions_dict)
-        self.items_cache[paths_str] = conditions_dict
+    def update_background_items(self, key, provider, base_dir, paths, conditions_dict):
+        self.items_cache.put(key, conditions_dict)
         Nautilus.MenuProvider.emit_items_updated_signal(provider)
 
     #
@@ -549,6 +573,7 @@ class RabbitVCS(
             #   - When a directory is normal and you add files inside it
             #
             for path in paths:
+                self.items_cache.invalidate(path, recurse=True)
                 # We're not interested in the result now, just the callback
                 self.status_checker.check_status(
                     path,
@@ -605,15 +630,40 @@ class RabbitVCS(
     # Callbacks
     #
 
+    def cb_statuses(self, statuses):
+        """
+        This is the callback for the C{StatusesChanged} signal of the checker,
+        with the statuses that changed since it reported them.
+
+        @type   statuses: list of status objects
+        @param  statuses: The statuses
+        """
+        for status in statuses:
+            # Found by the checker itself, e.g. after a change made outside
+            # the file manager, so the menus of its repository may be stale
+            self.items_cache.invalidate(status.path)
+            self.cb_status(status)
+
     def cb_status(self, status):
         """
-        This is the callback that C{StatusMonitor} calls.
+        This is the callback that C{StatusMonitor} calls. The status is applied
+        along with the others reported meanwhile once Nautilus is idle, see
+        C{update_emblem}.
+
+        @type   status: status object
+        @param  status: The status of the item something interesting happened to.
+        """
+        self.emblem_updates.add(status.path, status)
+
+    def update_emblem(self, path, status):
+        """
+        Applies the latest status reported for an item.
 
         @type   path:   string
         @param  path:   The path of the item something interesting happened to.
 
-        @type   statuses: list of status objects
-        @param  statuses: The statuses
+        @type   status: status object
+        @param  status: The status
         """
         if status.path in self.VFSFile_table:
             item = self.VFSFile_table[status.path]
@@ -626,18 +676,10 @@ class RabbitVCS(
             # After invalidating C{update_file_info} applies the correct emblem.
             # Since invalidation triggers an "update_file_info" call, we can
             # tell it NOT to invalidate the status checker path.
-            self.statuses_from_callback.append(status)
+            self.statuses_from_callback[status.path] = status
             # NOTE! There is a call to "update_file_info" WITHIN the call to
             # invalidate_extension_info() - beware recursion!
             item.invalidate_extension_info()
-            if status.path in self.items_cache:
-                # Prevent invalidating the item_cache because the emblem changed
-                # If we don't do this, all version control items in a directory are double scanned
-                if status.path in self.emblem_mod_cache:
-                    del self.emblem_mod_cache[status.path]
-                else:
-                    # log.error ("Remove path from cache: "+status.path)
-                    del self.items_cache[status.path]
         else:
             log.debug("Path [%s] not found in file table" % status.path)
 
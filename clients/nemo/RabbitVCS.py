@@ -32,8 +32,10 @@ from __future__ import absolute_import
 from rabbitvcs.util.contextmenuitems import *
 import copy
 from rabbitvcs.services.checkerservice import StatusCheckerStub as StatusChecker
+from rabbitvcs.services.conditions import ConditionsCache
 import rabbitvcs.services.service
 from rabbitvcs.util.settings import SettingsManager
+from rabbitvcs.util.updates import UpdateQueue
 from rabbitvcs import version as EXT_VERSION
 from rabbitvcs import gettext, get_icon_path
 from rabbitvcs.util.log import Log, reload_log_settings
@@ -53,11 +55,11 @@ from rabbitvcs.util.helper import get_file_extension, get_common_directory
 from rabbitvcs.util.helper import launch_ui_window, launch_diff_tool
 import rabbitvcs.vcs.status
 from rabbitvcs.vcs import VCS
-import pysvn
 from gi.repository import Nemo, GObject, Gtk, GdkPixbuf
 import gi
 from rabbitvcs.util import helper
 import datetime
+from functools import partial
 from os.path import isdir, isfile, realpath, basename
 import os.path
 import os
@@ -144,8 +146,8 @@ class RabbitVCS(
     always_invalidate = True
 
     #: When we get the statuses from the callback, put them here for further
-    #: use. This is of the form: [("path/to", {...status dict...}), ...]
-    statuses_from_callback = []
+    #: use. This is of the form: {"path/to": status object, ...}
+    statuses_from_callback = {}
 
     def get_local_path(self, item):
         if item.get_uri_scheme() != "file":
@@ -227,7 +229,18 @@ class RabbitVCS(
 
         self.status_checker.assert_version(EXT_VERSION)
 
-        self.items_cache = {}
+        # Statuses are applied a batch at a time once Nemo is idle, so that
+        # a burst of them during a checkout does not hold it up
+        self.emblem_updates = UpdateQueue(self.update_emblem)
+
+        # Let the checker tell us when statuses it reported change
+        self.status_checker.subscribe(self.cb_statuses)
+
+        # The menu conditions of recent selections, until something in
+        # their repositories changes
+        self.items_cache = ConditionsCache(
+            int(settings.get("checker", "max_cached_conditions"))
+        )
 
     def get_columns(self):
         """
@@ -313,25 +326,15 @@ class RabbitVCS(
 
         # Do our magic...
 
-        # I have added extra logic in cb_status, using a list
-        # (paths_from_callback) that should allow us to work around this for
+        # I have added extra logic in cb_status, using a dictionary
+        # (statuses_from_callback) that should allow us to work around this for
         # now. But it'd be good to have an actual status monitor.
 
-        found = False
-        status = None
-        # Could replace with (st for st in self.... if st.path ...).next()
-        # Need to catch exception
-        for idx in range(len(self.statuses_from_callback)):
-            found = (self.statuses_from_callback[idx].path) == path
-            if found:
-                break
-
-        if found:  # We're here because we were triggered by a callback
-            status = self.statuses_from_callback[idx]
-            del self.statuses_from_callback[idx]
+        # We're here if we were triggered by a callback
+        status = self.statuses_from_callback.pop(path, None)
 
         # Don't bother the checker if we already have the info from a callback
-        if not found:
+        if status is None:
             status = self.status_checker.check_status(
                 path,
                 recurse=True,
@@ -420,27 +423,22 @@ class RabbitVCS(
 
         # log.debug("get_file_items_full() called")
 
-        paths_str = "-".join(paths)
-
-        conditions_dict = None
-        if paths_str in self.items_cache:
-            conditions_dict = self.items_cache[paths_str]
-            if (
-                conditions_dict
-                and conditions_dict != "in-progress"
-                and hasattr(window, "base_dir")
-            ):
-                conditions = NemoMenuConditions(conditions_dict)
-                menu = NemoMainContextMenu(
-                    self, window.base_dir, paths, conditions
-                ).get_menu()
-                return menu
-
-        if conditions_dict != "in-progress" and hasattr(window, "base_dir"):
+        if not hasattr(window, "base_dir"):
+            return ()
+
+        key = self.items_cache.key(paths)
+        conditions_dict = self.items_cache.get(key)
+        if conditions_dict:
+            conditions = NemoMenuConditions(conditions_dict)
+            menu = NemoMainContextMenu(
+                self, window.base_dir, paths, conditions
+            ).get_menu()
+            return menu
+
+        if self.items_cache.begin(key):
             self.status_checker.generate_menu_conditions_async(
-                provider, window.base_dir, paths, self.update_file_items
+                provider, window.base_dir, paths, partial(self.update_file_items, key)
             )
-            self.items_cache[path] = "in-progress"
 
         return ()
 
@@ -459,9 +457,8 @@ class RabbitVCS(
 
         return NemoMainContextMenu(self, window.base_dir, paths).get_menu()
 
-    def update_file_items(self, provider, base_dir, paths, conditions_dict):
-        paths_str = "-".join(paths)
-        self.items_cache[paths_str] = conditions_dict
+    def update_file_items(self, key, provider, base_dir, paths, conditions_dict):
+        self.items_cache.put(key, conditions_dict)
         Nemo.MenuProvider.emit_items_updated_signal(provider)
 
     # ~ @disable
@@ -505,21 +502,21 @@ class RabbitVCS(
 
         # log.debug("get_background_items_full() called")
 
-        conditions_dict = None
-        if path in self.items_cache:
-            conditions_dict = self.items_cache[path]
-            if conditions_dict and conditions_dict != "in-progress":
-                conditions = NemoMenuConditions(conditions_dict)
-                menu = NemoMainContextMenu(self, path, [path], conditions).get_menu()
-                return menu
+        self.status_checker.prefetch(path)
+
+        key = self.items_cache.key([path])
+        conditions_dict = self.items_cache.get(key)
+        if conditions_dict:
+            conditions = NemoMenuConditions(conditions_dict)
+            menu = NemoMainContextMenu(self, path, [path], conditions).get_menu()
+            return menu
 
         window.base_dir = path
 
-        if conditions_dict != "in-progress":
+        if self.items_cache.begin(key):
             self.status_checker.generate_menu_conditions_async(
-                provider, path, [path], self.update_background_items
+                provider, path, [path], partial(self.update_background_items, key)
             )
-            self.items_cache[path] = "in-progress"
 
         return ()
 
@@ -535,10 +532,8 @@ class RabbitVCS(
 
         return NemoMainContextMenu(self, path, [path]).get_menu()
 
-    def update_background_items(self, provider, base_dir, paths, conditions_dict):
-        paths_str = "-".join(paths)
-        conditions = NemoMenuConditions(conditions_dict)
-        self.items_cache[paths_str] = conditions_dict
+    def update_background_items(self, key, provider, base_dir, paths, conditions_dict):
+        self.items_cache.put(key, conditions_dict)
         Nemo.MenuProvider.emit_items_updated_signal(provider)
 
     #
@@ -573,6 +568,7 @@ class RabbitVCS(
             #   - When a directory is normal and you add files inside it
             #
             for path in paths:
+                self.items_cache.invalidate(path, recurse=True)
                 # We're not interested in the result now, just the callback
                 self.status_checker.check_status(
                     path,
@@ -627,15 +623,40 @@ class RabbitVCS(
     # Callbacks
     #
 
+    def cb_statuses(self, statuses):
+        """
+        This is the callback for the C{StatusesChanged} signal of the checker,
+        with the statuses that changed since it reported them.
+
+        @type   statuses: list of status objects
+        @param  statuses: The statuses
+        """
+        for status in statuses:
+            # Found by the checker itself, e.g. after a change made outside
+            # the file manager, so the menus of its repository may be stale
+            self.items_cache.invalidate(status.path)
+            self.cb_status(status)
+
     def cb_status(self, status):
         """
-        This is the callback that C{StatusMonitor} calls.
+        This is the callback that C{StatusMonitor} calls. The status is applied
+        along with the others reported meanwhile once Nemo is idle, see
+        C{update_emblem}.
+
+        @type   status: status object
+        @param  status: The status of the item something interesting happened to.
+        """
+        self.emblem_updates.add(status.path, status)
+
+    def update_emblem(self, path, status):
+        """
+        Applies the latest status reported for an item.
 
         @type   path:   string
         @param  path:   The path of the item something interesting happened to.
 
-        @type   statuses: list of status objects
-        @param  statuses: The statuses
+        @type   status: status object
+        @param  status: The status
         """
         if status.path in self.VFSFile_table:
             item = self.VFSFile_table[status.path]
@@ -648,12 +669,10 @@ class RabbitVCS(
             # After invalidating C{update_file_info} applies the correct emblem.
             # Since invalidation triggers an "update_file_info" call, we can
             # tell it NOT to invalidate the status checker path.
-            self.statuses_from_callback.append(status)
+            self.statuses_from_callback[status.path] = status
             # NOTE! There is a call to "update_file_info" WITHIN the call to
             # invalidate_extension_info() - beware recursion!
             item.invalidate_extension_info()
-            if status.path in self.items_cache:
-                del self.items_cache[status.path]
         else:
             log.debug("Path [%s] not found in file table" % status.path)
 
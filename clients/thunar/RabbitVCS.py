@@ -40,7 +40,6 @@ from rabbitvcs.util.helper import get_file_extension, get_common_directory
 from rabbitvcs.util.helper import launch_ui_window, launch_diff_tool
 import rabbitvcs.ui.property_page
 import rabbitvcs.ui
-from rabbitvcs.vcs.svn import SVN
 from gi.repository import GObject, Thunarx
 import copy
 import os.path
@@ -73,16 +72,6 @@ class RabbitVCS(GObject.GObject, Thunarx.MenuProvider, Thunarx.PropertyPageProvi
     #: TODO: should probably be possible to create this dynamically
     EMBLEMS = rabbitvcs.ui.STATUS_EMBLEMS
 
-    #: A list of statuses which count as modified (for a directory) in
-    #: TortoiseSVN emblem speak.
-    MODIFIED_STATUSES = [
-        SVN.STATUS["added"],
-        SVN.STATUS["deleted"],
-        SVN.STATUS["replaced"],
-        SVN.STATUS["modified"],
-        SVN.STATUS["missing"],
-    ]
-
     MODIFIED_TEXT_STATUSES = ["added", "deleted", "replaced", "modified", "missing"]
 
     #: This is our lookup table for C{NautilusVFSFile}s which we need for attaching
@@ -21,7 +21,9 @@
 
 This file can be run as a Python script, in which case it starts a background
 VCS status checking service that can be called via DBUS. It also contains class
-definitions to call these methods from within a separate Python process.
+definitions to call these methods from within a separate Python process. Run
+with --stdio, it checks paths in-process instead and prints the statuses, see
+Headless().
 
 This currently works like so:
 
@@ -49,9 +51,14 @@ import os
 import os.path
 import sys
 import json
+import threading
+import time
+from collections import OrderedDict
+from optparse import OptionParser, SUPPRESS_HELP
 
 from gi.repository import GObject
 from gi.repository import GLib
+from gi.repository import Gio
 
 import dbus
 import dbus.mainloop.glib
@@ -61,54 +68,350 @@ import rabbitvcs.util.decorators
 import rabbitvcs.util._locale
 from rabbitvcs.util import helper
 from rabbitvcs.util.strings import S
+from rabbitvcs.util.settings import SettingsManager
+from rabbitvcs.util.stats import statistics
 import rabbitvcs.services.service
-from rabbitvcs.services.statuschecker import StatusChecker
-
+from rabbitvcs.services.scheduler import (
+    Scheduler,
+    RequestCancelled,
+    PRIORITY_INVALIDATE,
+    PRIORITY_MENU,
+    PRIORITY_VISIBLE,
+    PRIORITY_PREFETCH,
+)
+from rabbitvcs.services.prefetcher import Prefetcher, entries
+from rabbitvcs.vcs.statuscodec import (
+    find_class,
+    encode_status,
+    decode_status,
+    encode_statuses,
+    decode_statuses,
+    negotiate_encoding,
+    ENCODINGS,
+    ENCODING_JSON,
+    ENCODING_COMPACT,
+    COMPACT_FIELDS,
+)
+
+import rabbitvcs.vcs
 import rabbitvcs.vcs.status
 
 from rabbitvcs.util.log import Log
 
 log = Log("rabbitvcs.services.checkerservice")
 
+settings = SettingsManager()
+
 
 INTERFACE = "org.google.code.rabbitvcs.StatusChecker"
 OBJECT_PATH = "/org/google/code/rabbitvcs/StatusChecker"
 SERVICE = "org.google.code.rabbitvcs.RabbitVCS.Checker"
 TIMEOUT = 60 * 15 * 100  # seconds
 
+# The maximum number of paths sent in a single CheckStatusBatch call
+BATCH_SIZE = 500
 
-def find_class(module, name):
-    """Given a module name and a class name, return the actual type object."""
-    # From Python stdlib pickle module source
-    __import__(module)
-    mod = sys.modules[module]
-    klass = getattr(mod, name)
-    return klass
+# The most paths whose status clients were told about that are rechecked when
+# their working copy changes, the least recently reported are dropped first
+MAX_KNOWN = 20000
 
+# The DBus error returned for requests cancelled with CancelRequests
+CANCELLED_ERROR = INTERFACE + ".Cancelled"
 
-def encode_status(status):
-    """Before encoding a status object to JSON, we need to turn it into
-    something simpler.
-    """
-    return status.__getstate__()
+# The encoding of StatusesChanged signals, which every client understands
+SIGNAL_ENCODING = ENCODING_COMPACT
+
+# Written to stdout once the service name is owned, see start_service()
+READY_MESSAGE = "Started status checker service\n"
+
+
+class CancelledException(dbus.DBusException):
+    _dbus_error_name = CANCELLED_ERROR
+
+
+def client_priority(priority):
+    """Returns the priority class asked for by a client, defaulting to
+    visible for anything it is not allowed to ask for."""
+    priority = str(priority)
+    if priority not in (PRIORITY_MENU, PRIORITY_VISIBLE, PRIORITY_PREFETCH):
+        return PRIORITY_VISIBLE
+    return priority
 
 
-def decode_status(json_dict):
-    """Once we get a JSON encoded string out the other side of DBUS, we need to
-    reconstitute the original object. This method is based on the pickle module
-    in the Python stdlib.
+class StatusWatcher(object):
+    """Watches working copies on disk so that cached statuses can be trusted
+    until something actually changes.
+
+    Every directory of a watched working copy gets a file monitor (inotify on
+    Linux), as do the administrative files that change with the repository
+    state (the Git index, HEAD and refs, the SVN wc.db, the Mercurial
+    dirstate). A change to a path in the work tree invalidates that path and
+    its ancestors; a change to the administrative files invalidates the whole
+    working copy.
+
+    The directories to watch are listed by a thread, and their monitors are
+    added a batch at a time while the main loop is idle, so a large working
+    copy does not hold up requests. Nothing in it is trusted until they are
+    all in place. Working copies with more directories than max_watches
+    allows are left unwatched and behave as before (every request may
+    invalidate).
     """
-    cl = find_class(json_dict["__module__"], json_dict["__type__"])
-    st = None
-    if cl in rabbitvcs.vcs.status.STATUS_TYPES:
-        st = cl.__new__(cl)
-        st.__setstate__(json_dict)
-    elif "path" in json_dict:
-        log.warning("Could not deduce status class: %s" % json_dict["__type__"])
-        st = rabbitvcs.vcs.status.Status.status_error(json_dict["path"])
-    else:
-        raise TypeError("RabbitVCS status object has no path")
-    return st
+
+    METADATA = {
+        ".git": ["index", "HEAD", "packed-refs", os.path.join("refs", "heads")],
+        ".svn": ["wc.db"],
+        ".hg": ["dirstate"],
+    }
+
+    IGNORED_EVENTS = [Gio.FileMonitorEvent.CHANGES_DONE_HINT]
+
+    # The most monitors added per idle callback
+    BATCH_SIZE = 256
+
+    def __init__(self, status_checker, max_watches=8192, invalidate=None):
+        self.status_checker = status_checker
+        self.max_watches = max_watches
+
+        # Called with a path and whether to recurse when something changed
+        self.invalidate = invalidate or status_checker.invalidate
+
+        # Watched path -> (repository root, Gio.FileMonitor)
+        self.monitors = {}
+
+        # Repository root -> number of changes seen, or None when the working
+        # copy could not be watched
+        self.repositories = {}
+
+        # Repository root -> number of directory trees still being listed or
+        # watched in it
+        self.pending = {}
+
+        # The paths whose cached status is known to be current, as a tree of
+        # {name: node} dicts in which a node holds True under None when its
+        # own path is clean, so that a whole subtree is dropped at once
+        self.clean = {}
+
+    def find_root(self, path):
+        guess = self.status_checker.vcs_client.guess(path)
+        if guess["vcs"] == rabbitvcs.vcs.VCS_DUMMY:
+            return None
+        return guess["repo_path"]
+
+    def begin(self, path):
+        """Makes sure the working copy of path is watched. Returns a token to
+        pass to mark_clean() once the status of path has been computed, or
+        None if the path is not watched (yet).
+        """
+        root = self.find_root(path)
+        if root is None:
+            return None
+
+        if root not in self.repositories:
+            self.watch_repository(root)
+
+        if self.repositories[root] is None or root in self.pending:
+            return None
+
+        return (root, self.repositories[root])
+
+    def mark_clean(self, path, token):
+        """Records that the status of path is current, unless its working
+        copy changed since begin() handed out the token.
+        """
+        if token is None:
+            return
+
+        (root, changes) = token
+        if self.repositories.get(root) == changes and root not in self.pending:
+            self._node(path, create=True)[None] = True
+
+    def is_clean(self, path):
+        node = self._node(path)
+        return node is not None and None in node
+
+    def _node(self, path, create=False):
+        node = self.clean
+        for name in path.split("/"):
+            if not name:
+                continue
+            child = node.get(name)
+            if child is None:
+                if not create:
+                    return None
+                child = node[name] = {}
+            node = child
+        return node
+
+    def watch_repository(self, root):
+        self.repositories[root] = 0
+
+        for folder, names in list(self.METADATA.items()):
+            admin_path = os.path.join(root, folder)
+            if not os.path.isdir(admin_path):
+                continue
+
+            for name in names:
+                metadata_path = os.path.join(admin_path, name)
+                if os.path.exists(metadata_path):
+                    self._monitor(metadata_path, root, True)
+
+        self.watch_tree(root, root)
+
+    def watch_tree(self, path, root):
+        """Watches every directory under path, which is listed by a thread.
+        The working copy is not trusted until they are all watched.
+        """
+        self.pending[root] = self.pending.get(root, 0) + 1
+
+        thread = threading.Thread(
+            target=self._list_tree, args=(path, root), name="StatusWatcher-walk"
+        )
+        thread.daemon = True
+        thread.start()
+
+    def _list_tree(self, path, root):
+        # Runs in a thread, so it only reads self.monitors to give up early
+        folders = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = [d for d in dirnames if d not in self.METADATA]
+            folders.append(dirpath)
+            if len(folders) + len(self.monitors) > self.max_watches:
+                folders = None
+                break
+
+        GLib.idle_add(self._add_monitors, root, folders)
+
+    def _add_monitors(self, root, folders):
+        """Adds a batch of the monitors listed by _list_tree(). Returns True
+        while some are left, so that the idle callback runs again.
+        """
+        if self.repositories.get(root) is None:
+            # Unwatched, or the watcher quit, in the meantime
+            return False
+
+        if folders is None or len(folders) + len(self.monitors) > self.max_watches:
+            log.debug("Too many directories to watch in %s, not watching it" % root)
+            self.unwatch_repository(root)
+            return False
+
+        for path in folders[-self.BATCH_SIZE :]:
+            self._monitor(path, root, False)
+        del folders[-self.BATCH_SIZE :]
+        if folders:
+            return True
+
+        self.pending[root] -= 1
+        if not self.pending[root]:
+            del self.pending[root]
+        return False
+
+    def unwatch_repository(self, root):
+        for path, (monitor_root, monitor) in list(self.monitors.items()):
+            if monitor_root == root:
+                monitor.cancel()
+                del self.monitors[path]
+
+        self.repositories[root] = None
+        self.pending.pop(root, None)
+        self.forget(root, recurse=True)
+
+    def _monitor(self, path, root, is_metadata):
+        if path in self.monitors:
+            return
+
+        try:
+            monitor = Gio.File.new_for_path(path).monitor(
+                Gio.FileMonitorFlags.WATCH_MOVES, None
+            )
+        except GLib.Error as e:
+            log.debug("Unable to watch %s: %s" % (path, e))
+            return
+
+        monitor.connect("changed", self._on_changed, root, is_metadata)
+        self.monitors[path] = (root, monitor)
+
+    def _on_changed(self, monitor, gfile, other_gfile, event_type, root, is_metadata):
+        if event_type in self.IGNORED_EVENTS:
+            return
+
+        if self.repositories.get(root) is None:
+            return
+
+        self.repositories[root] += 1
+
+        if is_metadata:
+            self.forget(root, recurse=True)
+            self.invalidate(root, True)
+            return
+
+        for changed_file in (gfile, other_gfile):
+            if changed_file is None:
+                continue
+
+            path = changed_file.get_path()
+            if path is None or os.path.basename(path) in self.METADATA:
+                continue
+
+            self.path_changed(path, root, event_type)
+
+    def path_changed(self, path, root, event_type):
+        recurse = event_type in (
+            Gio.FileMonitorEvent.DELETED,
+            Gio.FileMonitorEvent.MOVED_OUT,
+            Gio.FileMonitorEvent.RENAMED,
+        )
+
+        self.forget(path, recurse)
+        self.invalidate(path, recurse)
+
+        if recurse:
+            for watched_path, (monitor_root, monitor) in list(self.monitors.items()):
+                if watched_path == path or watched_path.startswith(path + "/"):
+                    monitor.cancel()
+                    del self.monitors[watched_path]
+
+        if os.path.isdir(path) and path not in self.monitors:
+            self.watch_tree(path, root)
+
+    def forget(self, path, recurse=False):
+        """Stops trusting the cached status of path and its ancestors, and
+        with recurse, of everything under it.
+        """
+        names = [name for name in path.split("/") if name]
+        node = self.clean
+        node.pop(None, None)
+        parents = []
+        for name in names:
+            child = node.get(name)
+            if child is None:
+                break
+            parents.append((node, name))
+            node = child
+            node.pop(None, None)
+        else:
+            if recurse:
+                node.clear()
+
+        # Drop the nodes left empty, deepest first
+        for parent, name in reversed(parents):
+            if parent[name]:
+                break
+            del parent[name]
+
+    def quit(self):
+        for path, (root, monitor) in list(self.monitors.items()):
+            monitor.cancel()
+        self.monitors = {}
+        self.repositories = {}
+        self.pending = {}
+
+
+def fingerprint(status):
+    """Returns what clients are shown of a status, to tell whether it changed."""
+    return tuple(getattr(status, field, None) for field in COMPACT_FIELDS) + (
+        status.date,
+        type(status).__name__,
+    )
 
 
 def output_and_flush(*args):
@@ -146,18 +449,53 @@ class StatusCheckerService(dbus.service.Object):
         self.mainloop = mainloop
 
         # Start the status checking daemon so we can do requests in the
-        # background
+        # background. Imported here, since the extensions only need the stub.
+        from rabbitvcs.services.statuschecker import StatusChecker
+
         self.status_checker = StatusChecker()
 
+        # Checks run on worker threads, most urgent first, and their results
+        # are handed back on the main loop. Background work is kept off one of
+        # the workers, so that there is always one for what the user waits on.
+        workers = self.status_checker.workers
+        self.scheduler = Scheduler(
+            GLib.idle_add, workers, {PRIORITY_PREFETCH: max(1, workers - 1)}
+        )
+        self.scheduler.start()
+
+        # Warm the caches for the folders likely to be shown next
+        self.prefetcher = None
+        if settings.get("checker", "prefetch"):
+            self.prefetcher = Prefetcher(
+                self.scheduler, self.prefetch_requests, self.status_checker.repository
+            )
+
+        # The statuses clients were told about, so that they can be told when
+        # they change, least recently reported first:
+        # {path: (recurse, summary, repository, fingerprint, group)}
+        self.known = OrderedDict()
+        self.known_lock = threading.Lock()
+
+        # Watch working copies, so that clients asking us to invalidate a
+        # status we know to be current do not trigger a rescan.
+        self.watcher = None
+        if settings.get("checker", "watch_working_copies"):
+            self.watcher = StatusWatcher(
+                self.status_checker,
+                int(settings.get("checker", "max_watches")),
+                self.changed,
+            )
+
     @dbus.service.method(INTERFACE)
     def ExtraInformation(self):
         return self.status_checker.extra_info()
 
     @dbus.service.method(INTERFACE)
     def MemoryUsage(self):
-        own_mem = helper.process_memory(os.getpid())
-        checker_mem = self.status_checker.get_memory_usage()
-        return own_mem + checker_mem
+        # The checks run on threads of this process, so the caches the workers
+        # own (the statuses of each client and the menu conditions) are part
+        # of its memory
+        return helper.process_memory(os.getpid())
 
     @dbus.service.method(INTERFACE)
     def SetLocale(self, language="", encoding=""):
@@ -171,26 +509,443 @@ class StatusCheckerService(dbus.service.Object):
     def CheckerType(self):
         return self.status_checker.CHECKER_NAME
 
-    @dbus.service.method(INTERFACE, in_signature="aybbb", out_signature="s")
-    def CheckStatus(self, path, recurse=False, invalidate=False, summary=False):
+    @dbus.service.method(
+        INTERFACE,
+        in_signature="aybbb",
+        out_signature="s",
+        async_callbacks=("reply_handler", "error_handler"),
+    )
+    def CheckStatus(
+        self,
+        path,
+        recurse=False,
+        invalidate=False,
+        summary=False,
+        reply_handler=None,
+        error_handler=None,
+    ):
         """Requests a status check from the underlying status checker.
         Path is given as an array of bytes instead of a string because
         dbus does not support strings with invalid characters.
         """
+        reply_handler, error_handler = self.measured(
+            "CheckStatus", reply_handler, error_handler
+        )
+        self.check_statuses(
+            [S(bytearray(path))],
+            recurse,
+            invalidate,
+            summary,
+            PRIORITY_VISIBLE,
+            "",
+            lambda statuses: reply_handler(self.encoder.encode(statuses[0])),
+            error_handler,
+        )
+
+    @dbus.service.method(
+        INTERFACE,
+        in_signature="aaybbbss",
+        out_signature="s",
+        async_callbacks=("reply_handler", "error_handler"),
+    )
+    def CheckStatusBatch(
+        self,
+        paths,
+        recurse=False,
+        invalidate=False,
+        summary=False,
+        priority=PRIORITY_VISIBLE,
+        group="",
+        reply_handler=None,
+        error_handler=None,
+    ):
+        """Requests status checks for many paths in a single call. The reply
+        is a JSON list of statuses, in the same order as the paths.
+
+        The priority is one of "menu", "visible" or "prefetch". Requests made
+        with a non-empty group can be cancelled with CancelRequests.
+        """
+        reply_handler, error_handler = self.measured(
+            "CheckStatusBatch", reply_handler, error_handler
+        )
+        self.check_statuses(
+            [S(bytearray(path)) for path in paths],
+            recurse,
+            invalidate,
+            summary,
+            client_priority(priority),
+            str(group),
+            lambda statuses: reply_handler(self.encoder.encode(statuses)),
+            error_handler,
+        )
+
+    @dbus.service.method(
+        INTERFACE,
+        in_signature="aaybbbsss",
+        out_signature="ay",
+        async_callbacks=("reply_handler", "error_handler"),
+    )
+    def CheckStatusBatchEncoded(
+        self,
+        paths,
+        recurse=False,
+        invalidate=False,
+        summary=False,
+        encoding="",
+        priority=PRIORITY_VISIBLE,
+        group="",
+        reply_handler=None,
+        error_handler=None,
+    ):
+        """Like CheckStatusBatch, but the reply is encoded with one of the
+        encodings agreed on with NegotiateEncoding.
+        """
+        reply_handler, error_handler = self.measured(
+            "CheckStatusBatchEncoded", reply_handler, error_handler
+        )
+        self.check_statuses(
+            [S(bytearray(path)) for path in paths],
+            recurse,
+            invalidate,
+            summary,
+            client_priority(priority),
+            str(group),
+            lambda statuses: reply_handler(
+                dbus.ByteArray(encode_statuses(statuses, encoding))
+            ),
+            error_handler,
+        )
+
+    @dbus.service.method(INTERFACE, in_signature="as", out_signature="s")
+    def NegotiateEncoding(self, encodings):
+        """Given the status encodings a client understands, in order of
+        preference, returns the one that should be used for batched replies.
+        """
+        return negotiate_encoding([str(encoding) for encoding in encodings])
+
+    @dbus.service.method(INTERFACE, in_signature="s", out_signature="i")
+    def CancelRequests(self, group):
+        """Cancels the requests made for a group that have not started yet.
+        They fail with the CANCELLED_ERROR DBus error. Returns the number of
+        requests cancelled.
+        """
+        self.forget_group(str(group))
+        return self.scheduler.cancel(str(group))
+
+    @dbus.service.method(INTERFACE, in_signature="ay")
+    def Prefetch(self, path):
+        """Called when a client shows a folder. Queues, at the lowest priority,
+        the checks it would make if the user went on to a folder in or next
+        to it.
+        """
+        if self.prefetcher:
+            self.prefetcher.visit(S(bytearray(path)))
+
+    def prefetch_requests(self, folder):
+        """Returns the requests that warm the caches for a folder: the checks
+        clients make for the items shown in it, then the conditions of its
+        background menu.
+        """
+        requests = []
+        for path in entries(folder):
+            path = S(path)
+            requests.append(
+                (
+                    ("status", path, True, True),
+                    lambda path=path: self.check_status(path, True, True),
+                    self.status_checker.repository(path),
+                )
+            )
+
+        requests.append(
+            (
+                ("conditions", (folder,)),
+                lambda: self.status_checker.generate_menu_conditions([folder]),
+                self.status_checker.repository(folder),
+            )
+        )
+        return requests
+
+    @dbus.service.method(INTERFACE, out_signature="s")
+    def QueueStats(self):
+        """Returns, as JSON, the number of requests waiting and how long
+        requests waited for each priority class.
+        """
+        return json.dumps(self.scheduler.statistics())
+
+    @dbus.service.method(INTERFACE, out_signature="s")
+    def Stats(self):
+        """Returns, as JSON, the number of calls and the p50/p95/p99 latencies
+        (in seconds) of the status and menu methods, the status cache hits,
+        misses and evictions of each repository, the number, duration and
+        output of the subprocesses run by the backends, the memory of the
+        service (in KB, read from /proc) and the request queue statistics.
+        """
+        stats = statistics.summary()
+        memory = helper.process_memory_status()
+        memory["resident"] = helper.process_resident_memory()
+        stats["memory"] = memory
+        stats["queue"] = self.scheduler.statistics()
+        return json.dumps(stats)
+
+    def measured(self, method, reply_handler, error_handler):
+        """Wraps the handlers of an asynchronous method, to record how long
+        it took to reply in the statistics returned by Stats.
+        """
+        started = time.time()
+
+        def measured_reply_handler(*args):
+            statistics.call(method, time.time() - started)
+            reply_handler(*args)
+
+        def measured_error_handler(error):
+            statistics.call(method, time.time() - started, failed=True)
+            error_handler(error)
+
+        return measured_reply_handler, measured_error_handler
+
+    def invalidate(self, path, recurse=False):
+        """Forgets cached statuses before any check queued after this runs."""
+        self.scheduler.submit(
+            ("invalidate", path, recurse),
+            lambda: self.status_checker.invalidate(path, recurse),
+            lambda result: None,
+            priority=PRIORITY_INVALIDATE,
+            lane=self.status_checker.repository(path),
+        )
+
+    def changed(self, path, recurse=False):
+        """Called by the watcher when something changed in a working copy.
+        Forgets cached statuses and rechecks what clients know about.
+        """
+        self.invalidate(path, recurse)
+        self.refresh(self.status_checker.repository(path))
+
+    def remember(self, path, recurse, summary, status, group=None):
+        entry = (
+            recurse,
+            summary,
+            self.status_checker.repository(path),
+            fingerprint(status),
+            group,
+        )
+        with self.known_lock:
+            self.known.pop(path, None)
+            self.known[path] = entry
+            while len(self.known) > MAX_KNOWN:
+                self.known.popitem(last=False)
+
+    def forget_group(self, group):
+        """Stops rechecking the paths reported for a group, e.g. the folder a
+        client has left.
+        """
+        with self.known_lock:
+            for path, entry in list(self.known.items()):
+                if entry[4] == group:
+                    del self.known[path]
+
+    def refresh(self, repository):
+        """Rechecks, once the more urgent requests are done, the paths of a
+        repository whose status clients know about, and tells them about the
+        ones that changed with the StatusesChanged signal.
+        """
+        if repository is None:
+            return
+
+        def work():
+            with self.known_lock:
+                entries = [
+                    (path, entry)
+                    for path, entry in self.known.items()
+                    if entry[2] == repository
+                ]
+
+            changed = []
+            for path, (recurse, summary, root, known, group) in entries:
+                status = self.status_checker.check_status(
+                    path, recurse=recurse, summary=summary, invalidate=False
+                )
+                if fingerprint(status) != known:
+                    changed.append(status)
+
+            return changed
+
+        self.scheduler.submit(
+            ("refresh", repository),
+            work,
+            self.statuses_changed,
+            priority=PRIORITY_PREFETCH,
+            lane=repository,
+        )
+
+    def statuses_changed(self, statuses):
+        with self.known_lock:
+            for status in statuses:
+                entry = self.known.get(status.path)
+                if entry is not None:
+                    self.known[status.path] = (
+                        entry[:3] + (fingerprint(status),) + entry[4:]
+                    )
+
+        for index in range(0, len(statuses), BATCH_SIZE):
+            batch = statuses[index : index + BATCH_SIZE]
+            self.StatusesChanged(
+                SIGNAL_ENCODING,
+                dbus.ByteArray(encode_statuses(batch, SIGNAL_ENCODING)),
+            )
+
+    @dbus.service.signal(INTERFACE, signature="say")
+    def StatusesChanged(self, encoding, data):
+        """Emitted with a batch of statuses that changed since clients were
+        told about them, because a rescan or a change in a watched working
+        copy updated what is cached.
+        """
+        pass
+
+    def check_statuses(
+        self, paths, recurse, invalidate, summary, priority, group, callback, errback
+    ):
+        """Checks the status of each path and calls callback with the list of
+        statuses, or errback with the first error. All invalidation is queued
+        ahead of the checks, so that paths sharing a working copy can share a
+        rescan, and is skipped for paths the watcher knows to be current.
+        Checks of a path that is already waiting to be checked are merged.
+        """
+        tokens = []
+        for path in paths:
+            token = None
+            if self.watcher:
+                token = self.watcher.begin(path)
+            tokens.append(token)
+
+            if invalidate and not (self.watcher and self.watcher.is_clean(path)):
+                self.invalidate(path)
+
+        statuses = [None] * len(paths)
+        remaining = [len(paths)]
+        failed = []
+
+        if not paths:
+            callback(statuses)
+            return
+
+        def make_callback(index):
+            def status_callback(status):
+                statuses[index] = status
+                self.remember(paths[index], recurse, summary, status, group or None)
+                if self.watcher:
+                    self.watcher.mark_clean(paths[index], tokens[index])
+
+                remaining[0] -= 1
+                if remaining[0] == 0 and not failed:
+                    callback(statuses)
+
+            return status_callback
+
+        def error_callback(error):
+            if failed:
+                return
+            failed.append(error)
+            if isinstance(error, RequestCancelled):
+                error = CancelledException("Request cancelled")
+            errback(error)
+
+        for index, path in enumerate(paths):
+            # A folder shown is first summarised from the items directly in
+            # it, which needs no scan of everything under it
+            deferred = recurse and priority == PRIORITY_VISIBLE and os.path.isdir(path)
+            self.scheduler.submit(
+                ("status", path, recurse and not deferred, summary),
+                lambda path=path, deferred=deferred: self.check_status(
+                    path, recurse and not deferred, summary
+                ),
+                make_callback(index),
+                error_callback,
+                priority,
+                group or None,
+                self.status_checker.repository(path),
+            )
+            if deferred:
+                self.check_summary(path, summary, group)
+
+    def check_summary(self, path, summary, group):
+        """Queues the check of a folder summarised from everything under it,
+        once nothing more urgent is waiting. Clients are told with the
+        StatusesChanged signal if it differs from what they were sent.
+        """
+
+        def summary_checked(status):
+            with self.known_lock:
+                entry = self.known.get(path)
+            if entry is not None and entry[3] != fingerprint(status):
+                self.statuses_changed([status])
+
+        self.scheduler.submit(
+            ("status", path, True, summary),
+            lambda: self.check_status(path, True, summary),
+            summary_checked,
+            lambda error: None,
+            PRIORITY_PREFETCH,
+            group or None,
+            self.status_checker.repository(path),
+        )
+
+    def check_status(self, path, recurse, summary):
+        """Checks a path on a worker thread. Repositories whose statuses were
+        just loaded from the status store are then queued for a rescan, which
+        runs once the more urgent requests are done.
+        """
         status = self.status_checker.check_status(
-            S(bytearray(path)), recurse=recurse, summary=summary, invalidate=invalidate
+            path, recurse=recurse, summary=summary, invalidate=False
         )
 
-        return self.encoder.encode(status)
+        for root in self.status_checker.unconfirmed():
+            repository = self.status_checker.repository(root)
+            self.scheduler.submit(
+                ("confirm", root),
+                lambda root=root: self.status_checker.confirm(root),
+                lambda result, repository=repository: self.refresh(repository),
+                priority=PRIORITY_PREFETCH,
+                lane=repository,
+            )
 
-    @dbus.service.method(INTERFACE, in_signature="aay", out_signature="s")
-    def GenerateMenuConditions(self, paths):
+        return status
+
+    @dbus.service.method(
+        INTERFACE,
+        in_signature="aayss",
+        out_signature="s",
+        async_callbacks=("reply_handler", "error_handler"),
+    )
+    def GenerateMenuConditions(
+        self,
+        paths,
+        priority=PRIORITY_MENU,
+        group="",
+        reply_handler=None,
+        error_handler=None,
+    ):
+        reply_handler, error_handler = self.measured(
+            "GenerateMenuConditions", reply_handler, error_handler
+        )
         upaths = []
         for path in paths:
             upaths.append(S(bytearray(path)))
 
-        path_dict = self.status_checker.generate_menu_conditions(upaths)
-        return json.dumps(path_dict)
+        def errback(error):
+            if isinstance(error, RequestCancelled):
+                error = CancelledException("Request cancelled")
+            error_handler(error)
+
+        self.scheduler.submit(
+            ("conditions", tuple(upaths)),
+            lambda: self.status_checker.generate_menu_conditions(upaths),
+            lambda path_dict: reply_handler(json.dumps(path_dict)),
+            errback,
+            client_priority(priority),
+            str(group) or None,
+            upaths and self.status_checker.repository(upaths[0]) or None,
+        )
 
     @dbus.service.method(INTERFACE)
     def CheckVersionOrDie(self, version):
@@ -231,6 +986,9 @@ class StatusCheckerService(dbus.service.Object):
         If calling this programmatically, then you can do "os.waitpid(pid, 0)"
         on the returned PID to prevent a zombie process.
         """
+        if self.watcher:
+            self.watcher.quit()
+        self.scheduler.quit()
         self.status_checker.quit()
         log.debug("Quitting main loop...")
         self.mainloop.quit()
@@ -258,6 +1016,22 @@ class StatusCheckerStub(object):
         self.session_bus = dbus.SessionBus()
         self.decoder = json.JSONDecoder(object_hook=decode_status)
         self.status_checker = None
+
+        # The encoding of batched replies, see NegotiateEncoding
+        self.encoding = ENCODING_JSON
+
+        # Asynchronous status requests made during one main loop iteration,
+        # sent together by flush_status_checks(). Of the form:
+        # {(recurse, invalidate, summary, priority, group): {path: [callback, ...]}}
+        self.pending_checks = {}
+
+        # Group -> paths whose status check was cancelled, see cancel()
+        self.cancelled_checks = {}
+
+        # Callbacks for StatusesChanged signals, see subscribe()
+        self.subscribers = []
+        self.signal_match = None
+
         self._connect_to_checker()
 
     def _connect_to_checker(self):
@@ -305,6 +1079,22 @@ class StatusCheckerStub(object):
                     log.exception(ex)
                     self._connect_to_checker()
 
+        self.negotiate_encoding()
+
+    def negotiate_encoding(self):
+        """Agrees on the encoding of batched replies with the service, falling
+        back to JSON if the service does not support anything better.
+        """
+        try:
+            self.encoding = str(
+                self.status_checker.NegotiateEncoding(
+                    ENCODINGS, dbus_interface=INTERFACE
+                )
+            )
+        except dbus.DBusException as ex:
+            log.debug("Unable to negotiate a status encoding: %s" % ex)
+            self.encoding = ENCODING_JSON
+
     def check_status_now(self, path, recurse=False, invalidate=False, summary=False):
 
         status = None
@@ -332,66 +1122,267 @@ class StatusCheckerStub(object):
         return status
 
     def check_status_later(
-        self, path, callback, recurse=False, invalidate=False, summary=False
+        self,
+        path,
+        callback,
+        recurse=False,
+        invalidate=False,
+        summary=False,
+        priority=PRIORITY_VISIBLE,
+        group="",
     ):
-        def real_reply_handler(json_status):
-            # Note that this a closure referring to the outer functions callback
-            # parameter
-            status = self.decoder.decode(json_status)
-            path1 = S(path)
-            path2 = S(status.path)
-            assert path1 == path2, (
-                "Status check returned the wrong path "
-                "(asked about %s, got back %s)" % (path1.display(), path2.display())
+        """Queues an asynchronous status check. All checks queued during one
+        main loop iteration are sent to the service in batches, and callback
+        is called with the status of path when it arrives. If the check is
+        cancelled (see cancel()), callback is not called and the path is
+        returned by cancelled_paths() instead.
+        """
+        if not self.pending_checks:
+            GLib.idle_add(self.flush_status_checks)
+
+        requests = self.pending_checks.setdefault(
+            (recurse, invalidate, summary, priority, group), {}
+        )
+        requests.setdefault(path, []).append(callback)
+
+    def flush_status_checks(self):
+        pending = self.pending_checks
+        self.pending_checks = {}
+
+        for (recurse, invalidate, summary, priority, group), requests in list(
+            pending.items()
+        ):
+            paths = list(requests.keys())
+            for index in range(0, len(paths), BATCH_SIZE):
+                batch = [
+                    (path, requests[path]) for path in paths[index : index + BATCH_SIZE]
+                ]
+                self.check_status_batch(
+                    batch, recurse, invalidate, summary, priority, group
+                )
+
+        # Only run once per idle_add()
+        return False
+
+    def cancel(self, group):
+        """Cancels the status checks and menu conditions requested for a
+        group (e.g. a folder the user has left) that have not started yet.
+        """
+        for key in list(self.pending_checks.keys()):
+            if key[4] == group:
+                self.cancelled_checks.setdefault(group, set()).update(
+                    self.pending_checks.pop(key)
+                )
+
+        def error_handler(dbus_ex):
+            log.exception(dbus_ex)
+
+        try:
+            self.status_checker.CancelRequests(
+                group,
+                dbus_interface=INTERFACE,
+                reply_handler=lambda count: None,
+                error_handler=error_handler,
+            )
+        except dbus.DBusException as ex:
+            log.exception(ex)
+
+    def prefetch(self, path):
+        """Tells the service a folder is shown, so that it can check the
+        folders likely to be shown next while it is idle.
+        """
+
+        def error_handler(dbus_ex):
+            log.exception(dbus_ex)
+
+        try:
+            self.status_checker.Prefetch(
+                bytearray(S(path).bytes()),
+                dbus_interface=INTERFACE,
+                reply_handler=lambda: None,
+                error_handler=error_handler,
+            )
+        except dbus.DBusException as ex:
+            log.exception(ex)
+
+    def subscribe(self, callback):
+        """Calls callback with a list of statuses whenever the service finds
+        that statuses it reported before have changed.
+        """
+        self.subscribers.append(callback)
+        if self.signal_match is None:
+            self.signal_match = self.session_bus.add_signal_receiver(
+                self._on_statuses_changed,
+                signal_name="StatusesChanged",
+                dbus_interface=INTERFACE,
+                path=OBJECT_PATH,
+                byte_arrays=True,
             )
-            callback(status)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+        if not self.subscribers and self.signal_match is not None:
+            self.signal_match.remove()
+            self.signal_match = None
+
+    def _on_statuses_changed(self, encoding, data):
+        try:
+            statuses = decode_statuses(bytes(data), str(encoding))
+        except Exception as ex:
+            log.exception(ex)
+            return
+
+        for callback in list(self.subscribers):
+            callback(statuses)
+
+    def cancelled_paths(self, group):
+        """Returns the paths of a group whose status check was cancelled and
+        forgets about them, so that they can be checked again once the group
+        is needed again.
+        """
+        return self.cancelled_checks.pop(group, set())
+
+    def queue_stats(self):
+        """Returns the statistics of the service request queue, see
+        Scheduler.statistics().
+        """
+        try:
+            return json.loads(self.status_checker.QueueStats(dbus_interface=INTERFACE))
+        except dbus.DBusException as ex:
+            log.exception(ex)
+            self._connect_to_checker()
+            return {}
+
+    def stats(self):
+        """Returns the statistics of the service, see
+        StatusCheckerService.Stats().
+        """
+        try:
+            return json.loads(self.status_checker.Stats(dbus_interface=INTERFACE))
+        except dbus.DBusException as ex:
+            log.exception(ex)
+            self._connect_to_checker()
+            return {}
+
+    def check_status_batch(
+        self,
+        batch,
+        recurse=False,
+        invalidate=False,
+        summary=False,
+        priority=PRIORITY_VISIBLE,
+        group="",
+    ):
+        """Sends a single CheckStatusBatch call for a list of
+        (path, [callback, ...]) tuples.
+        """
+
+        encoding = self.encoding
+
+        def real_reply_handler(reply):
+            # Note that this a closure referring to the outer functions batch
+            # parameter
+            if encoding == ENCODING_JSON:
+                statuses = self.decoder.decode(reply)
+            else:
+                statuses = decode_statuses(reply, encoding)
+            for (path, callbacks), status in zip(batch, statuses):
+                path1 = S(path)
+                path2 = S(status.path)
+                assert path1 == path2, (
+                    "Status check returned the wrong path "
+                    "(asked about %s, got back %s)" % (path1.display(), path2.display())
+                )
+                for callback in callbacks:
+                    callback(status)
 
         def reply_handler(*args, **kwargs):
             # The callback should be performed as a low priority task, so we
             # keep Nautilus as responsive as possible.
             GLib.idle_add(real_reply_handler, *args, **kwargs)
 
+        def report_errors():
+            for path, callbacks in batch:
+                for callback in callbacks:
+                    callback(rabbitvcs.vcs.status.Status.status_error(path))
+
         def error_handler(dbus_ex):
+            if dbus_ex.get_dbus_name() == CANCELLED_ERROR:
+                self.cancelled_checks.setdefault(group, set()).update(
+                    path for path, callbacks in batch
+                )
+                return
             log.exception(dbus_ex)
             self._connect_to_checker()
-            callback(rabbitvcs.vcs.status.Status.status_error(path))
+            report_errors()
 
+        bpaths = [bytearray(S(path).bytes()) for path, callbacks in batch]
         try:
-            self.status_checker.CheckStatus(
-                bytearray(S(path).bytes()),
-                recurse,
-                invalidate,
-                summary,
-                dbus_interface=INTERFACE,
-                timeout=TIMEOUT,
-                reply_handler=reply_handler,
-                error_handler=error_handler,
-            )
+            if encoding == ENCODING_JSON:
+                self.status_checker.CheckStatusBatch(
+                    bpaths,
+                    recurse,
+                    invalidate,
+                    summary,
+                    priority,
+                    group,
+                    dbus_interface=INTERFACE,
+                    timeout=TIMEOUT,
+                    reply_handler=reply_handler,
+                    error_handler=error_handler,
+                )
+            else:
+                self.status_checker.CheckStatusBatchEncoded(
+                    bpaths,
+                    recurse,
+                    invalidate,
+                    summary,
+                    encoding,
+                    priority,
+                    group,
+                    dbus_interface=INTERFACE,
+                    timeout=TIMEOUT,
+                    byte_arrays=True,
+                    reply_handler=reply_handler,
+                    error_handler=error_handler,
+                )
         except dbus.DBusException as ex:
             log.exception(ex)
-            callback(rabbitvcs.vcs.status.Status.status_error(path))
+            report_errors()
             # Try to reconnect
             self._connect_to_checker()
 
     # @rabbitvcs.util.decorators.deprecated
     # Can't decide whether this should be deprecated or not... -JH
     def check_status(
-        self, path, recurse=False, invalidate=False, summary=False, callback=None
+        self,
+        path,
+        recurse=False,
+        invalidate=False,
+        summary=False,
+        callback=None,
+        priority=PRIORITY_VISIBLE,
+        group="",
     ):
         """Check the VCS status of the given path.
 
         This is a pass-through method to the check_status method of the DBUS
         service (which is, in turn, a wrapper around the real status checker).
+
+        Asynchronous checks are scheduled by the service according to their
+        priority, and can be cancelled by group.
         """
         if callback:
-            GLib.idle_add(
-                self.check_status_later, path, callback, recurse, invalidate, summary
+            self.check_status_later(
+                path, callback, recurse, invalidate, summary, priority, group
             )
             return rabbitvcs.vcs.status.Status.status_calc(path)
         else:
             return self.check_status_now(path, recurse, invalidate, summary)
 
-    def generate_menu_conditions(self, provider, base_dir, paths, callback):
+    def generate_menu_conditions(
+        self, provider, base_dir, paths, callback, priority=PRIORITY_MENU, group=""
+    ):
         def real_reply_handler(obj):
             # Note that this a closure referring to the outer functions callback
             # parameter
@@ -404,14 +1395,17 @@ class StatusCheckerStub(object):
             GLib.idle_add(real_reply_handler, *args, **kwargs)
 
         def error_handler(dbus_ex):
-            log.exception(dbus_ex)
-            self._connect_to_checker()
+            if dbus_ex.get_dbus_name() != CANCELLED_ERROR:
+                log.exception(dbus_ex)
+                self._connect_to_checker()
             callback(provider, base_dir, paths, {})
 
         bpaths = [bytearray(S(p).bytes()) for p in paths]
         try:
             self.status_checker.GenerateMenuConditions(
                 bpaths,
+                priority,
+                group,
                 dbus_interface=INTERFACE,
                 timeout=TIMEOUT,
                 reply_handler=reply_handler,
@@ -423,9 +1417,17 @@ class StatusCheckerStub(object):
             # Try to reconnect
             self._connect_to_checker()
 
-    def generate_menu_conditions_async(self, provider, base_dir, paths, callback):
+    def generate_menu_conditions_async(
+        self, provider, base_dir, paths, callback, priority=PRIORITY_MENU, group=""
+    ):
         GLib.idle_add(
-            self.generate_menu_conditions, provider, base_dir, paths, callback
+            self.generate_menu_conditions,
+            provider,
+            base_dir,
+            paths,
+            callback,
+            priority,
+            group,
         )
         return {}
 
@@ -455,24 +1457,132 @@ def Main():
     helper.gobject_threads_init()
     dbus.mainloop.glib.threads_init()
 
-    # This registers our service name with the bus
     session_bus = dbus.SessionBus()
-    service_name = dbus.service.BusName(SERVICE, session_bus)
-
     mainloop = GLib.MainLoop()
 
     checker_service = StatusCheckerService(session_bus, mainloop)
 
-    GLib.idle_add(output_and_flush, "Started status checker service\n")
+    # This registers our service name with the bus. The object is exported
+    # first, so it can be called as soon as the name is owned: the calls wait
+    # on the connection until the main loop runs. Tell start_service() that
+    # we are ready right away instead of once the main loop is idle.
+    service_name = dbus.service.BusName(SERVICE, session_bus)
+    output_and_flush(READY_MESSAGE)
 
     mainloop.run()
 
     log.debug("Checker: ended service: %s (%s)" % (OBJECT_PATH, os.getpid()))
 
 
+def Headless(args):
+    """The entry point of the headless checker, for scripting and
+    benchmarking without a desktop session. It is run with "--stdio" or by the
+    rabbitvcs-status command.
+
+    The paths given, or read one per line from stdin if there are none, are
+    checked by a service that is not exported on any bus, so they go through
+    the same scheduler, workers and caches as requests made over DBUS. Each
+    status is printed to stdout as a line of JSON, along with the time it took
+    in seconds. Returns the exit status.
+    """
+    parser = OptionParser(usage="%prog [options] [path ...]")
+    parser.add_option("--stdio", action="store_true", help=SUPPRESS_HELP)
+    parser.add_option(
+        "-r",
+        "--recurse",
+        action="store_true",
+        help="summarise folders from everything under them",
+    )
+    parser.add_option(
+        "-s", "--summary", action="store_true", help="include folder summaries"
+    )
+    parser.add_option(
+        "-i", "--invalidate", action="store_true", help="ignore cached statuses"
+    )
+    parser.add_option(
+        "--stats",
+        action="store_true",
+        help="print the service statistics to stderr when done",
+    )
+    options, paths = parser.parse_args(args)
+
+    helper.gobject_threads_init()
+    mainloop = GLib.MainLoop()
+    service = StatusCheckerService(None, mainloop)
+
+    state = {"pending": 0, "reading": True, "failed": False}
+
+    def finish():
+        if state["pending"] or state["reading"]:
+            return
+        if options.stats:
+            sys.stderr.write(service.Stats() + "\n")
+        service.Quit()
+
+    def output(record, started):
+        record["time"] = time.time() - started
+        output_and_flush(json.dumps(record) + "\n")
+        state["pending"] -= 1
+        finish()
+
+    def check(path):
+        path = os.path.abspath(path)
+        started = time.time()
+        state["pending"] += 1
+
+        def reply(statuses):
+            record = statuses[0].__getstate__()
+            record["type"] = record.pop("__type__")
+            del record["__module__"]
+            output(record, started)
+
+        def error(error):
+            state["failed"] = True
+            output({"path": path, "error": str(error)}, started)
+
+        # Recorded like the DBUS method the check stands in for
+        reply, error = service.measured("CheckStatus", reply, error)
+        service.check_statuses(
+            [path],
+            options.recurse,
+            options.invalidate,
+            options.summary,
+            PRIORITY_VISIBLE,
+            "",
+            reply,
+            error,
+        )
+
+    def end_of_input():
+        state["reading"] = False
+        finish()
+
+    def read():
+        for line in sys.stdin:
+            path = line.rstrip("\n")
+            if path:
+                GLib.idle_add(check, path)
+        GLib.idle_add(end_of_input)
+
+    if paths:
+        for path in paths:
+            GLib.idle_add(check, path)
+        GLib.idle_add(end_of_input)
+    else:
+        reader = threading.Thread(target=read, name="Headless-stdin")
+        reader.daemon = True
+        reader.start()
+
+    mainloop.run()
+    return state["failed"] and 1 or 0
+
+
 if __name__ == "__main__":
     rabbitvcs.util._locale.initialize_locale()
 
+    if "--stdio" in sys.argv[1:]:
+        sys.exit(Headless(sys.argv[1:]))
+
     # import cProfile
     # import rabbitvcs.util.helper
     # profile_data_file = os.path.join(
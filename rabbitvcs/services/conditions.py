@@ -0,0 +1,250 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Caching of the conditions context menus are built from.
+
+Working out the conditions of a selection means looking up the status of
+every selected path, so the checker service and the file manager extensions
+keep those of recent selections.  An entry is keyed by a hash of the selected
+paths and by the generation of each repository they are in.  The generation of
+a repository moves on whenever something in it is invalidated, so conditions
+worked out before that are never used again, and make way for newer ones as
+the least recently used.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import os.path
+import threading
+import unittest
+from collections import OrderedDict
+
+import rabbitvcs.vcs
+from rabbitvcs.vcs.snapshot import within
+
+
+def repository(path):
+    """
+    Returns the root of the working copy the path is in, or None.
+
+    """
+    guess = rabbitvcs.vcs.guess(path)
+    if guess["vcs"] == rabbitvcs.vcs.VCS_DUMMY:
+        return None
+    return guess["repo_path"]
+
+
+class ConditionsCache(object):
+    def __init__(self, max_size=256, repository=repository):
+        """
+        @type   max_size: integer
+        @param  max_size: The most selections to keep the conditions of, least
+            recently used ones are dropped first (0 for no limit)
+
+        @type   repository: callable
+        @param  repository: Called with a folder, returns the root of the
+            working copy it is in, or None
+
+        """
+        self.max_size = max_size
+        self.repository = repository
+
+        # Repository root (None outside working copies) -> generation
+        self.generations = {}
+
+        # Key -> conditions, least recent first
+        self.entries = OrderedDict()
+
+        # The keys whose conditions are being worked out
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def key(self, paths):
+        """
+        Returns the key of the conditions of the selected paths, for the
+        current generation of the repositories they are in.
+
+        """
+        # Files are in the repository of their folder, which saves looking up
+        # the repository of each file when many are selected
+        folders = set()
+        for path in paths:
+            if os.path.isdir(path):
+                folders.add(path)
+            else:
+                folders.add(os.path.dirname(path))
+        roots = set(self.repository(folder) for folder in folders)
+
+        digest = hashlib.sha1()
+        for path in paths:
+            digest.update(path.encode("utf-8", "surrogatepass"))
+            digest.update(b"\0")
+
+        with self.lock:
+            return (
+                digest.hexdigest(),
+                frozenset(
+                    (root, self.generations.setdefault(root, 0)) for root in roots
+                ),
+            )
+
+    def get(self, key):
+        """
+        Returns the conditions kept for the key, or None.
+
+        """
+        with self.lock:
+            conditions = self.entries.pop(key, None)
+            if conditions is not None:
+                self.entries[key] = conditions
+            return conditions
+
+    def begin(self, key):
+        """
+        Marks the conditions for the key as being worked out.  Returns False if
+        they already were, and put() has not been called for them since.
+
+        """
+        with self.lock:
+            if key in self.pending:
+                return False
+            self.pending.add(key)
+            return True
+
+    def put(self, key, conditions):
+        """
+        Keeps the conditions worked out for the key.  Empty conditions, from
+        a request that failed, are not kept.
+
+        """
+        with self.lock:
+            self.pending.discard(key)
+            if not conditions:
+                return
+
+            self.entries.pop(key, None)
+            self.entries[key] = conditions
+            while self.max_size and len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, path, recurse=False):
+        """
+        Moves on the generation of the repository the path is in and, if
+        recurse is True, of every repository below the path.
+
+        """
+        folder = path
+        if not os.path.isdir(path):
+            folder = os.path.dirname(path)
+        roots = set([self.repository(folder)])
+
+        with self.lock:
+            if recurse:
+                roots.update(
+                    root
+                    for root in self.generations
+                    if root is not None and within(root, path)
+                )
+            for root in roots:
+                self.generations[root] = self.generations.get(root, 0) + 1
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class TestConditionsCache(unittest.TestCase):
+    roots = {
+        "/repo": "/repo",
+        "/repo/a": "/repo",
+        "/repo/nested": "/repo/nested",
+        "/other": "/other",
+    }
+
+    def setUp(self):
+        self.cache = ConditionsCache(max_size=2, repository=self.roots.get)
+
+    def test_generations(self):
+        key = self.cache.key(["/repo/a/file"])
+        self.cache.put(key, {"is_git": True})
+        self.assertEqual(self.cache.get(key), {"is_git": True})
+
+        self.cache.invalidate("/other/file")
+        self.assertEqual(
+            self.cache.get(self.cache.key(["/repo/a/file"])), {"is_git": True}
+        )
+
+        self.cache.invalidate("/repo/a/file")
+        self.assertEqual(self.cache.get(self.cache.key(["/repo/a/file"])), None)
+
+    def test_recurse(self):
+        key = self.cache.key(["/repo/nested/file"])
+        self.cache.put(key, {"is_git": True})
+
+        self.cache.invalidate("/repo/a/file", recurse=True)
+        self.assertEqual(
+            self.cache.get(self.cache.key(["/repo/nested/file"])), {"is_git": True}
+        )
+
+        self.cache.invalidate("/repo", recurse=True)
+        self.assertEqual(self.cache.get(self.cache.key(["/repo/nested/file"])), None)
+
+    def test_lru(self):
+        keys = [self.cache.key(["/repo/a/%d" % index]) for index in range(3)]
+        self.cache.put(keys[0], {"length": 1})
+        self.cache.put(keys[1], {"length": 1})
+        self.cache.get(keys[0])
+        self.cache.put(keys[2], {"length": 1})
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.get(keys[1]), None)
+        self.assertEqual(self.cache.get(keys[0]), {"length": 1})
+
+    def test_displayed(self):
+        # The conditions prefetched for the items of a folder are still used
+        # once the file manager has shown them, which only checks statuses
+        cache = ConditionsCache(repository=self.roots.get)
+        paths = ["/repo/a/%d" % index for index in range(3)]
+        for path in paths:
+            cache.put(cache.key([path]), {"is_git": True})
+
+        for path in paths:
+            self.assertEqual(cache.get(cache.key([path])), {"is_git": True})
+
+        # Until the checker reports that one of them changed
+        cache.invalidate(paths[2])
+        self.assertEqual(cache.get(cache.key([paths[0]])), None)
+
+    def test_pending(self):
+        key = self.cache.key(["/repo/a/file"])
+        self.assertTrue(self.cache.begin(key))
+        self.assertFalse(self.cache.begin(key))
+
+        # A failed request is not kept, and may be made again
+        self.cache.put(key, {})
+        self.assertEqual(self.cache.get(key), None)
+        self.assertTrue(self.cache.begin(key))
+
+
+if __name__ == "__main__":
+    unittest.main()
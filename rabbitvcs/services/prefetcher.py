@@ -0,0 +1,293 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Speculative checks of the folders likely to be shown next.
+
+When a file manager shows a folder, the checker service queues, at the lowest
+priority, the checks it would be asked for if the user opened one of the
+folders in it, or went back to a folder next to it that was shown recently.
+They are made under the same keys as the checks of the extensions, so a
+request for something that is still waiting to be prefetched is merged with
+it and promoted.  Only a few requests are queued at a time, none while the
+machine is busy, and those still waiting are cancelled as soon as another
+folder is shown.
+"""
+
+from __future__ import absolute_import
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from collections import deque
+
+from rabbitvcs.services.scheduler import PRIORITY_PREFETCH
+
+# The most folders prefetched for a folder that is shown, the most items
+# checked in each of them, and the number of folders shown recently that are
+# remembered
+MAX_FOLDERS = 16
+MAX_ENTRIES = 256
+MAX_HISTORY = 32
+
+# Prefetch requests are made on behalf of this group, which clients cannot
+# name since theirs are strings
+GROUP = ("prefetch",)
+
+
+def entries(folder, max_entries=MAX_ENTRIES):
+    """
+    Returns the paths of the items in a folder that a file manager shows by
+    default, i.e. not the hidden ones, such as the administrative folders.
+
+    """
+    names = sorted(name for name in os.listdir(folder) if not name.startswith("."))
+    return [os.path.join(folder, name) for name in names[:max_entries]]
+
+
+def overloaded():
+    """
+    Returns True if there are more processes waiting to run than there are
+    processors.
+
+    """
+    try:
+        return os.getloadavg()[0] >= multiprocessing.cpu_count()
+    except (OSError, AttributeError, NotImplementedError):
+        return False
+
+
+class Prefetcher(object):
+    def __init__(
+        self,
+        scheduler,
+        requests,
+        repository,
+        queued=4,
+        max_folders=MAX_FOLDERS,
+        overloaded=overloaded,
+    ):
+        """
+        @type   scheduler: Scheduler
+        @param  scheduler: The queue of the checker service
+
+        @type   requests: callable
+        @param  requests: Called with a folder, returns the (key, work, lane)
+            of each request that warms the caches for it
+
+        @type   repository: callable
+        @param  repository: Called with a folder, returns the root of the
+            working copy it is in, or None
+
+        @type   queued: integer
+        @param  queued: The most prefetch requests waiting or running at once
+
+        @type   max_folders: integer
+        @param  max_folders: The most folders prefetched for a folder shown
+
+        @type   overloaded: callable
+        @param  overloaded: Returns True while nothing should be prefetched
+
+        """
+        self.scheduler = scheduler
+        self.requests = requests
+        self.repository = repository
+        self.queued = queued
+        self.max_folders = max_folders
+        self.overloaded = overloaded
+
+        # The folders shown recently, most recent last
+        self.history = deque(maxlen=MAX_HISTORY)
+
+        # The folders still to prefetch, and the requests of the current one
+        self.folders = deque()
+        self.waiting = deque()
+
+        # The number of requests submitted that have not completed yet
+        self.outstanding = 0
+
+    def visit(self, folder):
+        """
+        Called when a folder is shown.  What was being prefetched for the
+        folder shown before is dropped, and the immediate subfolders of this
+        one, then the folders next to it shown recently, are prefetched.
+
+        """
+        # File managers ask for the menus of a folder more than once
+        if self.history and self.history[-1] == folder and self.outstanding:
+            return
+
+        self.folders.clear()
+        self.waiting.clear()
+        self.scheduler.cancel(GROUP)
+
+        parent = os.path.dirname(folder)
+        siblings = [
+            visited
+            for visited in reversed(self.history)
+            if visited != folder and os.path.dirname(visited) == parent
+        ]
+        if folder in self.history:
+            self.history.remove(folder)
+        self.history.append(folder)
+
+        try:
+            subfolders = [path for path in entries(folder) if os.path.isdir(path)]
+        except OSError:
+            subfolders = []
+
+        self.folders.extend((subfolders + siblings)[: self.max_folders])
+        self.fill()
+
+    def fill(self):
+        """
+        Submits requests until as many as allowed are outstanding.  Nothing
+        more is prefetched for this folder once the machine is busy.
+
+        """
+        while self.outstanding < self.queued:
+            request = self.next_request()
+            if request is None:
+                return
+
+            if self.overloaded():
+                self.folders.clear()
+                self.waiting.clear()
+                return
+
+            key, work, lane = request
+            self.outstanding += 1
+            self.scheduler.submit(
+                key, work, self.done, self.done, PRIORITY_PREFETCH, GROUP, lane
+            )
+
+    def next_request(self):
+        while not self.waiting:
+            if not self.folders:
+                return None
+
+            folder = self.folders.popleft()
+            if self.repository(folder) is None:
+                continue
+
+            try:
+                self.waiting.extend(self.requests(folder))
+            except OSError:
+                # The folder is gone, or cannot be read
+                continue
+
+        return self.waiting.popleft()
+
+    def done(self, result):
+        """
+        Called when a request completed, failed or was cancelled.
+
+        """
+        self.outstanding -= 1
+        self.fill()
+
+
+class FakeScheduler(object):
+    def __init__(self):
+        self.submitted = []
+        self.cancelled = []
+
+    def submit(self, key, work, callback, error_callback, priority, group, lane):
+        self.submitted.append((key, callback, error_callback))
+
+    def cancel(self, group):
+        self.cancelled.append(group)
+        submitted = self.submitted
+        self.submitted = []
+        for key, callback, error_callback in submitted:
+            error_callback(Exception("cancelled"))
+
+
+class TestPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.top = tempfile.mkdtemp()
+        for folder in ["a", "b", "c", os.path.join("b", "d"), ".git"]:
+            os.mkdir(os.path.join(self.top, folder))
+        for name in [("a", "file"), ("a", ".hidden"), ("b", "d", "file")]:
+            open(os.path.join(self.top, *name), "w").close()
+
+        self.busy = False
+        self.scheduler = FakeScheduler()
+        self.prefetcher = Prefetcher(
+            self.scheduler,
+            lambda folder: [(path, None, None) for path in entries(folder)],
+            lambda folder: self.top,
+            queued=2,
+            overloaded=lambda: self.busy,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.top)
+
+    def path(self, *names):
+        return os.path.join(self.top, *names)
+
+    def complete(self):
+        keys = []
+        while self.scheduler.submitted:
+            key, callback, error_callback = self.scheduler.submitted.pop(0)
+            keys.append(key)
+            callback(None)
+        return keys
+
+    def test_subfolders(self):
+        self.prefetcher.visit(self.top)
+        self.assertEqual(len(self.scheduler.submitted), 2)
+        self.assertEqual(self.complete(), [self.path("a", "file"), self.path("b", "d")])
+        self.assertEqual(self.prefetcher.outstanding, 0)
+
+    def test_siblings(self):
+        self.prefetcher.visit(self.path("a"))
+        self.prefetcher.visit(self.path("c"))
+        self.prefetcher.visit(self.path("b"))
+        self.assertEqual(self.scheduler.cancelled, [GROUP] * 3)
+
+        # The subfolder first, then the folders next to it, most recent first
+        self.assertEqual(
+            self.complete(), [self.path("b", "d", "file"), self.path("a", "file")]
+        )
+
+    def test_cancel(self):
+        self.prefetcher.visit(self.top)
+        self.prefetcher.visit(self.top)
+        self.assertEqual(self.scheduler.cancelled, [GROUP])
+
+        self.prefetcher.visit(self.path("b", "d"))
+        self.assertEqual(self.scheduler.submitted, [])
+        self.assertEqual(self.prefetcher.outstanding, 0)
+
+    def test_overloaded(self):
+        self.busy = True
+        self.prefetcher.visit(self.top)
+        self.assertEqual(self.scheduler.submitted, [])
+        self.assertEqual(len(self.prefetcher.folders), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
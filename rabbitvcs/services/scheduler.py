@@ -0,0 +1,474 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Request scheduling for the checker service.
+
+Status checks and menu conditions are run on worker threads, most urgent
+first, so that a deep recursive check does not hold up the items the user is
+looking at.  Requests for the same thing that are still waiting are merged,
+and requests made on behalf of a group (usually the folder being shown) can be
+cancelled together once they no longer matter.
+
+Every request belongs to a lane, the repository it is about.  The requests of
+a lane are run one at a time, since the backend clients are not thread safe,
+while the lanes themselves are shared out among the workers.  A slow
+repository thus only holds up one worker.
+"""
+
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import threading
+import time
+import unittest
+
+from rabbitvcs.util.log import Log
+
+log = Log("rabbitvcs.services.scheduler")
+
+# Priority classes, most urgent first.  Invalidations are only scheduled by
+# the service itself, so that they run before any check queued after them.
+PRIORITY_INVALIDATE = "invalidate"
+PRIORITY_MENU = "menu"
+PRIORITY_VISIBLE = "visible"
+PRIORITY_PREFETCH = "prefetch"
+
+PRIORITIES = [PRIORITY_INVALIDATE, PRIORITY_MENU, PRIORITY_VISIBLE, PRIORITY_PREFETCH]
+
+RANKS = dict((priority, rank) for rank, priority in enumerate(PRIORITIES))
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class Request(object):
+    def __init__(self, key, work, priority, lane):
+        self.key = key
+        self.work = work
+        self.priority = priority
+        self.lane = lane
+        self.queued = time.time()
+
+        # (group, callback, error_callback) for everyone waiting on the result
+        self.waiters = []
+
+
+class Scheduler(object):
+    def __init__(self, deliver=None, workers=1, limits=None):
+        """
+        @type   deliver: callable
+        @param  deliver: Called with a callback and its arguments to hand a
+            result over, e.g. GLib.idle_add to call it on the main loop.  By
+            default callbacks are called on the worker thread.
+
+        @type   workers: integer
+        @param  workers: The number of worker threads
+
+        @type   limits: dict
+        @param  limits: Priority class -> the most workers that may run its
+            requests at once, so that the others are free for more urgent ones
+
+        """
+        self.deliver = deliver or (lambda func, *args: func(*args))
+        self.workers = max(1, workers)
+        self.limits = limits or {}
+
+        # Lane -> heap of (rank, sequence, request).  When a request is
+        # promoted it is pushed again, and the outdated entry is skipped.
+        self.lanes = {}
+        self.sequence = itertools.count()
+
+        # Lanes a worker is running a request of, and the number of requests
+        # of each priority class running
+        self.busy = set()
+        self.active = dict((priority, 0) for priority in PRIORITIES)
+
+        # Key -> the request waiting to run for it
+        self.pending = {}
+
+        self.condition = threading.Condition()
+        self.running = False
+        self.threads = []
+
+        self.stats = dict(
+            (
+                priority,
+                {"completed": 0, "cancelled": 0, "wait_total": 0.0, "wait_max": 0.0},
+            )
+            for priority in PRIORITIES
+        )
+
+    def start(self):
+        self.running = True
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.run, name="Scheduler-%d" % index)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def quit(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def submit(
+        self,
+        key,
+        work,
+        callback,
+        error_callback=None,
+        priority=PRIORITY_VISIBLE,
+        group=None,
+        lane=None,
+    ):
+        """
+        Queues work to be run on a worker thread.  If a request with the same
+        key is still waiting, the callbacks are added to it instead, and it is
+        promoted if this priority is more urgent.
+
+        @type   key: hashable
+        @param  key: Identifies what is computed, e.g. the path and options
+
+        @type   work: callable
+        @param  work: Called without arguments, returns the result
+
+        @type   callback: callable
+        @param  callback: Called with the result
+
+        @type   error_callback: callable
+        @param  error_callback: Called with the exception if the work failed
+            or the request was cancelled
+
+        @type   group: string
+        @param  group: Requests of a group can be cancelled together
+
+        @type   lane: hashable
+        @param  lane: Requests of a lane are never run at the same time, e.g.
+            the root of the repository the work is about
+
+        """
+        with self.condition:
+            request = self.pending.get(key)
+            if request is None:
+                request = Request(key, work, priority, lane)
+                self.pending[key] = request
+                self._push(request)
+            elif RANKS[priority] < RANKS[request.priority]:
+                request.priority = priority
+                self._push(request)
+
+            request.waiters.append((group, callback, error_callback))
+            self.condition.notify()
+
+    def _push(self, request):
+        heapq.heappush(
+            self.lanes.setdefault(request.lane, []),
+            (RANKS[request.priority], next(self.sequence), request),
+        )
+
+    def _peek(self, lane):
+        # Drop the entries of requests that were promoted, run or cancelled
+        queue = self.lanes[lane]
+        while queue:
+            rank, sequence, request = queue[0]
+            if (
+                self.pending.get(request.key) is request
+                and RANKS[request.priority] == rank
+            ):
+                return queue[0]
+            heapq.heappop(queue)
+
+        del self.lanes[lane]
+        return None
+
+    def cancel(self, group):
+        """
+        Cancels the requests made for a group that have not started yet.
+        Their error callbacks are called with RequestCancelled.  Returns the
+        number of callbacks cancelled.
+
+        """
+        cancelled = []
+        with self.condition:
+            for key, request in list(self.pending.items()):
+                waiters = [waiter for waiter in request.waiters if waiter[0] != group]
+                if len(waiters) == len(request.waiters):
+                    continue
+
+                cancelled += [
+                    waiter for waiter in request.waiters if waiter[0] == group
+                ]
+                request.waiters = waiters
+                if not waiters:
+                    del self.pending[key]
+                    self.stats[request.priority]["cancelled"] += 1
+
+        for group, callback, error_callback in cancelled:
+            if error_callback:
+                self.deliver(error_callback, RequestCancelled(group))
+
+        return len(cancelled)
+
+    def _next(self):
+        with self.condition:
+            while self.running:
+                # The most urgent request of the lanes no one is working on
+                best = None
+                for lane in list(self.lanes.keys()):
+                    if lane in self.busy:
+                        continue
+                    entry = self._peek(lane)
+                    if entry is None or self._limited(entry[2].priority):
+                        continue
+                    if best is None or entry < best:
+                        best = entry
+
+                if best is not None:
+                    request = best[2]
+                    heapq.heappop(self.lanes[request.lane])
+                    del self.pending[request.key]
+                    self.busy.add(request.lane)
+                    self.active[request.priority] += 1
+                    return request
+
+                self.condition.wait()
+
+        return None
+
+    def _limited(self, priority):
+        limit = self.limits.get(priority)
+        return limit is not None and self.active[priority] >= limit
+
+    def run(self):
+        while True:
+            request = self._next()
+            if request is None:
+                return
+
+            try:
+                self.execute(request)
+            finally:
+                with self.condition:
+                    self.busy.discard(request.lane)
+                    self.active[request.priority] -= 1
+                    self.condition.notify_all()
+
+    def execute(self, request):
+        wait = time.time() - request.queued
+
+        result = None
+        error = None
+        try:
+            result = request.work()
+        except Exception as e:
+            log.exception(e)
+            error = e
+
+        with self.condition:
+            stats = self.stats[request.priority]
+            stats["completed"] += 1
+            stats["wait_total"] += wait
+            stats["wait_max"] = max(stats["wait_max"], wait)
+
+        for group, callback, error_callback in request.waiters:
+            if error is None:
+                self.deliver(callback, result)
+            elif error_callback:
+                self.deliver(error_callback, error)
+
+    def statistics(self):
+        """
+        Returns, for each priority class, the number of requests waiting, the
+        age in seconds of the oldest one, the number completed and cancelled,
+        and the average and longest time completed requests waited.
+
+        """
+        now = time.time()
+        with self.condition:
+            statistics = {}
+            for priority in PRIORITIES:
+                stats = self.stats[priority]
+                statistics[priority] = {
+                    "queued": 0,
+                    "oldest": 0.0,
+                    "completed": stats["completed"],
+                    "cancelled": stats["cancelled"],
+                    "wait_average": stats["wait_total"] / (stats["completed"] or 1),
+                    "wait_max": stats["wait_max"],
+                }
+
+            for request in self.pending.values():
+                stats = statistics[request.priority]
+                stats["queued"] += 1
+                stats["oldest"] = max(stats["oldest"], now - request.queued)
+
+        return statistics
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.results = []
+        self.errors = []
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.scheduler.quit()
+
+    def block(self):
+        self.started.set()
+        self.release.wait()
+        return "blocker"
+
+    def submit(self, key, priority=PRIORITY_VISIBLE, group=None):
+        self.scheduler.submit(
+            key,
+            lambda: key,
+            self.results.append,
+            self.errors.append,
+            priority,
+            group,
+        )
+
+    def run_all(self):
+        # Keep the worker busy while requests are queued, then let it go
+        done = threading.Event()
+        self.scheduler.submit(
+            "done",
+            lambda: None,
+            lambda result: done.set(),
+            None,
+            PRIORITY_PREFETCH,
+            "done",
+        )
+        self.release.set()
+        done.wait(5)
+
+    def start_blocked(self):
+        self.scheduler.submit("blocker", self.block, self.results.append)
+        self.scheduler.start()
+        self.started.wait(5)
+
+    def test_priorities(self):
+        self.start_blocked()
+        self.submit("prefetch", PRIORITY_PREFETCH)
+        self.submit("visible", PRIORITY_VISIBLE)
+        self.submit("menu", PRIORITY_MENU)
+        self.run_all()
+        self.assertEqual(self.results, ["blocker", "menu", "visible", "prefetch"])
+
+    def test_merge(self):
+        self.start_blocked()
+        self.submit("a", PRIORITY_PREFETCH)
+        self.submit("b", PRIORITY_VISIBLE)
+        self.submit("a", PRIORITY_MENU)
+        self.assertEqual(len(self.scheduler), 2)
+        self.run_all()
+        self.assertEqual(self.results, ["blocker", "a", "a", "b"])
+
+    def test_cancel(self):
+        self.start_blocked()
+        self.submit("a", group="/old")
+        self.submit("b", group="/old")
+        self.submit("b", group="/new")
+        self.assertEqual(self.scheduler.cancel("/old"), 2)
+        self.assertEqual(len(self.errors), 2)
+        self.assertTrue(isinstance(self.errors[0], RequestCancelled))
+
+        stats = self.scheduler.statistics()
+        self.assertEqual(stats[PRIORITY_VISIBLE]["queued"], 1)
+        self.assertEqual(stats[PRIORITY_VISIBLE]["cancelled"], 1)
+
+        self.run_all()
+        self.assertEqual(self.results, ["blocker", "b"])
+
+    def test_lanes(self):
+        self.scheduler = Scheduler(workers=2)
+        self.scheduler.submit("blocker", self.block, self.results.append, lane="/a")
+        self.scheduler.start()
+        self.started.wait(5)
+
+        done = threading.Event()
+        self.scheduler.submit("a", lambda: "a", self.results.append, lane="/a")
+        self.scheduler.submit(
+            "b", lambda: "b", lambda result: done.set(), PRIORITY_PREFETCH, lane="/b"
+        )
+
+        # Another repository is not held up by the blocked one
+        self.assertTrue(done.wait(5))
+        self.assertEqual(self.results, [])
+
+        finished = threading.Event()
+        self.scheduler.submit(
+            "c", lambda: "c", lambda result: finished.set(), lane="/a"
+        )
+        self.release.set()
+        self.assertTrue(finished.wait(5))
+        self.assertEqual(self.results, ["blocker", "a"])
+
+    def test_limits(self):
+        self.scheduler = Scheduler(workers=2, limits={PRIORITY_PREFETCH: 1})
+        self.scheduler.submit(
+            "blocker",
+            self.block,
+            self.results.append,
+            None,
+            PRIORITY_PREFETCH,
+            lane="/a",
+        )
+        self.scheduler.start()
+        self.started.wait(5)
+
+        done = threading.Event()
+        self.scheduler.submit(
+            "b", lambda: "b", self.results.append, None, PRIORITY_PREFETCH, lane="/b"
+        )
+        self.scheduler.submit("c", lambda: "c", lambda result: done.set(), lane="/c")
+
+        # The free worker is kept for more urgent requests
+        self.assertTrue(done.wait(5))
+        self.assertEqual(self.results, [])
+
+        finished = threading.Event()
+        self.scheduler.submit(
+            "d",
+            lambda: "d",
+            lambda result: finished.set(),
+            None,
+            PRIORITY_PREFETCH,
+            lane="/b",
+        )
+        self.release.set()
+        self.assertTrue(finished.wait(5))
+        self.assertEqual(self.results, ["blocker", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -25,6 +25,7 @@ would be used from within a constructor.
 from __future__ import absolute_import
 
 import sys
+import select
 import subprocess
 
 import dbus
@@ -33,6 +34,9 @@ from rabbitvcs.util.log import Log
 
 log = Log("rabbitvcs.services.service")
 
+# How long (in seconds) to wait for a new service to tell us it is ready
+START_TIMEOUT = 30
+
 
 def start_service(script_file, dbus_service_name, dbus_object_path):
     """
@@ -49,7 +53,9 @@ def start_service(script_file, dbus_service_name, dbus_object_path):
     glib.idle_add(sys.stdout.flush)
     mainloop.run()
 
-    That way a newline will be sent when the mainloop is started.
+    That way a newline will be sent when the mainloop is started. A service
+    whose object is exported before it requests its name can send it as soon
+    as the name is owned instead, since calls wait until the mainloop runs.
 
     @param script_file: the Python script file to run if the DBUS object does
                         not already exist
@@ -79,8 +85,13 @@ def start_service(script_file, dbus_service_name, dbus_object_path):
         pid = proc.pid
         log.debug("Started process: %i" % pid)
 
-        # Wait for subprocess to send a newline, to tell us it's ready
-        proc.stdout.readline()  # We don't care what the message is
-        object_exists = True
+        # Wait for subprocess to send a newline, to tell us it owns the
+        # service name. We don't care what the message is, but if it exits or
+        # hangs before sending it, the caller should not wait any longer.
+        ready = select.select([proc.stdout], [], [], START_TIMEOUT)[0]
+        if ready and proc.stdout.readline():
+            object_exists = True
+        else:
+            log.warning("Service %s did not start" % dbus_service_name)
 
     return object_exists
@@ -21,9 +21,13 @@ to work, or you need to prototype things.
 """
 from __future__ import absolute_import
 from rabbitvcs.util.log import Log
+from rabbitvcs.util import helper
+from rabbitvcs.util.settings import SettingsManager
 
 import rabbitvcs.vcs
 import rabbitvcs.vcs.status
+from rabbitvcs.vcs.store import get_store
+from rabbitvcs.services.conditions import ConditionsCache
 
 from rabbitvcs import gettext
 
@@ -31,6 +35,8 @@ _ = gettext.gettext
 
 log = Log("rabbitvcs.services.statuschecker")
 
+settings = SettingsManager()
+
 
 class StatusChecker(object):
     """A class for performing status checks."""
@@ -42,28 +48,104 @@ class StatusChecker(object):
     def __init__(self):
         """Initialises status checker. Obviously."""
         self.vcs_client = rabbitvcs.vcs.create_vcs_instance()
-        self.conditions_dict_cache = {}
+
+        # The menu conditions of recent selections, until something in their
+        # repositories is invalidated
+        self.conditions_cache = ConditionsCache(
+            int(settings.get("checker", "max_cached_conditions")), self.repository
+        )
+
+        # The number of threads checks are run on. Each repository is only
+        # checked by one of them at a time, see repository().
+        self.workers = int(settings.get("checker", "workers"))
+
+        # Resident memory in KB above which the backend clients, and the
+        # statuses they cache, are let go (0 for no limit)
+        self.max_memory = int(settings.get("checker", "max_memory")) * 1024
+
+    def repository(self, path):
+        """Returns the root of the repository path belongs to, or None. This
+        decides which checks may run at the same time: the clients of a
+        repository are not thread safe, but different repositories have
+        different clients.
+        """
+        guess = self.vcs_client.guess(path)
+        if guess["vcs"] == rabbitvcs.vcs.VCS_DUMMY:
+            return None
+        return guess["repo_path"]
 
     def check_status(self, path, recurse, summary, invalidate):
-        """Performs a status check, blocking until the check is done."""
-        path_status = self.vcs_client.status(path, summary, invalidate)
+        """Performs a status check, blocking until the check is done. A
+        directory is summarised from everything under it if recurse is True,
+        or from the items directly in it otherwise.
+        """
+        if invalidate:
+            self.conditions_cache.invalidate(path, recurse)
+
+        depth = rabbitvcs.vcs.recurse_depth(recurse)
+        path_status = self.vcs_client.status(path, summary, invalidate, depth)
+        self.check_memory()
         return path_status
 
-    def generate_menu_conditions(self, paths, invalidate=False):
-        from rabbitvcs.util.contextmenu import MainContextMenuConditions
+    def unconfirmed(self):
+        """Returns the repositories whose statuses were loaded from the status
+        store and still need a rescan, see confirm().
+        """
+        store = get_store()
+        if store is None:
+            return set()
+        return store.take_unconfirmed()
 
-        conditions = MainContextMenuConditions(self.vcs_client, paths)
-        return conditions.path_dict
+    def confirm(self, root):
+        """Rescans a repository whose statuses were loaded from the status
+        store, to pick up changes made while the service was not running.
+        """
+        self.conditions_cache.invalidate(root, recurse=True)
+        self.vcs_client.invalidate(root, recurse=True)
+        self.vcs_client.status(root, summarize=True)
 
-    def extra_info(self):
-        return None
+    def check_memory(self):
+        """Lets go of the cached statuses if the memory limit is exceeded."""
+        if self.max_memory and helper.process_resident_memory() > self.max_memory:
+            log.debug("Memory limit exceeded, releasing the backend clients")
+            self.vcs_client.release_clients()
+
+    def invalidate(self, path, recurse=False):
+        """Forgets any cached status information for the given path."""
+        self.conditions_cache.invalidate(path, recurse)
+        self.vcs_client.invalidate(path, recurse)
 
-    def get_memory_usage(self):
-        """Returns any additional memory of any subprocesses used by this
-        checker. In other words, DO NOT return the memory usage of THIS process!
+    def generate_menu_conditions(self, paths, invalidate=False):
+        """Returns the menu conditions of the selected paths, which are kept
+        until something in their repositories is invalidated. If invalidate
+        is True, they are worked out again from fresh statuses.
         """
-        return 0
+        if invalidate:
+            for path in paths:
+                self.invalidate(path)
+
+        # Taken before the conditions are worked out, so that an invalidation
+        # in the meantime keeps them from being used
+        key = self.conditions_cache.key(paths)
+        path_dict = self.conditions_cache.get(key)
+        if path_dict is None:
+            from rabbitvcs.util.contextmenu import MainContextMenuConditions
+
+            conditions = MainContextMenuConditions(self.vcs_client, paths)
+            path_dict = conditions.path_dict
+            self.conditions_cache.put(key, path_dict)
+
+        return path_dict
+
+    def extra_info(self):
+        return [
+            (_("Workers"), str(self.workers)),
+            (_("Repositories"), str(self.vcs_client.client_count())),
+        ]
 
     def quit(self):
-        # We will exit when the main process does
-        pass
+        # We will exit when the main process does, but write the statuses
+        # the store holds back first
+        store = get_store()
+        if store is not None:
+            store.close()
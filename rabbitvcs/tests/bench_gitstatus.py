@@ -0,0 +1,136 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmark comparing the git status engines on synthetic repositories.
+
+Usage: python bench_gitstatus.py [number of files] [number of folders]
+
+For each index layout (version 2, version 4 and split index) a repository is
+created with the given number of committed files, a few of which are then
+modified, and some untracked and ignored files are added.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+from os.path import normpath, join, dirname, abspath
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+toplevel = normpath(join(dirname(abspath(__file__)), "..", ".."))
+sys.path.insert(0, toplevel)
+
+from rabbitvcs.vcs.git.gittyup.client import GittyupClient
+
+LAYOUTS = [
+    ("index v2", ["--index-version", "2"]),
+    ("index v4", ["--index-version", "4"]),
+    ("split index", ["--split-index"]),
+]
+
+
+def git(path, *args):
+    subprocess.check_call(
+        ["git", "-c", "user.name=bench", "-c", "user.email=bench@bench"] + list(args),
+        cwd=path,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def make_repository(path, file_count, folder_count, update_index):
+    os.makedirs(path)
+    git(path, "init", "-q")
+    with open(join(path, ".gitignore"), "w") as f:
+        f.write("*.o\nbuild/\n")
+
+    for index in range(file_count):
+        folder = join(path, "folder%04d" % (index % folder_count))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(join(folder, "file%06d.txt" % index), "w") as f:
+            f.write("file %d\n" % index)
+
+    git(path, "add", ".")
+    git(path, "commit", "-qm", "Synthetic repository")
+    git(path, "update-index", *update_index)
+
+    # Change one file in a hundred, and add untracked and ignored files
+    for index in range(0, file_count, 100):
+        folder = join(path, "folder%04d" % (index % folder_count))
+        with open(join(folder, "file%06d.txt" % index), "a") as f:
+            f.write("changed\n")
+        open(join(folder, "untracked%06d.txt" % index), "w").close()
+        open(join(folder, "object%06d.o" % index), "w").close()
+
+    os.makedirs(join(path, "build"))
+    open(join(path, "build", "output"), "w").close()
+
+
+def benchmark(client, path, engine, repeat=3):
+    best = None
+    for attempt in range(repeat):
+        start = time.time()
+        client.ignored_paths = []
+        statuses = client.status(path, engine)
+        elapsed = time.time() - start
+        best = min(best or elapsed, elapsed)
+
+    return (best, sorted((st.path, st.identifier) for st in statuses))
+
+
+if __name__ == "__main__":
+    file_count = 20000
+    folder_count = 200
+    if len(sys.argv) > 1:
+        file_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        folder_count = int(sys.argv[2])
+
+    workdir = tempfile.mkdtemp(prefix="rabbitvcs-bench-")
+    try:
+        print("%d files in %d folders" % (file_count, folder_count))
+        for name, update_index in LAYOUTS:
+            path = join(workdir, name.replace(" ", "-"))
+            make_repository(path, file_count, folder_count, update_index)
+            client = GittyupClient(path)
+
+            porcelain_time, porcelain = benchmark(client, path, "porcelain")
+            native_time, native = benchmark(client, path, "native")
+
+            print(
+                "%-12s porcelain %8.1f ms  native %8.1f ms  %s"
+                % (
+                    name,
+                    porcelain_time * 1000,
+                    native_time * 1000,
+                    porcelain == native and "same results" or "RESULTS DIFFER",
+                )
+            )
+            client.repo.close()
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,106 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Benchmark of the menu conditions worked out for a selection of files.
+
+Usage: python bench_menuconditions.py [number of files]
+
+A git repository is created with the given number of committed files in one
+folder (2,000 by default, "select all" in a generated folder may well be ten
+times that), a few of which are then modified, and all of them are selected.
+The first run of the conditions scans the folder, the following ones are
+answered from the status snapshot.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+from os.path import normpath, join, dirname, abspath
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+toplevel = normpath(join(dirname(abspath(__file__)), "..", ".."))
+sys.path.insert(0, toplevel)
+
+import rabbitvcs.vcs
+from rabbitvcs.util.contextmenu import MainContextMenuConditions
+
+
+def git(path, *args):
+    # No garbage collection in the background, it would get in the way of
+    # removing the repository
+    options = ["-c", "user.name=bench", "-c", "user.email=bench@bench"]
+    options += ["-c", "gc.auto=0"]
+    subprocess.check_call(
+        ["git"] + options + list(args), cwd=path, stdout=subprocess.DEVNULL
+    )
+
+
+def make_repository(path, file_count):
+    folder = join(path, "folder")
+    os.makedirs(folder)
+    git(path, "init", "-q")
+
+    paths = []
+    for index in range(file_count):
+        paths.append(join(folder, "file%06d.txt" % index))
+        with open(paths[-1], "w") as f:
+            f.write("file %d\n" % index)
+
+    git(path, "add", ".")
+    git(path, "commit", "-qm", "Synthetic repository")
+
+    # Change one file in a hundred
+    for index in range(0, file_count, 100):
+        with open(paths[index], "a") as f:
+            f.write("changed\n")
+
+    return paths
+
+
+if __name__ == "__main__":
+    file_count = 2000
+    if len(sys.argv) > 1:
+        file_count = int(sys.argv[1])
+
+    workdir = tempfile.mkdtemp(prefix="rabbitvcs-bench-")
+    try:
+        paths = make_repository(os.path.realpath(workdir), file_count)
+        vcs = rabbitvcs.vcs.create_vcs_instance()
+
+        print("%d selected files" % file_count)
+        for run in ("first", "second", "third"):
+            start = time.time()
+            conditions = MainContextMenuConditions(vcs, paths)
+            elapsed = time.time() - start
+
+            print(
+                "%-8s %8.1f ms  modified: %s"
+                % (run, elapsed * 1000, conditions.path_dict["has_modified"])
+            )
+    finally:
+        shutil.rmtree(workdir)
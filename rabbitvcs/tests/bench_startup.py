@@ -0,0 +1,143 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmark of the cold start of the checker service.
+
+Usage: python bench_startup.py [number of runs] [path]
+
+Each stage is run in a fresh interpreter: importing what the file manager
+extensions need to talk to the service, starting the service (without a bus),
+and the first status check of a path (this working copy by default), which is
+when the backend for its repository is imported.  The time spent in the
+stage and the whole run, and the backend modules loaded, are reported.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+from os.path import normpath, join, dirname, abspath
+import json
+import os
+import subprocess
+import sys
+import time
+
+toplevel = normpath(join(dirname(abspath(__file__)), "..", ".."))
+
+BACKEND_MODULES = (
+    "pysvn",
+    "dulwich",
+    "mercurial",
+    "rabbitvcs.vcs.svn",
+    "rabbitvcs.vcs.git",
+    "rabbitvcs.vcs.mercurial",
+)
+
+STAGES = [
+    (
+        "extension imports",
+        "import rabbitvcs.vcs\n"
+        "from rabbitvcs.services.checkerservice import StatusCheckerStub\n",
+    ),
+    (
+        "service start",
+        "import rabbitvcs.services.checkerservice as cs\n"
+        "cs.StatusCheckerService(None, None)\n",
+    ),
+    (
+        "first status",
+        "import rabbitvcs.services.checkerservice as cs\n"
+        "service = cs.StatusCheckerService(None, None)\n"
+        "service.status_checker.check_status(PATH, False, True, False)\n",
+    ),
+]
+
+RUNNER = """
+import sys, time, json
+started = time.time()
+PATH = %r
+%s
+elapsed = time.time() - started
+backends = sorted(name for name in %r if name in sys.modules)
+print(json.dumps({"elapsed": elapsed, "backends": backends}))
+"""
+
+
+def run_stage(code, path):
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [toplevel] + [p for p in [environment.get("PYTHONPATH")] if p]
+    )
+
+    started = time.time()
+    output = subprocess.check_output(
+        [sys.executable, "-c", RUNNER % (path, code, BACKEND_MODULES)],
+        env=environment,
+    )
+    total = time.time() - started
+
+    result = json.loads(output.decode("utf-8").splitlines()[-1])
+    return total, result["elapsed"], result["backends"]
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    runs = 5
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+
+    path = toplevel
+    if len(sys.argv) > 2:
+        path = abspath(sys.argv[2])
+
+    print("%d runs, first status of %s" % (runs, path))
+    print(
+        "%-20s %12s %12s  %s"
+        % ("stage", "stage (ms)", "process (ms)", "backends loaded")
+    )
+    for name, code in STAGES:
+        totals = []
+        stages = []
+        for index in range(runs):
+            total, elapsed, backends = run_stage(code, path)
+            totals.append(total)
+            stages.append(elapsed)
+
+        print(
+            "%-20s %12.1f %12.1f  %s"
+            % (
+                name,
+                median(stages) * 1000,
+                median(totals) * 1000,
+                ", ".join(backends) or "none",
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Micro-benchmark comparing the status encodings used between the checker
+service and its clients.
+
+Usage: python bench_statuscodec.py [number of statuses]
+
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+from os.path import normpath, join, dirname, abspath
+import sys
+import time
+
+toplevel = normpath(join(dirname(abspath(__file__)), "..", ".."))
+sys.path.insert(0, toplevel)
+
+import rabbitvcs.vcs.status
+from rabbitvcs.vcs.statuscodec import (
+    encode_statuses,
+    decode_statuses,
+    ENCODING_JSON,
+    ENCODING_COMPACT,
+)
+
+AUTHORS = ["adam", "bruce", "jason", "sjp", "nobody"]
+CONTENT = ["normal", "modified", "added", "unversioned", "ignored"]
+
+
+def make_statuses(count):
+    statuses = []
+    for index in range(count):
+        status = rabbitvcs.vcs.status.Status(
+            "/home/user/src/project/module%03d/file%06d.py" % (index % 500, index),
+            CONTENT[index % len(CONTENT)],
+            "normal",
+            summary=CONTENT[index % len(CONTENT)],
+            revision=1000 + index % 250,
+            author=AUTHORS[index % len(AUTHORS)],
+            date=1300000000 + index % 250,
+        )
+        if index % 2:
+            status.__class__ = rabbitvcs.vcs.status.SVNStatus
+        else:
+            status.__class__ = rabbitvcs.vcs.status.GitStatus
+        statuses.append(status)
+
+    return statuses
+
+
+def benchmark(statuses, encoding, repeat=3):
+    best_encode = best_decode = None
+    for attempt in range(repeat):
+        start = time.time()
+        data = encode_statuses(statuses, encoding)
+        encode_time = time.time() - start
+
+        start = time.time()
+        decoded = decode_statuses(data, encoding)
+        decode_time = time.time() - start
+
+        assert len(decoded) == len(statuses)
+
+        best_encode = min(best_encode or encode_time, encode_time)
+        best_decode = min(best_decode or decode_time, decode_time)
+
+    print(
+        "%-10s encode %8.1f ms  decode %8.1f ms  size %10d bytes"
+        % (encoding, best_encode * 1000, best_decode * 1000, len(data))
+    )
+
+
+if __name__ == "__main__":
+    count = 100000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    statuses = make_statuses(count)
+    print("%d statuses" % count)
+    for encoding in (ENCODING_JSON, ENCODING_COMPACT):
+        benchmark(statuses, encoding)
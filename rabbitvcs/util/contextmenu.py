@@ -25,6 +25,10 @@ from __future__ import print_function
 
 import os
 import os.path
+import shutil
+import stat
+import tempfile
+import unittest
 from time import sleep
 from collections import deque
 from six.moves import range
@@ -619,6 +623,77 @@ class ContextMenuCallbacks(object):
         self.caller.rescan_after_process_exit(proc, [self.paths[0]])
 
 
+# The conditions ContextMenuConditions.generate_path_dict() works out for the
+# selected paths, each one a bit of the masks they are worked out with
+PATH_CONDITIONS = (
+    "is_svn",
+    "is_git",
+    "is_mercurial",
+    "is_dir",
+    "is_file",
+    "exists",
+    "is_working_copy",
+    "is_in_a_or_a_working_copy",
+    "is_versioned",
+    "is_normal",
+    "is_added",
+    "is_modified",
+    "is_deleted",
+    "is_ignored",
+    "is_locked",
+    "is_missing",
+    "is_conflicted",
+    "is_obstructed",
+    "has_unversioned",
+    "has_added",
+    "has_modified",
+    "has_deleted",
+    "has_ignored",
+    "has_missing",
+    "has_conflicted",
+    "has_obstructed",
+)
+
+CONDITION_BITS = dict((key, 1 << index) for index, key in enumerate(PATH_CONDITIONS))
+
+
+def condition_mask(*keys):
+    mask = 0
+    for key in keys:
+        mask |= CONDITION_BITS[key]
+    return mask
+
+
+VCS_CONDITIONS = {
+    VCS_SVN: condition_mask("is_svn"),
+    VCS_GIT: condition_mask("is_git"),
+    VCS_MERCURIAL: condition_mask("is_mercurial"),
+}
+
+# The conditions met by a selected item with a given content status, and by
+# a selection with such an item in it or under it
+CONTENT_CONDITIONS = {
+    "added": condition_mask("is_added"),
+    "modified": condition_mask("is_modified"),
+    "deleted": condition_mask("is_deleted"),
+    "ignored": condition_mask("is_ignored"),
+    "missing": condition_mask("is_missing"),
+    "complicated": condition_mask("is_conflicted"),
+    "obstructed": condition_mask("is_obstructed"),
+}
+
+CONTAINED_CONDITIONS = {
+    "unversioned": condition_mask("has_unversioned"),
+    "added": condition_mask("has_added"),
+    "modified": condition_mask("has_modified"),
+    "deleted": condition_mask("has_deleted"),
+    "ignored": condition_mask("has_ignored"),
+    "missing": condition_mask("has_missing"),
+    "complicated": condition_mask("has_conflicted"),
+    "obstructed": condition_mask("has_obstructed"),
+}
+
+
 class ContextMenuConditions(object):
     """
     Provides a standard interface to checking conditions for menu items.
@@ -632,62 +707,85 @@ class ContextMenuConditions(object):
     def __init__(self):
         pass
 
+    def read_statuses(self, statuses):
+        """
+        Keeps the statuses generate_statuses() looked up, along with the sets
+        of content and metadata statuses among them.
+
+        """
+        self.statuses = {}
+        for status in statuses:
+            self.statuses[status.path] = status
+
+        self.text_statuses = set()
+        self.prop_statuses = set()
+        for status in self.statuses.values():
+            self.text_statuses.add(status.simple_content_status())
+            self.prop_statuses.add(status.simple_metadata_status())
+
     def generate_path_dict(self, paths):
-        self.path_dict = {"length": len(paths)}
+        """
+        Works out the conditions of the selection.  The has_* conditions
+        cover the statuses of everything selected and under it, while the
+        conditions of a single item are those of the last path selected.
 
-        checks = {
-            "is_svn": lambda path: (self.vcs_client.guess(path)["vcs"] == VCS_SVN),
-            "is_git": lambda path: (self.vcs_client.guess(path)["vcs"] == VCS_GIT),
-            "is_mercurial": lambda path: (
-                self.vcs_client.guess(path)["vcs"] == VCS_MERCURIAL
-            ),
-            "is_dir": os.path.isdir,
-            "is_file": os.path.isfile,
-            "exists": os.path.exists,
-            "is_working_copy": self.vcs_client.is_working_copy,
-            "is_in_a_or_a_working_copy": self.vcs_client.is_in_a_or_a_working_copy,
-            "is_versioned": self.vcs_client.is_versioned,
-            "is_normal": lambda path: self.statuses[path].simple_content_status()
-            == "unchanged"
-            and self.statuses[path].simple_metadata_status() == "normal",
-            "is_added": lambda path: self.statuses[path].simple_content_status()
-            == "added",
-            "is_modified": lambda path: self.statuses[path].simple_content_status()
-            == "modified"
-            or self.statuses[path].simple_metadata_status() == "modified",
-            "is_deleted": lambda path: self.statuses[path].simple_content_status()
-            == "deleted",
-            "is_ignored": lambda path: self.statuses[path].simple_content_status()
-            == "ignored",
-            "is_locked": self.vcs_client.is_locked,
-            "is_missing": lambda path: self.statuses[path].simple_content_status()
-            == "missing",
-            "is_conflicted": lambda path: self.statuses[path].simple_content_status()
-            == "complicated",
-            "is_obstructed": lambda path: self.statuses[path].simple_content_status()
-            == "obstructed",
-            "has_unversioned": lambda path: "unversioned" in self.text_statuses,
-            "has_added": lambda path: "added" in self.text_statuses,
-            "has_modified": lambda path: "modified" in self.text_statuses
-            or "modified" in self.prop_statuses,
-            "has_deleted": lambda path: "deleted" in self.text_statuses,
-            "has_ignored": lambda path: "ignored" in self.text_statuses,
-            "has_missing": lambda path: "missing" in self.text_statuses,
-            "has_conflicted": lambda path: "complicated" in self.text_statuses,
-            "has_obstructed": lambda path: "obstructed" in self.text_statuses,
-        }
-
-        for key, func in list(checks.items()):
-            self.path_dict[key] = False
-
-        # Each path gets tested for each check
-        # If a check has returned True for any path, skip it for remaining paths
-        for path in paths:
-            for key, func in list(checks.items()):
-                try:
-                    self.path_dict[key] = func(path)
-                except KeyError as e:
-                    self.path_dict[key] = False
+        """
+        mask = 0
+        if paths:
+            for content in self.text_statuses:
+                mask |= CONTAINED_CONDITIONS.get(content, 0)
+            if "modified" in self.prop_statuses:
+                mask |= CONTAINED_CONDITIONS["modified"]
+            mask |= self.path_mask(paths[-1])
+
+        self.path_dict = dict(
+            (key, bool(mask & bit)) for key, bit in CONDITION_BITS.items()
+        )
+        self.path_dict["length"] = len(paths)
+
+    def path_mask(self, path):
+        """
+        Returns the mask of the conditions a single path meets.
+
+        """
+        try:
+            mode = os.stat(path).st_mode
+        except OSError:
+            mode = None
+
+        mask = 0
+        if mode is not None:
+            mask |= CONDITION_BITS["exists"]
+            if stat.S_ISDIR(mode):
+                mask |= CONDITION_BITS["is_dir"]
+            elif stat.S_ISREG(mode):
+                mask |= CONDITION_BITS["is_file"]
+
+        mask |= VCS_CONDITIONS.get(self.vcs_client.guess(path)["vcs"], 0)
+
+        status = self.statuses.get(path)
+        if status is not None:
+            content = status.simple_content_status()
+            metadata = status.simple_metadata_status()
+            mask |= CONTENT_CONDITIONS.get(content, 0)
+            if metadata == "modified":
+                mask |= CONDITION_BITS["is_modified"]
+            elif content == "unchanged" and metadata == "normal":
+                mask |= CONDITION_BITS["is_normal"]
+
+        # Asked of the client of the working copy rather than worked out from
+        # the status, e.g. Subversion does not count ignored items as versioned
+        checks = (
+            ("is_working_copy", self.vcs_client.is_working_copy),
+            ("is_in_a_or_a_working_copy", self.vcs_client.is_in_a_or_a_working_copy),
+            ("is_versioned", self.vcs_client.is_versioned),
+            ("is_locked", self.vcs_client.is_locked),
+        )
+        for key, check in checks:
+            if check(path):
+                mask |= CONDITION_BITS[key]
+
+        return mask
 
     def checkout(self, data=None):
         if self.path_dict["length"] == 1:
@@ -1188,23 +1286,7 @@ class GtkFilesContextMenuConditions(ContextMenuConditions):
         self.generate_path_dict(self.paths)
 
     def generate_statuses(self, paths):
-        self.statuses = {}
-        for path in paths:
-            if not path:
-                continue
-
-            statuses_tmp = self.vcs_client.statuses(path, invalidate=True)
-            for status in statuses_tmp:
-                self.statuses[status.path] = status
-
-        self.text_statuses = [
-            self.statuses[key].simple_content_status()
-            for key in list(self.statuses.keys())
-        ]
-        self.prop_statuses = [
-            self.statuses[key].simple_metadata_status()
-            for key in list(self.statuses.keys())
-        ]
+        self.read_statuses(self.vcs_client.batch_statuses(paths, invalidate=True))
 
 
 class GtkFilesContextMenu(object):
@@ -1335,25 +1417,8 @@ class MainContextMenuConditions(ContextMenuConditions):
         self.generate_statuses(paths)
         self.generate_path_dict(paths)
 
-    # FIXME: major bottleneck
     def generate_statuses(self, paths):
-        self.statuses = {}
-        for path in paths:
-            if not path:
-                continue
-
-            statuses_tmp = self.vcs_client.statuses(path)
-            for status in statuses_tmp:
-                self.statuses[status.path] = status
-
-        self.text_statuses = [
-            self.statuses[key].simple_content_status()
-            for key in list(self.statuses.keys())
-        ]
-        self.prop_statuses = [
-            self.statuses[key].simple_metadata_status()
-            for key in list(self.statuses.keys())
-        ]
+        self.read_statuses(self.vcs_client.batch_statuses(paths))
 
 
 class MainContextMenu(object):
@@ -1590,5 +1655,77 @@ def TestMenuItemFunctions():
             )
 
 
+
+class FakeClient(object):
+    def __init__(self, root, versioned):
+        self.root = root
+        self.versioned = versioned
+
+    def guess(self, path):
+        return {"vcs": VCS_SVN, "repo_path": self.root}
+
+    def is_working_copy(self, path):
+        return path == self.root
+
+    def is_in_a_or_a_working_copy(self, path):
+        return True
+
+    def is_versioned(self, path):
+        return path in self.versioned
+
+    def is_locked(self, path):
+        return False
+
+
+class TestContextMenuConditions(unittest.TestCase):
+    def setUp(self):
+        from rabbitvcs.vcs.status import Status
+
+        self.root = tempfile.mkdtemp()
+        self.normal = os.path.join(self.root, "normal")
+        self.ignored = os.path.join(self.root, "ignored")
+        for path in [self.normal, self.ignored]:
+            open(path, "w").close()
+
+        self.statuses = [
+            Status(self.normal, "normal"),
+            Status(self.ignored, "ignored"),
+        ]
+        self.client = FakeClient(self.root, [self.root, self.normal])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def conditions(self, paths):
+        conditions = ContextMenuConditions()
+        conditions.vcs_client = self.client
+        conditions.read_statuses(self.statuses)
+        conditions.generate_path_dict(paths)
+        return conditions
+
+    def test_ignored(self):
+        conditions = self.conditions([self.ignored])
+        self.assertFalse(conditions.path_dict["is_versioned"])
+        self.assertTrue(conditions.path_dict["is_ignored"])
+        self.assertTrue(conditions.add())
+        self.assertTrue(conditions.add_to_ignore_list())
+
+    def test_mixed(self):
+        # The conditions of an item are those of the last one selected
+        conditions = self.conditions([self.normal, self.ignored])
+        self.assertFalse(conditions.path_dict["is_versioned"])
+        self.assertTrue(conditions.add())
+        self.assertTrue(conditions.add_to_ignore_list())
+        self.assertTrue(conditions.path_dict["has_ignored"])
+
+        conditions = self.conditions([self.ignored, self.normal])
+        self.assertTrue(conditions.path_dict["is_versioned"])
+        self.assertFalse(conditions.path_dict["is_ignored"])
+        self.assertFalse(conditions.add())
+        self.assertFalse(conditions.add_to_ignore_list())
+        self.assertTrue(conditions.path_dict["has_ignored"])
+        self.assertEqual(conditions.path_dict["length"], 2)
+
+
 if __name__ == "__main__":
     TestMenuItemFunctions()
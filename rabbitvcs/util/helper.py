@@ -155,7 +155,47 @@ def get_tmp_path(filename):
     return "%s/%s" % (tmpdir, filename)
 
 
+def process_resident_memory():
+    """
+    Returns the resident memory of this process in KB, read from /proc, or 0
+    if it is not available.
+
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        return 0
+
+    return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def process_memory_status(pid="self"):
+    """
+    Returns the memory figures of a process (the Vm* lines of
+    /proc/<pid>/status, e.g. VmRSS or VmHWM) in KB, or an empty dictionary if
+    they are not available.
+
+    """
+    memory = {}
+    try:
+        with open("/proc/%s/status" % pid) as status:
+            for line in status:
+                if line.startswith("Vm"):
+                    name, value = line.split(":", 1)
+                    memory[name] = int(value.split()[0])
+    except (IOError, OSError, ValueError, IndexError):
+        return {}
+
+    return memory
+
+
 def process_memory(pid):
+    # What ps reports as "size", without running it where /proc is available
+    memory = process_memory_status(pid)
+    if "VmData" in memory:
+        return memory["VmData"] + memory.get("VmStk", 0)
+
     # ps -p 5205 -w -w -o rss --no-headers
     psproc = subprocess.Popen(
         [
@@ -0,0 +1,179 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Runtime statistics of the checker service.
+
+Calls to the service, lookups in the status caches of each repository and
+the subprocesses run by the backends are counted here, so that the service
+can report them (see the Stats DBus method).  Recording is cheap and thread
+safe; only the most recent call durations are kept to compute percentiles.
+"""
+
+from __future__ import absolute_import
+
+import threading
+import time
+import unittest
+from collections import deque
+
+# The number of recent durations kept for each method
+SAMPLES = 1024
+
+CACHE_EVENTS = ("hits", "misses", "evictions")
+
+
+def percentile(samples, fraction):
+    """
+    Returns the sample below which the given fraction of the sorted samples
+    lie (nearest rank), or 0.0 if there are none.
+
+    """
+    if not samples:
+        return 0.0
+    index = int(round(fraction * len(samples) + 0.5)) - 1
+    return samples[min(max(index, 0), len(samples) - 1)]
+
+
+class Statistics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+        # Method -> [calls, errors, recent durations]
+        self.calls = {}
+
+        # Repository root -> {event: count}
+        self.caches = {}
+
+        self.subprocesses = {"count": 0, "duration": 0.0, "output_bytes": 0}
+
+    def call(self, method, duration, failed=False):
+        """
+        Records a call to a service method that took duration seconds.
+
+        """
+        with self.lock:
+            entry = self.calls.get(method)
+            if entry is None:
+                entry = self.calls[method] = [0, 0, deque(maxlen=SAMPLES)]
+            entry[0] += 1
+            if failed:
+                entry[1] += 1
+            entry[2].append(duration)
+
+    def cache(self, root, event, count=1):
+        """
+        Records hits, misses or evictions in the status cache of a
+        repository.
+
+        """
+        if not count:
+            return
+        with self.lock:
+            entry = self.caches.get(root)
+            if entry is None:
+                entry = self.caches[root] = dict.fromkeys(CACHE_EVENTS, 0)
+            entry[event] += count
+
+    def subprocess(self, duration, output_bytes):
+        """
+        Records a subprocess run by a backend.
+
+        """
+        with self.lock:
+            self.subprocesses["count"] += 1
+            self.subprocesses["duration"] += duration
+            self.subprocesses["output_bytes"] += output_bytes
+
+    def summary(self):
+        """
+        Returns the statistics as a dictionary that can be encoded as JSON.
+        Durations are in seconds.
+
+        """
+        with self.lock:
+            calls = dict(
+                (method, (entry[0], entry[1], sorted(entry[2])))
+                for method, entry in self.calls.items()
+            )
+            caches = dict((root, dict(entry)) for root, entry in self.caches.items())
+            subprocesses = dict(self.subprocesses)
+
+        methods = {}
+        for method, (count, errors, samples) in calls.items():
+            methods[method] = {
+                "calls": count,
+                "errors": errors,
+                "p50": percentile(samples, 0.50),
+                "p95": percentile(samples, 0.95),
+                "p99": percentile(samples, 0.99),
+                "max": samples and samples[-1] or 0.0,
+            }
+
+        return {
+            "uptime": time.time() - self.started,
+            "methods": methods,
+            "caches": caches,
+            "subprocesses": subprocesses,
+        }
+
+
+statistics = Statistics()
+
+
+class TestStatistics(unittest.TestCase):
+    def setUp(self):
+        self.statistics = Statistics()
+
+    def test_percentiles(self):
+        for index in range(100):
+            self.statistics.call("CheckStatus", (index + 1) / 1000.0)
+        self.statistics.call("CheckStatus", 1.0, failed=True)
+
+        method = self.statistics.summary()["methods"]["CheckStatus"]
+        self.assertEqual(method["calls"], 101)
+        self.assertEqual(method["errors"], 1)
+        self.assertEqual(method["p50"], 0.051)
+        self.assertEqual(method["p99"], 0.1)
+        self.assertEqual(method["max"], 1.0)
+
+    def test_caches(self):
+        self.statistics.cache("/repo", "hits", 3)
+        self.statistics.cache("/repo", "misses")
+        self.statistics.cache("/repo", "evictions", 0)
+        self.assertEqual(
+            self.statistics.summary()["caches"],
+            {"/repo": {"hits": 3, "misses": 1, "evictions": 0}},
+        )
+
+    def test_subprocesses(self):
+        self.statistics.subprocess(0.5, 100)
+        self.statistics.subprocess(0.25, 20)
+        self.assertEqual(
+            self.statistics.summary()["subprocesses"],
+            {"count": 2, "duration": 0.75, "output_bytes": 120},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Coalesced updates of the items shown by a file manager.
+
+Applying a status to an item makes the file manager ask for its information
+again, which is not cheap.  During a large checkout or commit the checker
+reports thousands of statuses a second, so the file manager extensions queue
+them instead, keeping only the latest of each path, and apply a bounded batch
+whenever the main loop is idle.  The file manager keeps drawing in between,
+and a path reported several times before its turn comes is updated once.
+"""
+
+from __future__ import absolute_import
+
+import unittest
+from collections import OrderedDict
+
+from gi.repository import GLib
+
+from rabbitvcs.util.log import Log
+
+log = Log("rabbitvcs.util.updates")
+
+# The most updates applied per idle callback
+BATCH_SIZE = 100
+
+
+class UpdateQueue(object):
+    def __init__(self, apply, batch_size=BATCH_SIZE, schedule=GLib.idle_add):
+        """
+        @type   apply: callable
+        @param  apply: Called on the main loop with a path and its latest value
+
+        @type   batch_size: integer
+        @param  batch_size: The most updates applied per idle callback
+
+        @type   schedule: callable
+        @param  schedule: Called with a function to call once the main loop is
+            idle, and again for as long as it returns True
+
+        """
+        self.apply = apply
+        self.batch_size = batch_size
+        self.schedule = schedule
+
+        # Path -> the latest value, oldest path first
+        self.pending = OrderedDict()
+        self.scheduled = False
+
+    def add(self, path, value):
+        """
+        Queues an update.  A path that is already waiting keeps its place, with
+        the newer value.
+
+        """
+        self.pending[path] = value
+        if not self.scheduled:
+            self.scheduled = True
+            self.schedule(self.flush)
+
+    def flush(self):
+        """
+        Applies a batch of updates.  Returns True while some are left, so that
+        the idle callback runs again.
+
+        """
+        for index in range(min(self.batch_size, len(self.pending))):
+            path, value = self.pending.popitem(last=False)
+            try:
+                self.apply(path, value)
+            except Exception as e:
+                log.exception(e)
+
+        self.scheduled = bool(self.pending)
+        return self.scheduled
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class TestUpdateQueue(unittest.TestCase):
+    def setUp(self):
+        self.applied = []
+        self.scheduled = []
+        self.queue = UpdateQueue(
+            lambda path, value: self.applied.append((path, value)),
+            batch_size=2,
+            schedule=self.scheduled.append,
+        )
+
+    def test_coalesce(self):
+        self.queue.add("/a", 1)
+        self.queue.add("/b", 1)
+        self.queue.add("/a", 2)
+        self.assertEqual(len(self.scheduled), 1)
+        self.assertEqual(len(self.queue), 2)
+
+        self.assertFalse(self.queue.flush())
+        self.assertEqual(self.applied, [("/a", 2), ("/b", 1)])
+
+    def test_batches(self):
+        for path in ["/a", "/b", "/c"]:
+            self.queue.add(path, 1)
+
+        self.assertTrue(self.queue.flush())
+        self.assertEqual(len(self.applied), 2)
+        self.assertFalse(self.queue.flush())
+        self.assertEqual(len(self.applied), 3)
+
+        # Scheduled again once there is something new
+        self.queue.add("/a", 2)
+        self.assertEqual(len(self.scheduled), 2)
+
+    def test_reentrant(self):
+        # Applying an update may report another one
+        def apply(path, value):
+            self.applied.append(path)
+            if path == "/a":
+                self.queue.add("/b", 1)
+
+        self.queue.apply = apply
+        self.queue.add("/a", 1)
+        self.assertTrue(self.queue.flush())
+        self.assertFalse(self.queue.flush())
+        self.assertEqual(self.applied, ["/a", "/b"])
+        self.assertEqual(len(self.scheduled), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
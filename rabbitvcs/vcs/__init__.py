@@ -23,6 +23,7 @@ from __future__ import absolute_import
 #
 
 import os.path
+import threading
 from rabbitvcs import gettext
 
 _ = gettext.gettext
@@ -33,6 +34,8 @@ logger = Log("rabbitvcs.vcs")
 
 from rabbitvcs.util.helper import get_exclude_paths
 from rabbitvcs.util.settings import SettingsManager
+from rabbitvcs.vcs.pool import ClientPool
+from rabbitvcs.vcs.roots import guess_root
 
 settings = SettingsManager()
 
@@ -43,6 +46,25 @@ VCS_GIT = "git"
 VCS_MERCURIAL = "mercurial"
 VCS_DUMMY = "unknown"
 
+# How far below a path a status check looks: the path alone, the items
+# directly under it, or everything under it
+DEPTH_EMPTY = "empty"
+DEPTH_IMMEDIATES = "immediates"
+DEPTH_INFINITY = "infinity"
+
+DEPTHS = [DEPTH_EMPTY, DEPTH_IMMEDIATES, DEPTH_INFINITY]
+
+
+def recurse_depth(recurse):
+    """
+    Returns the depth meant by the recurse flag used by older callers.
+
+    """
+    if recurse:
+        return DEPTH_INFINITY
+    return DEPTH_IMMEDIATES
+
+
 VCS_FOLDERS = {}
 if not settings.get("HideItem", "svn"):
     VCS_FOLDERS[".svn"] = VCS_SVN
@@ -53,14 +75,9 @@ if not settings.get("HideItem", "git"):
 def _guess(path):
     # Determine the VCS instance based on the path
     if path:
-        path_to_check = path.split("@")[0]
-
-        while path_to_check != "/" and path_to_check != "":
-            for folder, client in list(VCS_FOLDERS.items()):
-                if os.path.isdir(os.path.join(path_to_check, folder)):
-                    cache = {"vcs": client, "repo_path": path_to_check}
-                    return cache
-            path_to_check = os.path.split(path_to_check)[0]
+        folder, repo_path = guess_root(path.split("@")[0], list(VCS_FOLDERS.keys()))
+        if folder is not None:
+            return {"vcs": VCS_FOLDERS[folder], "repo_path": repo_path}
 
     return {"vcs": VCS_DUMMY, "repo_path": path}
 
@@ -77,6 +94,8 @@ def guess(path):
 
 class VCS(object):
     clients = {}
+    pools = {}
+    pools_lock = threading.Lock()
     exclude_paths = []
 
     def __init__(self):
@@ -91,97 +110,111 @@ class VCS(object):
             self.clients[VCS_DUMMY] = Dummy()
             return self.clients[VCS_DUMMY]
 
-    def svn(self):
+    def svn(self, path=None, is_repo_path=False):
         if settings.get("HideItem", "svn"):
             return self.dummy()
 
-        if VCS_SVN in self.clients:
-            return self.clients[VCS_SVN]
-        else:
+        if VCS_SVN not in self.clients:
             try:
                 from rabbitvcs.vcs.svn import SVN
 
                 self.clients[VCS_SVN] = SVN()
-                return self.clients[VCS_SVN]
             except Exception as e:
                 logger.debug("Unable to load SVN module: %s" % e)
                 logger.exception(e)
                 self.clients[VCS_SVN] = self.dummy()
-                return self.clients[VCS_SVN]
+
+        svn = self.clients[VCS_SVN]
+        if not path or svn.__class__.__name__ == "Dummy":
+            return svn
+
+        # pysvn clients must not be used by several threads at once, so each
+        # working copy gets a client (and status cache) of its own
+        pool = self.pool(VCS_SVN, lambda root: svn.__class__(root))
+
+        repo_path = path
+        if not is_repo_path:
+            repo_path = svn.find_repository_path(path)
+            if repo_path is None:
+                return svn
+
+        return pool.get(repo_path)
+
+    def pool(self, vcs, factory):
+        """
+        Returns the pool of per-repository clients for a VCS.
+
+        """
+        with self.pools_lock:
+            if vcs not in self.pools:
+                self.pools[vcs] = ClientPool(
+                    factory,
+                    settings.get("checker", "client_pool_size"),
+                    settings.get("checker", "client_idle_timeout"),
+                )
+            return self.pools[vcs]
 
     def git(self, path=None, is_repo_path=False):
         if settings.get("HideItem", "git"):
             return self.dummy()
 
-        if VCS_GIT in self.clients:
-            git = self.clients[VCS_GIT]
-            if git.__class__.__name__ == "Dummy":
-                return self.dummy()
-
-            if path:
-                if is_repo_path:
-                    git.set_repository(path)
-                else:
-                    repo_path = git.find_repository_path(path)
-                    git.set_repository(repo_path)
-
-            return git
-        else:
+        if VCS_GIT not in self.clients:
             try:
                 from rabbitvcs.vcs.git import Git
 
-                git = Git()
-
-                if path:
-                    if is_repo_path:
-                        git.set_repository(path)
-                    else:
-                        repo_path = git.find_repository_path(path)
-                        git.set_repository(repo_path)
-
-                self.clients[VCS_GIT] = git
-                return self.clients[VCS_GIT]
+                # Not bound to a repository, used to find repositories and to
+                # create or clone them
+                self.clients[VCS_GIT] = Git()
             except Exception as e:
                 logger.debug("Unable to load Git module: %s" % e)
                 logger.exception(e)
                 self.clients[VCS_GIT] = self.dummy()
-                return self.clients[VCS_GIT]
 
-    def mercurial(self, path=None, is_repo_path=False):
-        if settings.get("HideItem", "hg"):
+        git = self.clients[VCS_GIT]
+        if git.__class__.__name__ == "Dummy":
             return self.dummy()
 
-        if VCS_MERCURIAL in self.clients:
-            mercurial = self.clients[VCS_MERCURIAL]
+        pool = self.pool(VCS_GIT, git.__class__)
+        if not path:
+            return pool.recent() or git
 
-            if path:
-                if is_repo_path:
-                    mercurial.set_repository(path)
-                else:
-                    repo_path = mercurial.find_repository_path(path)
-                    mercurial.set_repository(repo_path)
+        repo_path = path
+        if not is_repo_path:
+            repo_path = git.find_repository_path(path)
+            if repo_path is None:
+                return git
 
-            return mercurial
-        else:
-            try:
-                from rabbitvcs.vcs.mercurial import Mercurial
+        return pool.get(repo_path)
 
-                mercurial = Mercurial()
+    def mercurial(self, path=None, is_repo_path=False):
+        if settings.get("HideItem", "hg"):
+            return self.dummy()
 
-                if path:
-                    if is_repo_path:
-                        mercurial.set_repository(path)
-                    else:
-                        repo_path = mercurial.find_repository_path(path)
-                        mercurial.set_repository(repo_path)
+        if VCS_MERCURIAL not in self.clients:
+            try:
+                from rabbitvcs.vcs.mercurial import Mercurial
 
-                self.clients[VCS_MERCURIAL] = mercurial
-                return self.clients[VCS_MERCURIAL]
+                self.clients[VCS_MERCURIAL] = Mercurial()
             except Exception as e:
                 logger.debug("Unable to load Mercurial module: %s" % e)
                 logger.exception(e)
                 self.clients[VCS_MERCURIAL] = self.dummy()
-                return self.clients[VCS_MERCURIAL]
+
+        mercurial = self.clients[VCS_MERCURIAL]
+        if mercurial.__class__.__name__ == "Dummy":
+            return self.dummy()
+
+        pool = self.pool(VCS_MERCURIAL, mercurial.__class__)
+        if not path:
+            return pool.recent() or mercurial
+
+        repo_path = path
+        if not is_repo_path:
+            repo_path = mercurial.find_repository_path(path)
+            if repo_path is None:
+                return mercurial
+
+        return pool.get(repo_path)
 
     def client(self, path, vcs=None):
         if self.should_exclude(path):
@@ -191,7 +224,7 @@ class VCS(object):
         # Determine the VCS instance based on the vcs parameter
         if vcs:
             if vcs == VCS_SVN:
-                return self.svn()
+                return self.svn(path)
             elif vcs == VCS_GIT:
                 return self.git(path)
             elif vcs == VCS_MERCURIAL:
@@ -199,14 +232,33 @@ class VCS(object):
 
         guess = self.guess(path)
         if guess["vcs"] == VCS_GIT:
-            return self.git(guess["repo_path"], is_repo_path=False)
+            return self.git(guess["repo_path"], is_repo_path=True)
         elif guess["vcs"] == VCS_SVN:
-            return self.svn()
+            return self.svn(guess["repo_path"], is_repo_path=True)
         elif guess["vcs"] == VCS_MERCURIAL:
             return self.mercurial(guess["repo_path"], is_repo_path=False)
         else:
             return self.dummy()
 
+    def release_clients(self):
+        """
+        Drops every pooled client, along with the statuses it caches.  They
+        are created again as needed.
+
+        """
+        with self.pools_lock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            pool.clear()
+
+    def client_count(self):
+        """
+        Returns the number of pooled clients, one per repository.
+
+        """
+        with self.pools_lock:
+            return sum(len(pool) for pool in self.pools.values())
+
     def should_exclude(self, path):
         for exclude_path in self.exclude_paths:
             if path.startswith(exclude_path):
@@ -219,13 +271,90 @@ class VCS(object):
 
     # Methods that call client methods
 
-    def statuses(self, path, recurse=True, invalidate=False):
+    def statuses(self, path, recurse=True, invalidate=False, depth=None):
+        """
+        Returns the statuses of the path and of the items under it, down to
+        the given depth (one of the DEPTH_* constants).  If depth is None, it
+        is taken from recurse.
+
+        """
+        client = self.client(path)
+        return client.statuses(
+            path, recurse=recurse, invalidate=invalidate, depth=depth
+        )
+
+    def batch_statuses(self, paths, recurse=True, invalidate=False):
+        """
+        Returns the statuses of several paths and of the items under them, in
+        one list.  The files selected in a folder are looked up together, from
+        the statuses of the items directly in the folder, so the client of
+        their repository is looked up once and queried once.  When
+        invalidating, every path is invalidated before the first query rather
+        than each query rescanning the repository.
+
+        """
+        # Folder -> (client, files selected in it), and (client, directory)
+        folders = {}
+        directories = []
+        for path in paths:
+            if not path or self.should_exclude(path):
+                continue
+
+            if os.path.isdir(path):
+                directories.append((self.client(path), path))
+                continue
+
+            folder = os.path.dirname(path)
+            if folder not in folders:
+                folders[folder] = (self.client(folder), [])
+            folders[folder][1].append(path)
+
+        if invalidate:
+            for client, path in directories:
+                client.invalidate(path, recurse)
+            for client, files in folders.values():
+                for path in files:
+                    client.invalidate(path, recurse)
+
+        statuses = []
+        for client, path in directories:
+            statuses.extend(client.statuses(path, recurse=recurse))
+
+        for folder, (client, files) in folders.items():
+            found = {}
+            if len(files) > 1:
+                for status in client.statuses(folder, depth=DEPTH_IMMEDIATES):
+                    found[status.path] = status
+
+            for path in files:
+                if path in found:
+                    statuses.append(found[path])
+                else:
+                    statuses.extend(client.statuses(path, recurse=recurse))
+
+        return statuses
+
+    def status(self, path, summarize=True, invalidate=False, depth=DEPTH_INFINITY):
+        """
+        Returns the status of a path.  The summary of a directory covers the
+        items under it down to the given depth.
+
+        """
         client = self.client(path)
-        return client.statuses(path, recurse=recurse, invalidate=invalidate)
+        return client.status(path, summarize, invalidate, depth)
 
-    def status(self, path, summarize=True, invalidate=False):
+    def invalidate(self, path, recurse=False):
         client = self.client(path)
-        return client.status(path, summarize, invalidate)
+        client.invalidate(path, recurse)
+
+        if recurse:
+            # Repositories nested below the path have clients of their own
+            with self.pools_lock:
+                pools = list(self.pools.values())
+            for pool in pools:
+                for nested in pool.clients_under(path):
+                    if nested is not client:
+                        nested.invalidate(path, recurse)
 
     def is_working_copy(self, path):
         client = self.client(path)
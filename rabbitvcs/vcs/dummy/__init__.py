@@ -33,7 +33,9 @@ class Dummy(object):
     def __init__(self):
         pass
 
-    def status(self, path, summarize=True, invalidate=False):
+    def status(
+        self, path, summarize=True, invalidate=False, depth=rabbitvcs.vcs.DEPTH_INFINITY
+    ):
         return rabbitvcs.vcs.status.Status.status_unknown(path)
 
     def is_working_copy(self, path):
@@ -51,8 +53,11 @@ class Dummy(object):
     def is_locked(self, path):
         return False
 
-    def statuses(self, path, recurse=True, invalidate=False):
+    def statuses(self, path, recurse=True, invalidate=False, depth=None):
         return []
 
+    def invalidate(self, path, recurse=False):
+        pass
+
     def revision(self, kind, number=None):
         return None
@@ -26,6 +26,7 @@ Concrete VCS implementation for Git functionality.
 from __future__ import absolute_import
 
 import os.path
+import threading
 from datetime import datetime
 
 from .gittyup.client import GittyupClient
@@ -37,6 +38,8 @@ from rabbitvcs.util.strings import S
 import rabbitvcs.vcs
 import rabbitvcs.vcs.status
 import rabbitvcs.vcs.log
+from rabbitvcs.vcs.snapshot import StatusSnapshot
+from rabbitvcs.vcs.store import get_store, file_key
 from rabbitvcs.vcs.branch import BranchEntry, LocalBranchEntry
 from rabbitvcs.util.log import Log
 
@@ -128,10 +131,16 @@ class Git(object):
         self.interface = "gittyup"
         if repo:
             self.client = GittyupClient(repo)
+            self.config = self.client.config
         else:
             self.client = GittyupClient()
 
-        self.cache = rabbitvcs.vcs.status.StatusCache()
+        self.snapshots = {}
+        self.snapshots_lock = threading.Lock()
+
+        # "porcelain" runs git status, "native" compares the index with the
+        # working tree without running git
+        self.status_engine = rabbitvcs.vcs.settings.get("checker", "git_status")
 
     def set_repository(self, path):
         self.client.set_repository(path)
@@ -150,7 +159,7 @@ class Git(object):
     # Status Methods
     #
 
-    def statuses(self, path, recurse=False, invalidate=False):
+    def statuses(self, path, recurse=False, invalidate=False, depth=None):
         """
         Generates a list of GittyupStatus objects for the specified file.
 
@@ -158,64 +167,173 @@ class Git(object):
         @param  path: The file to look up.  If the file is a directory, it will
             return a recursive list of child path statuses
 
+        @type   depth: string
+        @param  depth: One of the rabbitvcs.vcs.DEPTH_* constants, taken from
+            recurse if None.  With DEPTH_IMMEDIATES, only the items directly in
+            the folder are scanned, and its subfolders are only listed if
+            their statuses are known from an earlier scan.
+
         """
+        if depth is None:
+            depth = rabbitvcs.vcs.recurse_depth(recurse)
 
-        if path in self.cache:
-            if invalidate:
-                del self.cache[path]
-            else:
-                return self.cache.find_path_statuses(path)
+        if depth == rabbitvcs.vcs.DEPTH_EMPTY:
+            return [self.status(path, summarize=False, invalidate=invalidate)]
 
-        gittyup_statuses = self.client.status(path)
+        scope = None
+        if os.path.isdir(path):
+            scope = path
 
-        if not len(gittyup_statuses):
+        recurse = depth == rabbitvcs.vcs.DEPTH_INFINITY
+        snapshot = self.snapshot(path, invalidate, scope, recurse)
+        statuses = snapshot.statuses(path, recurse)
+        if not len(statuses):
             return [rabbitvcs.vcs.status.Status.status_unknown(path)]
-        else:
-            statuses = []
-            for st in gittyup_statuses:
-                # gittyup returns status paths relative to the repository root
-                # so we need to convert the path to an absolute path
-                st.path = self.client.get_absolute_path(st.path)
-
-                # If not recursing, only return the item in question (if a file)
-                # or items directly under the path (if a directory)
-                cmp_path = os.path.join(path, os.path.basename(st.path))
-                if not recurse and cmp_path != st.path and st.path != path:
-                    continue
 
-                rabbitvcs_status = rabbitvcs.vcs.status.GitStatus(st)
-                self.cache[st.path] = rabbitvcs_status
+        return statuses
 
-                statuses.append(rabbitvcs_status)
+    def snapshot(self, path, invalidate=False, scope=None, recurse=True):
+        """
+        Returns the status snapshot of the repository containing the path,
+        scanning the folder the path is in first if the snapshot is out of date
+        for it.  The statuses of everything shown in a folder thus come from
+        one scan limited to that folder.
 
-            return statuses
+        @type   scope: string
+        @param  scope: The folder to scan instead
 
-    def status(self, path, summarize=True, invalidate=False):
-        if path in self.cache:
-            if invalidate:
-                del self.cache[path]
-            else:
-                st = self.cache[path]
-                if summarize:
-                    st.summary = st.single
-                return st
+        @type   recurse: boolean
+        @param  recurse: Whether to scan everything under the folder, rather
+            than only the items directly in it
 
-        all_statuses = self.statuses(path, invalidate=invalidate)
+        """
+        root = self.get_repository()
+        with self.snapshots_lock:
+            snapshot = self.snapshots.get(root)
+            created = snapshot is None
+            if created:
+                snapshot = StatusSnapshot(root)
+                self.snapshots[root] = snapshot
 
-        if summarize:
-            path_status = None
-            for st in all_statuses:
-                if st.path == path:
-                    path_status = st
-                    break
-
-            if path_status:
-                path_status.summary = path_status.single
-            else:
-                path_status = rabbitvcs.vcs.status.Status.status_unknown(path)
+        store = get_store()
+        if created and store and not invalidate:
+            statuses = store.load(root, self._validation_key())
+            if statuses is not None:
+                snapshot.preload(statuses)
+
+        if invalidate:
+            snapshot.invalidate()
+
+        if scope is None:
+            scope = os.path.dirname(path)
+        if not snapshot.contains(scope):
+            scope = root
+
+        snapshot.refresh(self._scan, scope, recurse)
+        return snapshot
+
+    def _scan(self, scope, recurse=True):
+        # Taken before scanning, so that changes made during the scan make
+        # the saved statuses invalid
+        key = self._validation_key()
+
+        statuses = []
+        for st in self.client.status(scope, self.status_engine, recurse):
+            # gittyup returns status paths relative to the repository root
+            # so we need to convert the path to an absolute path
+            st.path = self.client.get_absolute_path(st.path)
+            statuses.append(rabbitvcs.vcs.status.GitStatus(st))
+
+        # Only the statuses of the whole repository are worth keeping
+        store = get_store()
+        root = self.get_repository()
+        if store and scope == root and recurse:
+            store.save(root, key, statuses)
+
+        return statuses
+
+    def _validation_key(self):
+        """
+        Describes the state of the index and of HEAD, which saved statuses
+        are only valid for.
+
+        """
+        try:
+            head = S(self.client.repo.refs[b"HEAD"])
+        except KeyError:
+            head = "unborn"
+
+        return "git:%s:%s:%s" % (
+            self.status_engine,
+            file_key(self.client.repo.index_path()),
+            head,
+        )
+
+    def invalidate(self, path, recurse=False):
+        # Any change in a repository may change the status of its directories,
+        # so the whole snapshot goes.
+        with self.snapshots_lock:
+            snapshots = list(self.snapshots.values())
+
+        for snapshot in snapshots:
+            if snapshot.contains(path) or (
+                recurse and snapshot.root.startswith(path.rstrip("/") + "/")
+            ):
+                snapshot.invalidate()
+
+    def status(
+        self, path, summarize=True, invalidate=False, depth=rabbitvcs.vcs.DEPTH_INFINITY
+    ):
+        """
+        Returns the status of a path.  A file only needs the items directly in
+        its folder to be scanned, and so does a folder summarised from the
+        items directly in it (DEPTH_IMMEDIATES), unless everything under it
+        was scanned already.  Otherwise everything under the folder is.
+
+        """
+        if not os.path.isdir(path):
+            snapshot = self.snapshot(path, invalidate, recurse=False)
+        elif depth == rabbitvcs.vcs.DEPTH_IMMEDIATES:
+            snapshot = self.snapshot(path, invalidate, path, recurse=False)
+            if snapshot.content(path) is None:
+                return self._items_status(path, snapshot, summarize)
         else:
-            path_status = all_statuses[0]
+            snapshot = self.snapshot(path, invalidate, path)
+        path_status = snapshot.status(path)
+
+        if path_status is None:
+            # git reports ignored folders but not what is inside them
+            content = None
+            parent = os.path.dirname(path)
+            while content is None and snapshot.contains(parent):
+                content = snapshot.content(parent)
+                parent = os.path.dirname(parent)
+
+            if content != "ignored":
+                return rabbitvcs.vcs.status.Status.status_unknown(path)
+
+            path_status = rabbitvcs.vcs.status.GitStatus(
+                gittyup.objects.IgnoredStatus(path)
+            )
+
+        if summarize and depth != rabbitvcs.vcs.DEPTH_EMPTY:
+            path_status.summary = (
+                snapshot.summary(path, depth == rabbitvcs.vcs.DEPTH_INFINITY)
+                or path_status.single
+            )
+
+        return path_status
+
+    def _items_status(self, path, snapshot, summarize):
+        """
+        Returns the status of a folder that was only scanned for the items
+        directly in it, which tell whether the folder is modified but not
+        whether something further down is.
 
+        """
+        path_status = rabbitvcs.vcs.status.GitStatus(gittyup.objects.NormalStatus(path))
+        if summarize:
+            path_status.summary = snapshot.summary(path, False, path_status.single)
         return path_status
 
     def is_working_copy(self, path):
@@ -227,7 +345,7 @@ class Git(object):
         if self.is_working_copy(path):
             return True
 
-        return self.find_repository_path(os.path.split(path)[0]) != ""
+        return self.find_repository_path(os.path.split(path)[0]) is not None
 
     def is_versioned(self, path):
         if self.is_working_copy(path):
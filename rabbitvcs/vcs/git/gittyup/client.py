@@ -22,6 +22,7 @@ import dulwich.errors
 import dulwich.repo
 import dulwich.porcelain
 import dulwich.objects
+import dulwich.ignore
 from dulwich.index import write_index_dict, SHA1Writer
 
 # from dulwich.patch import write_tree_diff
@@ -30,9 +31,11 @@ from .exceptions import *
 from . import util
 from .objects import *
 from .command import GittyupCommand
+from .statcache import StatCache, GitIndex
 
 from rabbitvcs.util import helper
 from rabbitvcs.util.strings import *
+from rabbitvcs.vcs.roots import find_root
 
 import six.moves.tkinter
 import six.moves.tkinter_messagebox
@@ -96,6 +99,9 @@ class GittyupClient(object):
         self.numberOfCommandStages = 0
         self.numberOfCommandStagesExecuted = 0
 
+        # The stat data of the index file and the index parsed from it
+        self._parsed_index = None
+
         if path:
             try:
                 self.repo = dulwich.repo.Repo(path)
@@ -382,14 +388,10 @@ class GittyupClient(object):
         return self.repo.path
 
     def find_repository_path(self, path):
-        path_to_check = S(path)
-        while path_to_check != "/" and path_to_check != "":
-            if os.path.isdir(os.path.join(path_to_check, ".git")):
-                return path_to_check
-
-            path_to_check = os.path.split(path_to_check)[0]
-
-        return None
+        repo_path = find_root(S(path), ".git")
+        if repo_path is None:
+            return None
+        return S(repo_path)
 
     def get_relative_path(self, path):
         path = S(path)
@@ -1610,142 +1612,329 @@ class GittyupClient(object):
 
         return tags
 
-    def status_porcelain(self, path):
-        if os.path.isdir(path):
-            (files, directories) = self._read_directory_tree(path)
-        else:
-            files = [self.get_relative_path(path)]
-            directories = []
+    def _status_scope(self, path, recurse=True):
+        """
+        Returns the path relative to the repository ("" for the repository
+        itself) and a function telling whether a relative path lies under it,
+        or is one of the items directly in it if recurse is False.
 
-        files_hash = {}
-        for file in files:
-            files_hash[file] = True
+        """
+        relative_path = self.get_relative_path(path)
+        if relative_path == ".":
+            relative_path = ""
 
-        cmd = ["git", "status", "--porcelain", path]
-        try:
-            (status, stdout, stderr) = GittyupCommand(
-                cmd, cwd=self.repo.path, notify=self.notify
-            ).execute()
-        except GittyupCommandError as e:
-            self.callback_notify(e)
+        def in_scope(item):
+            if not recurse:
+                return (
+                    item != relative_path and item.rpartition("/")[0] == relative_path
+                )
+            return (
+                not relative_path
+                or item == relative_path
+                or item.startswith(relative_path + "/")
+            )
+
+        return (relative_path, in_scope)
+
+    def _status_from_xy(self, item, xy, kind="1", origin=None):
+        """
+        Returns the status object for the two letter code used by git status,
+        where X is the state of the index and Y the state of the working tree.
+
+        """
+        if kind == "2":
+            if xy[0] == "R":
+                return RenamedStatus(item, origin)
+            return AddedStatus(item, origin)
+        elif xy == ".D":
+            return MissingStatus(item)
+        elif kind == "u" or any(c in xy for c in "MRU"):
+            return ModifiedStatus(item)
+        elif "A" in xy or xy[0] == "C":
+            return AddedStatus(item)
+        elif xy[0] == "D":
+            return RemovedStatus(item)
+
+        return ModifiedStatus(item)
+
+    def _directory_statuses(self, files, changed_paths, reported, in_scope):
+        """
+        Determine status of folders based on child contents, marking the
+        ancestors of each changed item in one pass
+
+        """
+        directories = {}
+        for item in files:
+            parent = item.rpartition("/")[0]
+            while parent not in directories:
+                directories[parent] = False
+                if not parent:
+                    break
+                parent = parent.rpartition("/")[0]
+
+        for item in changed_paths:
+            parent = item.rpartition("/")[0]
+            while not directories.get(parent, True):
+                directories[parent] = True
+                if not parent:
+                    break
+                parent = parent.rpartition("/")[0]
 
         statuses = []
-        modified_files = []
-        for line in stdout:
-            components = RE_STATUS.match(line)
-            if components:
-                status = components.group(1)
-                strip_status = status.strip()
-                path = self.string_unescape(components.group(2))
-                if path[0] == '"' and path[-1] == '"':
-                    path = path[1:-1]
-
-                if status == " D":
-                    statuses.append(MissingStatus(path))
-                elif any(c in strip_status for c in ["M", "R", "U"]):
-                    statuses.append(ModifiedStatus(path))
-                elif strip_status in ["A", "C"]:
-                    statuses.append(AddedStatus(path))
-                elif strip_status == "D":
-                    statuses.append(RemovedStatus(path))
-                elif strip_status == "??":
-                    statuses.append(UntrackedStatus(path))
-
-                modified_files.append(path)
-                try:
-                    del files_hash[path]
-                except Exception as e:
-                    pass
+        for directory, modified in directories.items():
+            if directory in reported or not in_scope(directory):
+                continue
+            if modified:
+                statuses.append(ModifiedStatus(directory))
+            else:
+                statuses.append(NormalStatus(directory))
+
+        return statuses
+
+    def read_index(self):
+        """
+        Returns the parsed index, which is only read again once the index
+        file has been written.
+
+        """
+        index_path = self.repo.index_path()
+        st = os.stat(index_path)
+        key = (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+        if self._parsed_index is None or self._parsed_index[0] != key:
+            index = GitIndex(self.repo.controldir(), index_path)
+            # Not kept if the index was written while it was being read
+            if index.mtime_ns == st.st_mtime_ns:
+                self._parsed_index = (key, index)
+            return index
+
+        return self._parsed_index[1]
+
+    def status_porcelain(self, path, recurse=True):
+        """
+        Works out the status with git status.  If recurse is False, only the
+        items directly in the folder are reported, leaving out its subfolders
+        (git does not look into them).
+
+        """
+        relative_path, in_scope = self._status_scope(path, recurse)
+
+        statuses = []
+        changed_paths = []
+        reported = set()
+        files = []
 
-        # Determine untracked directories
-        cmd = ["git", "clean", "-nd", self.repo.path]
+        pathspec = path
+        if not recurse:
+            pathspec = ":(glob)%s*" % re.sub(
+                r"([*?[\\])", r"\\\1", relative_path + "/" if relative_path else ""
+            )
+
+        cmd = [
+            "git",
+            "status",
+            "--porcelain=v2",
+            "-z",
+            "--ignored=matching",
+            "--untracked-files=all",
+            "--",
+            pathspec,
+        ]
+        records = GittyupCommand(cmd, cwd=self.repo.path, notify=self.notify).stream()
         try:
-            (status, stdout, stderr) = GittyupCommand(
-                cmd, cwd=self.repo.path, notify=self.notify
-            ).execute()
+            for record in records:
+                if not record:
+                    continue
+
+                kind = record[0]
+                if kind == "?":
+                    item = record[2:]
+                    statuses.append(UntrackedStatus(item))
+                elif kind == "!":
+                    item = record[2:].rstrip("/")
+                    statuses.append(IgnoredStatus(item))
+                    self.ignored_paths.append(item)
+                    reported.add(item)
+                    continue
+                elif kind in ("1", "2", "u"):
+                    # 1 XY sub mH mI mW hH hI path
+                    # 2 XY sub mH mI mW hH hI score path NUL origin
+                    # u XY sub m1 m2 m3 mW h1 h2 h3 path
+                    fields = {"1": 9, "2": 10, "u": 11}[kind]
+                    parts = record.split(" ", fields - 1)
+                    item = parts[-1]
+
+                    origin = None
+                    if kind == "2":
+                        origin = next(records)
+                    statuses.append(self._status_from_xy(item, parts[1], kind, origin))
+                else:
+                    continue
+
+                files.append(item)
+                changed_paths.append(item)
+                reported.add(item)
         except GittyupCommandError as e:
             self.callback_notify(e)
 
-        untracked_directories = []
-        for line in stdout:
-            components = re.match("^(Would remove)\s(.*?)$", line)
-            if components:
-                untracked_path = components.group(2)
-                if untracked_path[-1] == "/":
-                    untracked_directories.append(untracked_path[:-1])
+        # Everything else git knows about is unchanged, which we can read
+        # straight from the index instead of walking the working tree
+        if self.repo.has_index():
+            for entry in self.read_index().entries:
+                item = entry.name
+                if item not in reported and in_scope(item):
+                    statuses.append(NormalStatus(item))
+                    files.append(item)
+                    reported.add(item)
+
+        if not files and not statuses and relative_path and recurse:
+            statuses.append(NormalStatus(relative_path))
+
+        statuses += self._directory_statuses(files, changed_paths, reported, in_scope)
+        return statuses
+
+    def status_native(self, path, recurse=True):
+        """
+        Works out the status without running git.  Files whose stat data
+        matches the index are taken to be unchanged, so only files which may
+        have changed are read and hashed.  If recurse is False, only the items
+        directly in the folder are reported, as with status_porcelain().
+
+        """
+        relative_path, in_scope = self._status_scope(path, recurse)
+
+        statuses = []
+        changed_paths = []
+        reported = set()
+        files = []
 
-        # Determine the ignored files and directories in Repo
-        cmd = ["git", "clean", "-ndX", self.repo.path]
+        statcache = StatCache(self.repo.path, self.repo.controldir())
         try:
-            (status, stdout, stderr) = GittyupCommand(
-                cmd, cwd=self.repo.path, notify=self.notify
-            ).execute()
-        except GittyupCommandError as e:
-            self.callback_notify(e)
-        ignored_directories = []
-        for line in stdout:
-            components = re.match("^(Would remove)\s(.*?)$", line)
-            if components:
-                ignored_path = components.group(2)
-                if ignored_path[-1] == "/":
-                    ignored_directories.append(ignored_path[:-1])
-                    next
-                statuses.append(IgnoredStatus(ignored_path))
-                self.ignored_paths.append(ignored_path)
-                try:
-                    del files_hash[ignored_path]
-                except Exception as e:
-                    pass
-        for file, data in list(files_hash.items()):
-            ignore_file = False
-            untracked_file = False
-            for ignored_path in ignored_directories:
-                if S(ignored_path) in file:
-                    ignore_file = True
-                    break
-            for untracked_path in untracked_directories:
-                if S(untracked_path) in file:
-                    untracked_file = True
-                    break
-            if untracked_file == True:
-                statuses.append(UntrackedStatus(file))
-                if ignore_file == True:
-                    self.ignored_paths.append(file)
-            elif ignore_file == True:
-                statuses.append(IgnoredStatus(file))
-                self.ignored_paths.append(file)
-            else:
-                statuses.append(NormalStatus(file))
+            index = self.read_index()
+            entries = index.entries
+        except (IOError, OSError):
+            index = None
+            entries = []
 
-        # Determine status of folders based on child contents
-        for d in directories:
-            d_status = NormalStatus(d)
+        try:
+            tree_sha = self.repo[self.repo.head()].tree
+        except KeyError:
+            tree_sha = None
+
+        staged = {}
+        modified = set()
+        missing = set()
+        if index is not None:
+            staged = statcache.staged_changes(index, self.repo.object_store, tree_sha)
+            modified, missing = statcache.worktree_changes(
+                index,
+                [
+                    entry
+                    for entry in entries
+                    if not entry.stage and in_scope(entry.name)
+                ],
+            )
 
-            # Check if directory is untracked or a sub-directory of an untracked directory
-            for untracked_path in untracked_directories:
-                if untracked_path in d:
-                    d_status = UntrackedStatus(d)
-                    break
+        tracked = set()
+        conflicts = set()
+        for entry in entries:
+            tracked.add(entry.name)
+            if entry.stage:
+                conflicts.add(entry.name)
 
-            dirPattern = "/%s/" % d
-            if len(d) == 0:
-                dirPattern = "/"
+        for name in sorted(tracked):
+            if not in_scope(name):
+                continue
 
-            # Check if directory includes modified files
-            for file in modified_files:
-                if ("/%s" % file).startswith(
-                    dirPattern
-                ):  # fix, when file startwith same prefix as directory, fix status for root repo path ""
-                    d_status = ModifiedStatus(d)
-                    break
+            if name in missing:
+                worktree = "D"
+            elif name in modified:
+                worktree = "M"
+            else:
+                worktree = "."
+
+            xy = staged.get(name, ".") + worktree
+            if name in conflicts:
+                statuses.append(self._status_from_xy(name, xy, "u"))
+            elif xy == "..":
+                statuses.append(NormalStatus(name))
+                files.append(name)
+                reported.add(name)
+                continue
+            else:
+                statuses.append(self._status_from_xy(name, xy))
+
+            files.append(name)
+            changed_paths.append(name)
+            reported.add(name)
 
-            # Check if directory is ignored
-            for ignored_path in ignored_directories:
-                if ignored_path in d:
-                    d_status = IgnoredStatus(d)
+        for name, change in staged.items():
+            if change == "D" and name not in tracked and in_scope(name):
+                statuses.append(RemovedStatus(name))
+                files.append(name)
+                changed_paths.append(name)
+                reported.add(name)
+
+        # Look for untracked and ignored items in the working tree
+        tracked_directories = set()
+        for name in tracked:
+            parent = name.rpartition("/")[0]
+            while parent and parent not in tracked_directories:
+                tracked_directories.add(parent)
+                parent = parent.rpartition("/")[0]
+
+        ignore_filter = dulwich.ignore.IgnoreFilterManager.from_repo(self.repo)
+
+        def add_untracked(item, is_directory=False):
+            if ignore_filter.is_ignored(item + "/" if is_directory else item):
+                statuses.append(IgnoredStatus(item))
+                self.ignored_paths.append(item)
+                reported.add(item)
+                return True
+
+            statuses.append(UntrackedStatus(item))
+            files.append(item)
+            changed_paths.append(item)
+            reported.add(item)
+            return False
+
+        if os.path.isdir(path):
+            for root, dirs, filenames in os.walk(path):
+                if root == self.repo.path:
+                    prefix = ""
+                else:
+                    prefix = self.get_relative_path(root) + "/"
+
+                for name in list(dirs):
+                    item = prefix + name
+                    absolute_path = root + "/" + name
+                    if name == ".git" or item in tracked:
+                        dirs.remove(name)
+                    elif os.path.islink(absolute_path):
+                        dirs.remove(name)
+                        filenames.append(name)
+                    elif item not in tracked_directories:
+                        if ignore_filter.is_ignored(item + "/"):
+                            dirs.remove(name)
+                            statuses.append(IgnoredStatus(item))
+                            self.ignored_paths.append(item)
+                            reported.add(item)
+                        elif os.path.exists(os.path.join(absolute_path, ".git")):
+                            # A nested repository is reported as a whole
+                            dirs.remove(name)
+                            add_untracked(item, True)
+
+                for name in filenames:
+                    item = prefix + name
+                    if item not in tracked:
+                        add_untracked(item)
+
+                if not recurse:
                     break
-            statuses.append(d_status)
+        elif relative_path and relative_path not in reported:
+            if os.path.lexists(path):
+                add_untracked(relative_path)
 
+        statuses += self._directory_statuses(files, changed_paths, reported, in_scope)
         return statuses
 
     def status_dulwich(self, path):
@@ -1846,11 +2035,13 @@ class GittyupClient(object):
     def get_all_ignore_file_paths(self, path):
         return self.ignored_paths
 
-    def status(self, path):
+    def status(self, path, engine="porcelain", recurse=True):
         # TODO - simply get this from the status implementation / avoid global state
         self.ignored_paths = []
 
-        return self.status_porcelain(path)
+        if engine == "native":
+            return self.status_native(path, recurse)
+        return self.status_porcelain(path, recurse)
 
     def log(self, path="", skip=0, limit=None, revision="", showtype="all"):
 
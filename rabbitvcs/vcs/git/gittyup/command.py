@@ -9,10 +9,13 @@ import fcntl
 import select
 import codecs
 import os
+import tempfile
+import time
 
 from .exceptions import GittyupCommandError
 
 from rabbitvcs.util.strings import *
+from rabbitvcs.util.stats import statistics
 
 
 def notify_func(data):
@@ -47,19 +50,24 @@ class GittyupCommand(object):
 
         return returner
 
-    def execute(self):
+    def get_environment(self):
         env = os.environ.copy()
         env["LANG"] = "C"
         env["PYTHONIOENCODING"] = "UTF-8"
         env["GIT_TERMINAL_PROMPT"] = "0"
         env["GIT_SSL_CERT_PASSWORD_PROTECTED"] = ""
+        return env
+
+    def execute(self):
+        started = time.time()
+        output_bytes = 0
         proc = subprocess.Popen(
             self.command,
             cwd=self.cwd,
             stdin=None,
             stderr=subprocess.STDOUT,
             stdout=subprocess.PIPE,
-            env=env,
+            env=self.get_environment(),
             close_fds=True,
             preexec_fn=os.setsid,
         )
@@ -72,6 +80,7 @@ class GittyupCommand(object):
 
             if line == "":
                 break
+            output_bytes += len(line.encode(UTF8_ENCODING, SURROGATE_ESCAPE))
             line = line.rstrip("\r\n")  # Strip trailing newline.
             self.notify(line)
             stdout.append(line)
@@ -79,4 +88,61 @@ class GittyupCommand(object):
             if self.cancel():
                 proc.kill()
 
+        statistics.subprocess(time.time() - started, output_bytes)
         return (0, stdout, None)
+
+    def stream(self, separator=b"\0", chunk_size=65536):
+        """
+        Runs the command and yields its output one record at a time, as the
+        output arrives.  Records are separated by the given byte, as with the
+        -z option of most git commands, and are not unquoted or stripped.
+
+        Raises GittyupCommandError if the command fails.
+
+        """
+        started = time.time()
+        output_bytes = 0
+
+        # Errors go to a file rather than a pipe, which could fill up and
+        # block git while we are still reading its output
+        errors = tempfile.TemporaryFile()
+        proc = subprocess.Popen(
+            self.command,
+            cwd=self.cwd,
+            stdin=None,
+            stderr=errors,
+            stdout=subprocess.PIPE,
+            env=self.get_environment(),
+            close_fds=True,
+            preexec_fn=os.setsid,
+        )
+
+        try:
+            pending = b""
+            while True:
+                chunk = proc.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                output_bytes += len(chunk)
+
+                records = (pending + chunk).split(separator)
+                pending = records.pop()
+                for record in records:
+                    yield record.decode(UTF8_ENCODING, SURROGATE_ESCAPE)
+
+                if self.cancel():
+                    proc.kill()
+                    break
+
+            if pending:
+                yield pending.decode(UTF8_ENCODING, SURROGATE_ESCAPE)
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+            errors.seek(0)
+            stderr = errors.read()
+            errors.close()
+            statistics.subprocess(time.time() - started, output_bytes)
+
+        if returncode != 0 and not self.cancel():
+            raise GittyupCommandError(stderr.decode(UTF8_ENCODING, SURROGATE_ESCAPE))
@@ -5,11 +5,15 @@
 
 class GittyupStatus(object):
     path = None
+    origin = None
     is_staged = False
 
-    def __init__(self, path):
+    def __init__(self, path, origin=None):
         self.path = path
 
+        # The path a renamed or copied item came from
+        self.origin = origin
+
     def __repr__(self):
         return "<Status %s %s>" % (self.path, self.identifier)
 
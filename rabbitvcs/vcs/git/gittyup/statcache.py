@@ -0,0 +1,441 @@
+from __future__ import absolute_import
+
+#
+# statcache.py
+#
+# Reads the git index and compares the stat data it stores with the working
+# tree, so that only files which may have changed need to be hashed.
+#
+
+import os
+import stat
+import struct
+import hashlib
+import binascii
+from bisect import bisect_left
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from rabbitvcs.util.strings import UTF8_ENCODING, SURROGATE_ESCAPE
+
+INDEX_SIGNATURE = b"DIRC"
+INDEX_HEADER = struct.Struct(">4sII")
+
+# ctime, ctime ns, mtime, mtime ns, dev, ino, mode, uid, gid, size, sha, flags
+ENTRY_HEADER = struct.Struct(">10I20sH")
+
+FLAG_ASSUME_VALID = 0x8000
+FLAG_EXTENDED = 0x4000
+FLAG_STAGE = 0x3000
+FLAG_NAME_LENGTH = 0x0FFF
+
+EXTENDED_SKIP_WORKTREE = 0x4000
+EXTENDED_INTENT_TO_ADD = 0x2000
+
+MODE_GITLINK = 0o160000
+
+HASH_SIZE = 20
+
+IndexEntry = namedtuple(
+    "IndexEntry",
+    [
+        "name",
+        "ctime",
+        "ctime_ns",
+        "mtime",
+        "mtime_ns",
+        "dev",
+        "ino",
+        "mode",
+        "uid",
+        "gid",
+        "size",
+        "sha",
+        "stage",
+        "assume_valid",
+        "skip_worktree",
+        "intent_to_add",
+    ],
+)
+
+
+class IndexFormatError(Exception):
+    """Indicates an index file we cannot read"""
+
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
+
+
+class GitIndex(object):
+    """
+    The entries of a git index file (versions 2 to 4, including split
+    indexes) together with its cache-tree.
+
+    """
+
+    def __init__(self, git_dir, index_path=None):
+        self.git_dir = git_dir
+        self.path = index_path or os.path.join(git_dir, "index")
+        self.entries = []
+        self.cache_tree = {}
+        self.version = None
+
+        index_stat = os.stat(self.path)
+        self.mtime = index_stat.st_mtime
+        self.mtime_ns = index_stat.st_mtime_ns
+
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        self.version, entries, extensions = _parse_index(data)
+
+        if b"TREE" in extensions:
+            self.cache_tree = _parse_cache_tree(extensions[b"TREE"])
+
+        if b"link" in extensions:
+            entries = self._merge_split_index(entries, extensions[b"link"])
+
+        self.entries = entries
+
+    def _merge_split_index(self, entries, link):
+        shared_sha = binascii.hexlify(link[:HASH_SIZE]).decode("ascii")
+        if shared_sha == "0" * (HASH_SIZE * 2):
+            return entries
+
+        shared_path = os.path.join(self.git_dir, "sharedindex.%s" % shared_sha)
+        with open(shared_path, "rb") as f:
+            version, shared, extensions = _parse_index(f.read())
+
+        deleted = set()
+        replaced = set()
+        if len(link) > HASH_SIZE:
+            deleted, offset = _read_ewah(link, HASH_SIZE)
+            replaced, offset = _read_ewah(link, offset)
+
+        merged = []
+        split = iter(entries)
+        for position, entry in enumerate(shared):
+            if position in replaced:
+                replacement = next(split)
+                if not replacement.name:
+                    replacement = replacement._replace(name=entry.name)
+                entry = replacement
+            if position not in deleted:
+                merged.append(entry)
+
+        merged.extend(split)
+        merged.sort(key=lambda entry: (entry.name, entry.stage))
+        return merged
+
+
+def _parse_index(data):
+    signature, version, count = INDEX_HEADER.unpack_from(data)
+    if signature != INDEX_SIGNATURE:
+        raise IndexFormatError("Not a git index")
+    if version not in (2, 3, 4):
+        raise IndexFormatError("Unsupported index version %d" % version)
+
+    entries = []
+    offset = INDEX_HEADER.size
+    previous_name = b""
+    make_entry = IndexEntry._make
+    hexlify = binascii.hexlify
+    for i in range(count):
+        start = offset
+        fields = ENTRY_HEADER.unpack_from(data, offset)
+        offset += ENTRY_HEADER.size
+
+        flags = fields[11]
+        extended = 0
+        if flags & FLAG_EXTENDED and version >= 3:
+            (extended,) = struct.unpack_from(">H", data, offset)
+            offset += 2
+
+        if version == 4:
+            strip, offset = _read_varint(data, offset)
+            end = data.index(b"\0", offset)
+            name = previous_name[: len(previous_name) - strip] + data[offset:end]
+            offset = end + 1
+        else:
+            length = flags & FLAG_NAME_LENGTH
+            if length == FLAG_NAME_LENGTH:
+                length = data.index(b"\0", offset) - offset
+            name = data[offset : offset + length]
+            # Entries are padded with 1-8 NULs to a multiple of eight bytes
+            offset = start + ((offset + length - start + 8) & ~7)
+
+        previous_name = name
+        entries.append(
+            make_entry(
+                (name.decode(UTF8_ENCODING, SURROGATE_ESCAPE),)
+                + fields[:10]
+                + (
+                    hexlify(fields[10]),
+                    (flags & FLAG_STAGE) >> 12,
+                    bool(flags & FLAG_ASSUME_VALID),
+                    bool(extended & EXTENDED_SKIP_WORKTREE),
+                    bool(extended & EXTENDED_INTENT_TO_ADD),
+                )
+            )
+        )
+
+    extensions = {}
+    while offset + 8 <= len(data) - HASH_SIZE:
+        signature, size = struct.unpack_from(">4sI", data, offset)
+        offset += 8
+        extensions[signature] = data[offset : offset + size]
+        offset += size
+
+    return (version, entries, extensions)
+
+
+def _read_varint(data, offset):
+    """Reads the offset encoding used for path prefixes in index v4"""
+    byte = data[offset]
+    offset += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        value += 1
+        byte = data[offset]
+        offset += 1
+        value = (value << 7) + (byte & 0x7F)
+
+    return (value, offset)
+
+
+def _read_ewah(data, offset):
+    """
+    Reads an EWAH compressed bitmap and returns the set of bit positions that
+    are set, and the offset following the bitmap.
+
+    """
+    bit_count, word_count = struct.unpack_from(">II", data, offset)
+    offset += 8
+    words = struct.unpack_from(">%dQ" % word_count, data, offset)
+    # Skip the words and the position of the last run length word
+    offset += word_count * 8 + 4
+
+    bits = set()
+    position = 0
+    i = 0
+    while i < word_count:
+        marker = words[i]
+        i += 1
+        run_length = (marker >> 1) & 0xFFFFFFFF
+        literal_count = marker >> 33
+        if marker & 1:
+            bits.update(range(position, position + run_length * 64))
+        position += run_length * 64
+
+        for word in words[i : i + literal_count]:
+            while word:
+                low = word & -word
+                bits.add(position + low.bit_length() - 1)
+                word ^= low
+            position += 64
+        i += literal_count
+
+    return (set(bit for bit in bits if bit < bit_count), offset)
+
+
+def _parse_cache_tree(data):
+    """
+    Returns a dictionary of directory paths to the hex sha of their tree, for
+    every directory whose cached tree is still valid.
+
+    """
+    cache_tree = {}
+
+    def parse(offset, prefix):
+        end = data.index(b"\0", offset)
+        name = data[offset:end].decode(UTF8_ENCODING, SURROGATE_ESCAPE)
+        offset = end + 1
+
+        end = data.index(b"\n", offset)
+        entry_count, subtree_count = data[offset:end].split(b" ")
+        offset = end + 1
+
+        path = prefix + "/" + name if prefix else name
+        if int(entry_count) >= 0:
+            cache_tree[path] = binascii.hexlify(data[offset : offset + HASH_SIZE])
+            offset += HASH_SIZE
+
+        for i in range(int(subtree_count)):
+            offset = parse(offset, path)
+
+        return offset
+
+    if data:
+        parse(0, "")
+
+    return cache_tree
+
+
+def hash_file(path, mode):
+    """Returns the hex sha of the blob git would store for the file"""
+    if stat.S_ISLNK(mode):
+        contents = os.readlink(path.encode(UTF8_ENCODING, SURROGATE_ESCAPE))
+    else:
+        with open(path, "rb") as f:
+            contents = f.read()
+
+    sha = hashlib.sha1(b"blob %d\0" % len(contents))
+    sha.update(contents)
+    return sha.hexdigest().encode("ascii")
+
+
+class StatCache(object):
+    """
+    Compares the index of a repository with the working tree.  Files whose
+    stat data matches the index are taken to be unchanged; the rest are hashed
+    in a thread pool.
+
+    """
+
+    def __init__(self, repo_path, git_dir=None, workers=None):
+        self.repo_path = repo_path
+        self.git_dir = git_dir or os.path.join(repo_path, ".git")
+        if workers is None:
+            workers = min(8, (os.cpu_count() or 1) + 4)
+        self.workers = workers
+
+    def read_index(self):
+        return GitIndex(self.git_dir)
+
+    def is_racy(self, index, entry):
+        """
+        A file modified in the same second the index was written may have
+        changed without its stat data changing, so it must be hashed.
+
+        """
+        index_mtime = (int(index.mtime), index.mtime_ns % 1000000000)
+        return (entry.mtime, entry.mtime_ns) >= index_mtime
+
+    def stat_matches(self, entry, st):
+        if entry.mode == MODE_GITLINK:
+            return True
+        if stat.S_IFMT(entry.mode) != stat.S_IFMT(st.st_mode):
+            return False
+        if stat.S_ISREG(st.st_mode) and (entry.mode ^ st.st_mode) & 0o100:
+            return False
+
+        return (
+            entry.size == st.st_size & 0xFFFFFFFF
+            and entry.mtime == int(st.st_mtime) & 0xFFFFFFFF
+            and entry.mtime_ns == st.st_mtime_ns % 1000000000
+            and entry.ctime == int(st.st_ctime) & 0xFFFFFFFF
+            and entry.ctime_ns == st.st_ctime_ns % 1000000000
+            and entry.ino == st.st_ino & 0xFFFFFFFF
+            and entry.uid == st.st_uid & 0xFFFFFFFF
+            and entry.gid == st.st_gid & 0xFFFFFFFF
+        )
+
+    def worktree_changes(self, index, entries):
+        """
+        Compares the given index entries with the working tree.
+
+        Returns a tuple of (modified names, missing names).
+
+        """
+        modified = set()
+        missing = set()
+        suspects = []
+        for entry in entries:
+            if entry.assume_valid or entry.skip_worktree:
+                continue
+
+            path = self.repo_path + "/" + entry.name
+            try:
+                st = os.lstat(path)
+            except OSError:
+                missing.add(entry.name)
+                continue
+
+            if entry.mode == MODE_GITLINK:
+                if not stat.S_ISDIR(st.st_mode):
+                    modified.add(entry.name)
+            elif stat.S_IFMT(entry.mode) != stat.S_IFMT(st.st_mode):
+                modified.add(entry.name)
+            elif entry.size != st.st_size & 0xFFFFFFFF:
+                modified.add(entry.name)
+            elif not self.stat_matches(entry, st) or self.is_racy(index, entry):
+                suspects.append((entry, path, st.st_mode))
+
+        if suspects:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                shas = executor.map(
+                    lambda suspect: self._hash(suspect[1], suspect[2]), suspects
+                )
+                for (entry, path, mode), sha in zip(suspects, shas):
+                    if sha != entry.sha:
+                        modified.add(entry.name)
+
+        return (modified, missing)
+
+    def _hash(self, path, mode):
+        try:
+            return hash_file(path, mode)
+        except (IOError, OSError):
+            return None
+
+    def staged_changes(self, index, object_store, tree_sha):
+        """
+        Compares the stage 0 entries of the index with a tree, normally the
+        tree of HEAD.  Directories whose cached tree in the index matches the
+        tree are skipped without being read.
+
+        Returns a dictionary of names to "A" (added), "D" (deleted) or "M"
+        (modified), as in the X column of git status.
+
+        """
+        entries = dict(
+            (entry.name, entry) for entry in index.entries if not entry.stage
+        )
+        names = sorted(entries)
+        in_tree = bytearray(len(names))
+        positions = dict((name, position) for position, name in enumerate(names))
+        changes = {}
+
+        def walk(tree_sha, prefix):
+            if index.cache_tree.get(prefix) == tree_sha:
+                start, end = names_under(names, prefix)
+                in_tree[start:end] = b"\1" * (end - start)
+                return
+
+            for item in object_store[tree_sha].items():
+                name = item.path.decode(UTF8_ENCODING, SURROGATE_ESCAPE)
+                path = prefix + "/" + name if prefix else name
+                if stat.S_ISDIR(item.mode):
+                    walk(item.sha, path)
+                    continue
+
+                entry = entries.get(path)
+                if entry is None:
+                    changes[path] = "D"
+                    continue
+
+                in_tree[positions[path]] = 1
+                if entry.sha != item.sha or entry.mode != item.mode:
+                    changes[path] = "M"
+
+        if tree_sha is not None:
+            walk(tree_sha, "")
+
+        for position, name in enumerate(names):
+            if not in_tree[position] or entries[name].intent_to_add:
+                changes[name] = "A"
+
+        return changes
+
+
+def names_under(names, directory):
+    """
+    Returns the slice of a sorted list of names that lie under the directory
+
+    """
+    if not directory:
+        return (0, len(names))
+
+    start = bisect_left(names, directory + "/")
+    end = bisect_left(names, directory + "0")
+    return (start, end)
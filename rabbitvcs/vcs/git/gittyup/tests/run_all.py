@@ -15,6 +15,8 @@ def cleanup(modules):
 modules = [
     "branch.py",
     "stage.py",
+    "status.py",
+    "statcache.py",
     "commit.py",
     "tag.py",
     "remove.py",
@@ -0,0 +1,131 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+#
+# test/statcache.py
+#
+
+import os
+import subprocess
+from shutil import rmtree
+from sys import argv
+from optparse import OptionParser
+
+from gittyup.client import GittyupClient
+from gittyup.objects import *
+from gittyup.statcache import GitIndex
+from util import touch, change
+
+parser = OptionParser()
+parser.add_option("-c", "--cleanup", action="store_true", default=False)
+options, args = parser.parse_args(argv)
+
+DIR = os.path.abspath("statcache")
+
+
+def git(*args):
+    subprocess.check_call(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@test"] + list(args),
+        cwd=DIR,
+    )
+
+
+def compare(g):
+    """The native engine must agree with git, apart from rename detection"""
+    g.ignored_paths = []
+    porcelain = sorted((st.path, st.identifier) for st in g.status(DIR))
+    g.ignored_paths = []
+    native = sorted((st.path, st.identifier) for st in g.status(DIR, "native"))
+    assert porcelain == native, (porcelain, native)
+    return native
+
+
+if options.cleanup:
+    rmtree(DIR, ignore_errors=True)
+
+    print("statcache.py clean")
+else:
+    if os.path.isdir(DIR):
+        raise SystemExit(
+            "This test script has already been run.  Please call this script with --cleanup to start again"
+        )
+
+    os.mkdir(DIR)
+    g = GittyupClient()
+    g.initialize_repository(DIR)
+
+    os.makedirs(DIR + "/fol/sub")
+    for i in range(20):
+        with open(DIR + "/fol/sub/test%d.txt" % i, "w") as f:
+            f.write("test %d\n" % i)
+    touch(DIR + "/test1.txt")
+    with open(DIR + "/.gitignore", "w") as f:
+        f.write("build/\n*.o\n")
+    git("add", ".")
+    git("commit", "-qm", "Test commit")
+
+    os.mkdir(DIR + "/build")
+    touch(DIR + "/build/output")
+    touch(DIR + "/fol/test.o")
+    touch(DIR + "/untracked.txt")
+
+    for version in ("2", "3", "4"):
+        git("update-index", "--index-version", version)
+        change(DIR + "/fol/sub/test%s.txt" % version)
+        st = dict(compare(g))
+        # git only writes version 3 when an entry needs extended flags
+        if version != "3":
+            assert GitIndex(DIR + "/.git").version == int(version)
+        assert st["fol/sub/test%s.txt" % version] == "modified", st
+        assert st["fol/sub"] == "modified", st
+        assert st["build"] == "ignored", st
+        assert st["untracked.txt"] == "untracked", st
+
+    # A file changed without its size changing, in the same second as the
+    # index was written, must still be seen as modified
+    with open(DIR + "/fol/sub/test10.txt", "w") as f:
+        f.write("TEST 10\n")
+    st = dict(compare(g))
+    assert st["fol/sub/test10.txt"] == "modified", st
+
+    # Staged, removed and missing files
+    git("add", "fol/sub/test2.txt")
+    git("rm", "-q", "--cached", "fol/sub/test5.txt")
+    os.remove(DIR + "/fol/sub/test6.txt")
+    st = dict(compare(g))
+    assert st["fol/sub/test6.txt"] == "missing", st
+
+    # Intent to add entries need index version 3
+    touch(DIR + "/intent.txt")
+    git("update-index", "--index-version", "2")
+    git("add", "-N", "intent.txt")
+    assert GitIndex(DIR + "/.git").version == 3
+    compare(g)
+    git("reset", "-q", "intent.txt")
+
+    # Split index
+    git("update-index", "--split-index")
+    change(DIR + "/test1.txt")
+    git("add", "test1.txt")
+    git("rm", "-q", "--cached", "fol/sub/test7.txt")
+    change(DIR + "/fol/sub/test8.txt")
+    git("add", "fol/sub/test8.txt")
+    touch(DIR + "/fol/new.txt")
+    git("add", "fol/new.txt")
+    index = GitIndex(DIR + "/.git")
+    assert [entry.name for entry in index.entries] == sorted(
+        entry.name for entry in index.entries
+    )
+    assert "fol/sub/test7.txt" not in [entry.name for entry in index.entries]
+    st = compare(g)
+    assert ("fol/new.txt", "added") in st, st
+    assert ("fol/sub/test7.txt", "removed") in st, st
+
+    # Skip-worktree entries are not compared with the working tree
+    git("update-index", "--skip-worktree", "fol/sub/test9.txt")
+    change(DIR + "/fol/sub/test9.txt")
+    g.ignored_paths = []
+    st = dict((s.path, s.identifier) for s in g.status(DIR, "native"))
+    assert st["fol/sub/test9.txt"] == "normal", st
+
+    print("statcache.py pass")
@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+#
+# test/status.py
+#
+
+import os
+import subprocess
+from shutil import rmtree
+from sys import argv
+from optparse import OptionParser
+
+from gittyup.client import GittyupClient
+from gittyup.objects import *
+from util import touch, change
+
+parser = OptionParser()
+parser.add_option("-c", "--cleanup", action="store_true", default=False)
+options, args = parser.parse_args(argv)
+
+DIR = os.path.abspath("status")
+
+if options.cleanup:
+    rmtree(DIR, ignore_errors=True)
+
+    print("status.py clean")
+else:
+    if os.path.isdir(DIR):
+        raise SystemExit(
+            "This test script has already been run.  Please call this script with --cleanup to start again"
+        )
+
+    os.mkdir(DIR)
+    g = GittyupClient()
+    g.initialize_repository(DIR)
+
+    os.mkdir(DIR + "/fol")
+    touch(DIR + "/fol/test1.txt")
+    touch(DIR + "/test2.txt")
+    touch(DIR + "/test3.txt")
+    subprocess.check_call(["git", "add", "."], cwd=DIR)
+    subprocess.check_call(
+        [
+            "git",
+            "-c",
+            "user.name=test",
+            "-c",
+            "user.email=test@test",
+            "commit",
+            "-qm",
+            "Test commit",
+        ],
+        cwd=DIR,
+    )
+
+    def status():
+        g.ignored_paths = []
+        return dict((st.path, st) for st in g.status(DIR))
+
+    # Unchanged files and folders come from the index
+    st = status()
+    assert st["fol/test1.txt"] == NormalStatus, st
+    assert st["fol"] == NormalStatus, st
+    assert st[""] == NormalStatus, st
+
+    # Changes mark every folder above them as modified
+    change(DIR + "/fol/test1.txt")
+    os.remove(DIR + "/test3.txt")
+    st = status()
+    assert st["fol/test1.txt"] == ModifiedStatus, st
+    assert st["fol"] == ModifiedStatus, st
+    assert st[""] == ModifiedStatus, st
+    assert st["test3.txt"] == MissingStatus, st
+
+    # Renames keep the path they came from
+    subprocess.check_call(["git", "mv", "test2.txt", "renamed.txt"], cwd=DIR)
+    st = status()
+    assert st["renamed.txt"] == RenamedStatus, st
+    assert st["renamed.txt"].origin == "test2.txt", st
+
+    # Untracked and ignored items
+    with open(DIR + "/.gitignore", "w") as f:
+        f.write("build/\n")
+    os.mkdir(DIR + "/build")
+    touch(DIR + "/build/output")
+    os.mkdir(DIR + "/new")
+    touch(DIR + "/new/test4.txt")
+    st = status()
+    assert st["new/test4.txt"] == UntrackedStatus, st
+    assert st["new"] == ModifiedStatus, st
+    assert st["build"] == IgnoredStatus, st
+    assert "build/output" not in st, st
+    assert "build" in g.get_all_ignore_file_paths(DIR)
+
+    print("status.py pass")
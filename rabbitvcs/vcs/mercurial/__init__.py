@@ -28,7 +28,7 @@ from __future__ import absolute_import
 import os.path
 from datetime import datetime
 
-from mercurial import commands, ui, hg
+from mercurial import commands, ui, hg, scmutil
 
 from rabbitvcs.util.strings import S
 
@@ -36,8 +36,10 @@ import rabbitvcs.vcs
 import rabbitvcs.vcs.status
 import rabbitvcs.vcs.log
 import rabbitvcs.vcs.mercurial.util
+from rabbitvcs.vcs.roots import find_root
 from rabbitvcs.vcs.branch import BranchEntry
 from rabbitvcs.util.log import Log
+from rabbitvcs.util.stats import statistics
 
 log = Log("rabbitvcs.vcs.mercurial")
 
@@ -119,7 +121,7 @@ class Mercurial(object):
             self.repository_path = repo
             self.repository = hg.repository(self.ui, self.repository_path)
 
-        self.cache = rabbitvcs.vcs.status.StatusCache()
+        self.cache = rabbitvcs.vcs.status.bounded_status_cache()
 
     def set_repository(self, path):
         self.repository_path = path
@@ -129,14 +131,7 @@ class Mercurial(object):
         return self.repository_path
 
     def find_repository_path(self, path):
-        path_to_check = path
-        while path_to_check != "/" and path_to_check != "":
-            if os.path.isdir(os.path.join(path_to_check, ".hg")):
-                return path_to_check
-
-            path_to_check = os.path.split(path_to_check)[0]
-
-        return None
+        return find_root(path, ".hg")
 
     def get_relative_path(self, path):
         if path == self.repository_path:
@@ -147,8 +142,16 @@ class Mercurial(object):
     def get_absolute_path(self, path):
         return os.path.join(self.repository_path, path).rstrip("/")
 
-    def statuses(self, path, recurse=True, invalidate=False):
-        mercurial_statuses = self.repository.status(clean=True, unknown=True)
+    def statuses(self, path, recurse=True, invalidate=False, depth=None):
+        if depth is None:
+            depth = rabbitvcs.vcs.recurse_depth(recurse)
+
+        # Statuses are not cached, every query asks the repository about the
+        # path and what is under it, which the status of a folder depends on
+        statistics.cache(self.repository_path, "misses")
+        mercurial_statuses = self.repository.status(
+            match=self._matcher(path), clean=True, unknown=True
+        )
 
         # the status method returns a series of tuples filled with files matching
         # the statuses below
@@ -201,24 +204,47 @@ class Mercurial(object):
 
             index += 1
 
-        return statuses
-
-    def status(self, path, summarize=True, invalidate=False):
-        all_statuses = self.statuses(path, invalidate=invalidate)
-
+        # Folders above the path were only told about part of their contents
+        prefix = path.rstrip("/") + "/"
+        if depth == rabbitvcs.vcs.DEPTH_EMPTY:
+            return [st for st in statuses if st.path == path]
+        elif depth == rabbitvcs.vcs.DEPTH_IMMEDIATES:
+            return [
+                st
+                for st in statuses
+                if st.path == path or os.path.dirname(st.path) == path
+            ]
+
+        return [st for st in statuses if st.path == path or st.path.startswith(prefix)]
+
+    def _matcher(self, path):
+        """
+        Returns a matcher limiting a status query to the path and everything
+        under it, or None for the whole repository.
+
+        """
+        relative_path = self.get_relative_path(path)
+        if not relative_path:
+            return None
+
+        return scmutil.match(self.repository[None], ["path:" + relative_path])
+
+    def invalidate(self, path, recurse=False):
+        self.cache.invalidate(path, recurse)
+
+    def status(
+        self, path, summarize=True, invalidate=False, depth=rabbitvcs.vcs.DEPTH_INFINITY
+    ):
+        # The status of a folder already accounts for everything under it
+        all_statuses = self.statuses(
+            path, invalidate=invalidate, depth=rabbitvcs.vcs.DEPTH_EMPTY
+        )
+        if not all_statuses:
+            return rabbitvcs.vcs.status.Status.status_unknown(path)
+
+        path_status = all_statuses[0]
         if summarize:
-            path_status = None
-            for st in all_statuses:
-                if st.path == path:
-                    path_status = st
-                    break
-
-            if path_status:
-                path_status.summary = path_status.single
-            else:
-                path_status = rabbitvcs.vcs.status.Status.status_unknown(path)
-        else:
-            path_status = all_statuses[0]
+            path_status.summary = path_status.single
 
         return path_status
 
@@ -231,7 +257,7 @@ class Mercurial(object):
         if self.is_working_copy(path):
             return True
 
-        return self.find_repository_path(os.path.split(path)[0]) != ""
+        return self.find_repository_path(os.path.split(path)[0]) is not None
 
     def is_versioned(self, path):
         if self.is_working_copy(path):
@@ -0,0 +1,190 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+A pool of backend clients, one per repository.
+
+Opening a repository means reading its configuration and ignore files, so
+clients are kept around and reused for as long as they are in use, up to a
+limited number of repositories.
+"""
+
+from __future__ import absolute_import
+
+import time
+import threading
+import unittest
+from collections import OrderedDict
+
+from rabbitvcs.util.log import Log
+
+log = Log("rabbitvcs.vcs.pool")
+
+
+class ClientPool(object):
+    def __init__(self, factory, max_size=16, idle_timeout=600):
+        """
+        @type   factory: callable
+        @param  factory: Called with a repository root, returns a new client
+            for that repository
+
+        @type   max_size: integer
+        @param  max_size: The most clients to keep, least recently used ones
+            are dropped first
+
+        @type   idle_timeout: integer
+        @param  idle_timeout: Drop clients unused for this many seconds
+
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        # Repository root -> (client, time of last use), least recent first
+        self.clients = OrderedDict()
+        self.lock = threading.Lock()
+
+        # When idle clients were last looked for.  Hits look for them too, at
+        # most this often, so that they are let go while the pool is in use.
+        self.pruned = time.time()
+        self.prune_interval = max(1, min(60, idle_timeout))
+
+    def get(self, root):
+        """
+        Returns the client for the repository, creating it if needed.
+
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.clients.pop(root, None)
+            if entry is not None:
+                self.clients[root] = (entry[0], now)
+                if now - self.pruned >= self.prune_interval:
+                    self._prune(now)
+                return entry[0]
+
+        # Open the repository outside the lock so that other repositories are
+        # not held up; if another thread got there first, use its client
+        client = self.factory(root)
+
+        with self.lock:
+            entry = self.clients.pop(root, None)
+            if entry is not None:
+                client = entry[0]
+            self.clients[root] = (client, now)
+            self._prune(now)
+
+        return client
+
+    def recent(self):
+        """
+        Returns the most recently used client, or None.
+
+        """
+        with self.lock:
+            if self.clients:
+                return next(reversed(self.clients.values()))[0]
+        return None
+
+    def clients_under(self, path):
+        """
+        Returns the clients of every repository at or below the path.
+
+        """
+        prefix = path.rstrip("/") + "/"
+        with self.lock:
+            return [
+                client
+                for root, (client, last_used) in self.clients.items()
+                if root == path or root.startswith(prefix)
+            ]
+
+    def clear(self):
+        with self.lock:
+            self.clients.clear()
+
+    def _prune(self, now):
+        self.pruned = now
+        while self.clients:
+            root, (client, last_used) = next(iter(self.clients.items()))
+            if (
+                len(self.clients) <= self.max_size
+                and now - last_used < self.idle_timeout
+            ):
+                break
+
+            log.debug("Dropping client for %s" % root)
+            del self.clients[root]
+
+    def __len__(self):
+        return len(self.clients)
+
+
+class TestClientPool(unittest.TestCase):
+    def setUp(self):
+        self.created = []
+        self.pool = ClientPool(self.factory, max_size=2, idle_timeout=60)
+
+    def factory(self, root):
+        self.created.append(root)
+        return "client for %s" % root
+
+    def test_reuse(self):
+        self.assertEqual(self.pool.get("/a"), "client for /a")
+        self.pool.get("/a")
+        self.assertEqual(self.created, ["/a"])
+        self.assertEqual(self.pool.recent(), "client for /a")
+
+    def test_lru(self):
+        self.pool.get("/a")
+        self.pool.get("/b")
+        self.pool.get("/a")
+        self.pool.get("/c")
+        self.assertEqual(list(self.pool.clients.keys()), ["/a", "/c"])
+
+    def test_idle(self):
+        self.pool.get("/a")
+        self.pool.clients["/a"] = ("client for /a", time.time() - 120)
+        self.pool.get("/b")
+        self.assertEqual(list(self.pool.clients.keys()), ["/b"])
+
+    def test_idle_hits(self):
+        self.pool.get("/a")
+        self.pool.get("/b")
+        self.pool.clients["/a"] = ("client for /a", time.time() - 120)
+
+        # Hits only look for idle clients every so often
+        self.pool.get("/b")
+        self.assertEqual(len(self.pool), 2)
+        self.pool.pruned -= self.pool.prune_interval
+        self.pool.get("/b")
+        self.assertEqual(list(self.pool.clients.keys()), ["/b"])
+
+    def test_clients_under(self):
+        self.pool.get("/a")
+        self.pool.get("/a/b")
+        self.assertEqual(len(self.pool.clients_under("/a")), 2)
+        self.assertEqual(self.pool.clients_under("/a/b/c"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
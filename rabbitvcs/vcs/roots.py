@@ -0,0 +1,271 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Working copy root discovery.
+
+Finding the working copy of a path means looking for an administrative
+folder (.git, .svn, .hg) in the path and each of its ancestors.  This is done
+for every file Nautilus shows, so the answers are cached per directory.
+
+For each directory we remember which administrative folders it contains and
+the nearest working copy root of every kind at or above it, which is computed
+from its parent.  One walk up from a path thus fills in the answer for every
+directory on the way, and looking up any of them again, or any file in them,
+costs one stat of the directory to check that its modification time has not
+changed, plus one for each working copy root found above it.  Directories
+outside any working copy are cached the same way.
+
+Adding or removing an administrative folder changes the modification time of
+its directory.  When such a change is seen, every cached answer is checked
+again from scratch the next time it is asked for.  A working copy created
+above a directory already looked up is noticed once its own directory is
+looked at, which Nautilus does when it is shown.
+"""
+
+from __future__ import absolute_import
+
+import os
+import os.path
+import stat
+import shutil
+import tempfile
+import threading
+import unittest
+
+MARKERS = (".svn", ".git", ".hg")
+
+
+class RootCache(object):
+    def __init__(self, markers=MARKERS):
+        """
+        @type   markers: tuple
+        @param  markers: The administrative folders to look for
+
+        """
+        self.markers = markers
+
+        # Bumped whenever an administrative folder appears or disappears, to
+        # make every cached answer stale
+        self.generation = 0
+
+        # Directory -> (mtime, generation, markers it contains,
+        #               {marker: nearest root at or above it})
+        self.directories = {}
+
+        # Guards the two above, lookups are made from several worker threads.
+        # Walks are made outside of it, at worst two threads look at the same
+        # directory.
+        self.lock = threading.Lock()
+
+    def roots(self, path):
+        """
+        Returns a dictionary mapping each administrative folder name to the
+        nearest directory at or above path that contains it.
+
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+
+        if st is None or not stat.S_ISDIR(st.st_mode):
+            # Files do not contain administrative folders, nor do paths that
+            # do not exist (yet)
+            parent = os.path.dirname(path)
+            if not parent or parent == path:
+                return {}
+            return self.roots(parent)
+
+        with self.lock:
+            entry = self.directories.get(path)
+        if entry is not None and entry[0] == st.st_mtime_ns:
+            # Make sure the working copies found above are still there
+            for root in set(entry[3].values()):
+                if root != path:
+                    self.roots(root)
+
+            if entry[1] == self.generation:
+                return entry[3]
+
+        found = tuple(
+            marker
+            for marker in self.markers
+            if os.path.isdir(os.path.join(path, marker))
+        )
+        with self.lock:
+            if entry is not None and entry[2] != found:
+                self.generation += 1
+            # If it changes again before the answer is stored, the answer is
+            # stale and checked again next time
+            generation = self.generation
+
+        # The root directory itself is never treated as a working copy
+        parent = os.path.dirname(path)
+        if parent == path:
+            nearest = {}
+        else:
+            nearest = parent and self.roots(parent) or {}
+            if found:
+                nearest = dict(nearest)
+                for marker in found:
+                    nearest[marker] = path
+
+        with self.lock:
+            self.directories[path] = (st.st_mtime_ns, generation, found, nearest)
+        return nearest
+
+    def find(self, path, marker):
+        """
+        Returns the nearest directory at or above path that contains the
+        given administrative folder, or None.
+
+        """
+        return self.roots(path).get(marker)
+
+    def guess(self, path, markers):
+        """
+        Returns the innermost working copy of path as a (marker, root) tuple,
+        or (None, None) if path is not in a working copy.  When a directory
+        contains several administrative folders, the first one in markers is
+        picked.
+
+        @type   markers: list
+        @param  markers: The administrative folders to consider, in order of
+            preference
+
+        """
+        nearest = self.roots(path)
+
+        found = (None, None)
+        for marker in markers:
+            root = nearest.get(marker)
+            if root is not None and (found[1] is None or len(root) > len(found[1])):
+                found = (marker, root)
+
+        return found
+
+    def clear(self):
+        with self.lock:
+            self.directories = {}
+            self.generation += 1
+
+
+_cache = RootCache()
+
+
+def find_root(path, marker):
+    """
+    Returns the nearest directory at or above path that contains the given
+    administrative folder (e.g. ".git"), or None.
+
+    """
+    return _cache.find(path, marker)
+
+
+def guess_root(path, markers):
+    """
+    Returns the innermost working copy of path, considering the given
+    administrative folders, as a (marker, root) tuple.
+
+    """
+    return _cache.guess(path, markers)
+
+
+class TestRootCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp())
+        self.cache = RootCache()
+
+        self.outer = os.path.join(self.tmpdir, "outer")
+        self.inner = os.path.join(self.outer, "a", "inner")
+        os.makedirs(os.path.join(self.outer, ".git"))
+        os.makedirs(os.path.join(self.inner, ".svn"))
+        os.makedirs(os.path.join(self.inner, "b", "c"))
+        open(os.path.join(self.inner, "b", "file"), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_find(self):
+        path = os.path.join(self.inner, "b", "file")
+        self.assertEqual(self.cache.find(path, ".git"), self.outer)
+        self.assertEqual(self.cache.find(path, ".svn"), self.inner)
+        self.assertEqual(self.cache.find(path, ".hg"), None)
+        self.assertEqual(self.cache.find(self.tmpdir, ".git"), None)
+        self.assertEqual(
+            self.cache.find(os.path.join(self.outer, "missing", "x"), ".git"),
+            self.outer,
+        )
+
+    def test_guess(self):
+        path = os.path.join(self.inner, "b")
+        self.assertEqual(self.cache.guess(path, [".git", ".svn"]), (".svn", self.inner))
+        self.assertEqual(self.cache.guess(path, [".git"]), (".git", self.outer))
+        self.assertEqual(self.cache.guess(self.tmpdir, [".git"]), (None, None))
+
+    def test_one_walk(self):
+        self.cache.roots(os.path.join(self.inner, "b", "c"))
+        for path in (self.outer, os.path.join(self.outer, "a"), self.inner):
+            self.assertTrue(path in self.cache.directories)
+
+    def test_threads(self):
+        paths = [
+            os.path.join(self.inner, "b", "c"),
+            os.path.join(self.inner, "b", "file"),
+            os.path.join(self.outer, "a"),
+        ]
+        results = []
+
+        def look_up(path):
+            for i in range(50):
+                results.append((path, self.cache.find(path, ".svn")))
+                self.cache.clear()
+
+        threads = [threading.Thread(target=look_up, args=(path,)) for path in paths]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        expected = {paths[0]: self.inner, paths[1]: self.inner, paths[2]: None}
+        self.assertEqual(len(results), 150)
+        for path, root in results:
+            self.assertEqual(root, expected[path])
+
+    def test_marker_changes(self):
+        path = os.path.join(self.inner, "b", "c")
+        self.assertEqual(self.cache.find(path, ".hg"), None)
+
+        os.makedirs(os.path.join(self.outer, ".hg"))
+        os.utime(self.outer, ns=(0, 0))
+        # Noticed once the directory holding the new folder is looked at
+        self.cache.find(self.outer, ".hg")
+        self.assertEqual(self.cache.find(path, ".hg"), self.outer)
+
+        shutil.rmtree(os.path.join(self.inner, ".svn"))
+        os.utime(self.inner, ns=(0, 0))
+        self.assertEqual(self.cache.find(path, ".svn"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,475 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Repository-wide status snapshots.
+
+A snapshot holds the statuses of one repository, as produced by scans of the
+whole repository or of the folders queries were made about.  Every query for
+a path under a scanned folder is answered from the snapshot until it is
+invalidated or the folder is evicted to stay within the cache limits, and
+concurrent queries made while a scan is running wait for that scan instead of
+starting their own.
+"""
+
+from __future__ import absolute_import
+
+import os.path
+import threading
+import unittest
+
+import rabbitvcs.vcs.status
+from rabbitvcs.vcs.status import parent_path
+
+from rabbitvcs.util.log import Log
+from rabbitvcs.util.stats import statistics
+
+log = Log("rabbitvcs.vcs.snapshot")
+
+
+class StatusSnapshot(object):
+    def __init__(self, root, new_cache=None):
+        """
+        @type   root: string
+        @param  root: The root of the repository
+
+        @type   new_cache: callable
+        @param  new_cache: Returns an empty status cache, limited by the
+            settings by default
+
+        """
+        self.root = root
+        self.new_cache = new_cache or rabbitvcs.vcs.status.bounded_status_cache
+        self.generation = 0
+        self.scanned_generation = None
+        self.flight = 0
+
+        # The folders scanned in the generation of the cache, those of which
+        # only the items directly in them were, and the one being scanned
+        self.scopes = set()
+        self.shallow = set()
+        self.scanning = None
+        self.scanning_recurse = True
+        self.condition = threading.Condition()
+
+        # The paths the cache evicted since it was last filled
+        self.cache, self.evicted = self._build([])
+
+    def contains(self, path):
+        """
+        Whether the path belongs to the repository of this snapshot.
+
+        """
+        return within(path, self.root)
+
+    def invalidate(self):
+        """
+        Start a new generation.  The next query rescans the repository.
+
+        """
+        with self.condition:
+            if self.is_current():
+                statistics.cache(self.root, "evictions", len(self.cache))
+            self.generation += 1
+
+    def preload(self, statuses):
+        """
+        Use statuses saved earlier as the current ones, unless the repository
+        has been scanned already.
+
+        """
+        cache, evicted = self._build(statuses)
+        with self.condition:
+            if evicted:
+                # Too large to keep in full, the repository is scanned when
+                # it is first queried
+                return
+            if self.scanned_generation is None and self.scanning is None:
+                self.cache, self.evicted = cache, evicted
+                self.scanned_generation = self.generation
+                self.scopes = set([self.root])
+                self.shallow = set()
+
+    def is_current(self):
+        return self.scanned_generation == self.generation
+
+    def covers(self, scope):
+        """
+        Whether the folder, or one above it, was scanned in the current
+        generation.
+
+        """
+        if not self.is_current():
+            return False
+
+        path = scope
+        while path not in self.scopes:
+            parent = parent_path(path)
+            if parent == path or not self.contains(parent):
+                return False
+            path = parent
+
+        return True
+
+    def covers_items(self, scope):
+        """
+        Whether the items directly in the folder were scanned in the current
+        generation.
+
+        """
+        return self.covers(scope) or (self.is_current() and scope in self.shallow)
+
+    def refresh(self, scan, scope=None, recurse=True):
+        """
+        Make sure the snapshot reflects the current generation for the items
+        under a folder, scanning that folder if it does not.  If a scan is
+        already running, wait for it and use its results if it covers the
+        folder.
+
+        @type   scan: callable
+        @param  scan: Called with a folder and recurse, returns a list of
+            status objects for that folder and every path under it, or for
+            the items directly in it if recurse is False
+
+        @type   scope: string
+        @param  scope: The folder to scan, the repository root by default
+
+        @type   recurse: boolean
+        @param  recurse: False if only the items directly in the folder are
+            needed.  Its subfolders are then only known if they were scanned.
+
+        """
+        if scope is None:
+            scope = self.root
+
+        if recurse:
+            covers = self.covers
+        else:
+            covers = self.covers_items
+
+        with self.condition:
+            if covers(scope):
+                statistics.cache(self.root, "hits")
+                return
+
+            statistics.cache(self.root, "misses")
+            while self.scanning is not None:
+                flight = self.flight
+                if self.scanning_recurse:
+                    covering = within(scope, self.scanning)
+                else:
+                    covering = not recurse and scope == self.scanning
+                while self.scanning is not None and self.flight == flight:
+                    self.condition.wait()
+                if covering or covers(scope):
+                    return
+
+            self.scanning = scope
+            self.scanning_recurse = recurse
+            self.flight += 1
+            generation = self.generation
+
+        statuses = None
+        built = None
+        try:
+            statuses = scan(scope, recurse)
+            if scope == self.root and recurse:
+                built = self._build(statuses)
+        finally:
+            with self.condition:
+                if statuses is not None:
+                    if built is None and self.scanned_generation == generation:
+                        if recurse:
+                            self._merge(scope, statuses)
+                        else:
+                            self._merge_items(scope, statuses)
+                    else:
+                        # Statuses of an older generation are of no use
+                        if built is None:
+                            built = self._build(statuses)
+                        self.cache, self.evicted = built
+                        if recurse:
+                            self.scopes = set([scope])
+                            self.shallow = set()
+                        else:
+                            self.scopes = set()
+                            self.shallow = set([scope])
+                        # If the repository changed during the scan, the
+                        # generation has moved on and the next query scans
+                        # again.
+                        self.scanned_generation = generation
+                    self._forget_evicted(scope)
+                self.scanning = None
+                self.condition.notify_all()
+
+    def _merge(self, scope, statuses):
+        # What was known about the folder is replaced, paths that are gone
+        # included.  Ancestors are dropped as well, only the root scan or one
+        # of their own folders can tell their status.
+        self.cache.invalidate(scope, recurse=True)
+        for status in statuses:
+            self.cache[status.path] = status
+
+        self.scopes = set(path for path in self.scopes if not within(path, scope))
+        self.scopes.add(scope)
+        self.shallow = set(path for path in self.shallow if not within(path, scope))
+
+    def _merge_items(self, scope, statuses):
+        # The items directly in the folder are replaced, except for the
+        # subfolders scanned in full, which the scan did not look into.
+        # Nothing else changed since the generation is the same.
+        for child in self.cache.children(scope):
+            if child not in self.scopes:
+                del self.cache[child]
+        for status in statuses:
+            self.cache[status.path] = status
+
+        self.shallow.add(scope)
+
+    def _build(self, statuses):
+        # Returns the cache along with the set the paths it evicts go to
+        evicted = set()
+        cache = self.new_cache()
+        cache.on_evict = evicted.add
+        for status in statuses:
+            cache[status.path] = status
+
+        return cache, evicted
+
+    def _forget_evicted(self, scope):
+        # A path missing from a snapshot is one the scan did not report, so
+        # the folders the cache evicted statuses from are not complete
+        # anymore.  They are forgotten, along with what is left under them,
+        # and scanned again as a whole when queried.  What is under the folder
+        # just scanned is kept, since it is queried next, even if it does not
+        # fit and has to be scanned again each time.
+        if not self.evicted:
+            return
+
+        statistics.cache(self.root, "evictions", len(self.evicted))
+        scopes = self.scopes | self.shallow
+        dropped = set()
+        for path in self.evicted:
+            while self.contains(path):
+                if path in scopes:
+                    dropped.add(path)
+                parent = parent_path(path)
+                if parent == path:
+                    break
+                path = parent
+        self.evicted.clear()
+
+        self.scopes -= dropped
+        self.shallow -= dropped
+        for folder in dropped:
+            if within(scope, folder):
+                continue
+            # The folder itself stays, the items above it may rely on it, and
+            # so do the folders still scanned under it
+            for path in self.cache.subtree(folder):
+                if not self.covers(path) and parent_path(path) not in self.shallow:
+                    del self.cache[path]
+
+    def status(self, path):
+        """
+        Returns the status of a single path, or None if the scan did not
+        report it.
+
+        """
+        with self.condition:
+            if path in self.cache:
+                return self.cache[path]
+        return None
+
+    def content(self, path):
+        """
+        Returns the content status of a single path, or None if the scan did
+        not report it.
+
+        """
+        with self.condition:
+            return self.cache.content(path)
+
+    def summary(self, path, recurse=True, single=None):
+        """
+        Returns the summary status of a path, from everything under it or only
+        from the items directly under it, or None if the scan did not report
+        it and its own single status is not given.
+
+        """
+        with self.condition:
+            return self.cache.summary(path, recurse, single)
+
+    def statuses(self, path, recurse=False):
+        """
+        Returns the status of the path and of the items directly under it, or
+        of everything under it if recurse is True.
+
+        """
+        with self.condition:
+            return self.cache.find_path_statuses(path, recurse)
+
+
+def within(path, folder):
+    """
+    Whether the path is the folder or lies under it.
+
+    """
+    return path == folder or path.startswith(folder.rstrip("/") + "/")
+
+
+class TestStatusSnapshot(unittest.TestCase):
+    root = "/path/to/repo"
+
+    def scan(self, scope, recurse=True):
+        self.scans += 1
+        statuses = [
+            rabbitvcs.vcs.status.Status(self.root, "normal"),
+            rabbitvcs.vcs.status.Status(os.path.join(self.root, "a"), "modified"),
+            rabbitvcs.vcs.status.Status(os.path.join(self.root, "a", "b"), "modified"),
+            rabbitvcs.vcs.status.Status(os.path.join(self.root, "c"), "normal"),
+            rabbitvcs.vcs.status.Status(os.path.join(self.root, "d"), "normal"),
+        ]
+        if not recurse:
+            # Only the files directly in the folder
+            folders = set(parent_path(st.path) for st in statuses)
+            return [
+                st
+                for st in statuses
+                if parent_path(st.path) == scope and st.path not in folders
+            ]
+        return [st for st in statuses if within(st.path, scope)]
+
+    def setUp(self):
+        self.scans = 0
+        self.snapshot = StatusSnapshot(self.root)
+
+    def test_statuses(self):
+        self.snapshot.refresh(self.scan)
+        paths = [st.path for st in self.snapshot.statuses(self.root)]
+        self.assertEqual(
+            sorted(paths),
+            [self.root, self.root + "/a", self.root + "/c", self.root + "/d"],
+        )
+
+        paths = [st.path for st in self.snapshot.statuses(self.root, recurse=True)]
+        self.assertEqual(len(paths), 5)
+        self.assertEqual(self.snapshot.status(self.root + "/x"), None)
+
+    def test_generations(self):
+        self.snapshot.refresh(self.scan)
+        self.snapshot.refresh(self.scan)
+        self.assertEqual(self.scans, 1)
+
+        self.snapshot.invalidate()
+        self.snapshot.refresh(self.scan)
+        self.assertEqual(self.scans, 2)
+
+    def test_scopes(self):
+        self.snapshot.refresh(self.scan, self.root + "/a")
+        self.assertEqual(self.snapshot.status(self.root + "/c"), None)
+        self.assertEqual(self.snapshot.summary(self.root + "/a"), "modified")
+
+        self.snapshot.refresh(self.scan, self.root + "/a/b")
+        self.assertEqual(self.scans, 1)
+
+        self.snapshot.refresh(self.scan, self.root + "/c")
+        self.assertEqual(self.scans, 2)
+        self.assertEqual(
+            self.snapshot.scopes, set([self.root + "/a", self.root + "/c"])
+        )
+        self.assertEqual(len(self.snapshot.statuses(self.root, recurse=True)), 3)
+
+        # Only the items directly in the root are scanned, the subfolders
+        # scanned before are kept
+        self.snapshot.refresh(self.scan, self.root, recurse=False)
+        self.snapshot.refresh(self.scan, self.root, recurse=False)
+        self.assertEqual(self.scans, 3)
+        paths = [st.path for st in self.snapshot.statuses(self.root)]
+        self.assertEqual(
+            sorted(paths), [self.root + "/a", self.root + "/c", self.root + "/d"]
+        )
+        self.assertEqual(self.snapshot.summary(self.root + "/a"), "modified")
+
+        self.snapshot.refresh(self.scan)
+        self.snapshot.refresh(self.scan, self.root + "/a")
+        self.snapshot.refresh(self.scan, self.root + "/a", recurse=False)
+        self.assertEqual(self.scans, 4)
+        self.assertEqual(self.snapshot.summary(self.root, recurse=False), "modified")
+
+        self.snapshot.invalidate()
+        self.snapshot.refresh(self.scan, self.root + "/c")
+        self.assertEqual(self.scans, 5)
+        self.assertEqual(self.snapshot.status(self.root + "/a"), None)
+
+    def test_bounded(self):
+        snapshot = StatusSnapshot(
+            self.root, lambda: rabbitvcs.vcs.status.StatusCache(max_entries=3)
+        )
+        snapshot.refresh(self.scan, self.root + "/a")
+        snapshot.refresh(self.scan, self.root + "/c")
+        snapshot.status(self.root + "/a/b")
+        snapshot.refresh(self.scan, self.root + "/d")
+
+        # /a and /c were the least recently used, what is left of /a goes too
+        self.assertEqual(snapshot.scopes, set([self.root + "/d"]))
+        self.assertEqual(len(snapshot.statuses(self.root, recurse=True)), 1)
+
+        snapshot.refresh(self.scan, self.root + "/a")
+        self.assertEqual(self.scans, 4)
+        self.assertEqual(snapshot.summary(self.root + "/a"), "modified")
+
+    def test_preload(self):
+        self.snapshot.preload(self.scan(self.root))
+        self.snapshot.refresh(self.scan)
+        self.assertEqual(self.scans, 1)
+        self.assertEqual(self.snapshot.summary(self.root), "modified")
+
+    def test_single_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_scan(root, recurse=True):
+            started.set()
+            release.wait()
+            return self.scan(root, recurse)
+
+        threads = [
+            threading.Thread(target=self.snapshot.refresh, args=(slow_scan,))
+            for i in range(4)
+        ]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.scans, 1)
+        self.assertEqual(
+            self.snapshot.status(self.root + "/a/b").path, self.root + "/a/b"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -25,6 +25,8 @@ from __future__ import absolute_import
 import os.path
 import unittest
 import six
+from array import array
+from collections import OrderedDict
 
 from datetime import datetime
 
@@ -32,10 +34,13 @@ import rabbitvcs.vcs
 from rabbitvcs.util.strings import S
 
 from rabbitvcs.util.log import Log
+from rabbitvcs.util.settings import SettingsManager
 from six.moves import range
 
 log = Log("rabbitvcs.vcs.status")
 
+settings = SettingsManager()
+
 from rabbitvcs import gettext
 
 _ = gettext.gettext
@@ -66,6 +71,88 @@ MODIFIED_CHILD_STATUSES = [
     status_replaced,
 ]
 
+# A rough estimate of the memory taken by a cached status, besides its path:
+# its row number and slots in the cache and in the tree, and its columns
+ENTRY_SIZE = 140
+
+# When over budget, a cache evicts down to this fraction of it at once, so
+# that the least recently used statuses are only looked for now and then
+EVICTION_TARGET = 0.9
+
+# Stored in the date column of a StatusCache for statuses without a date
+NO_DATE = -(2**63)
+
+
+def parent_path(path):
+    """
+    Same as os.path.dirname() for the normalized paths kept in caches, only
+    faster, since caches look at every directory above the paths they keep.
+
+    """
+    index = path.rfind("/")
+    if index <= 0:
+        return path[: index + 1]
+    return path[:index]
+
+
+class InternTable(object):
+    """
+    Keeps each distinct value (e.g. an author) once, for the entries that use
+    it, and lets it go when the last one is gone.
+
+    """
+
+    def __init__(self):
+        self.values = []
+        self.refs = []
+        self.index = {}
+        self.free = []
+
+    def add(self, value):
+        try:
+            position = self.index.get(value)
+        except TypeError:
+            # Not hashable, fall back to a linear search
+            position = None
+            for candidate, ref in enumerate(self.refs):
+                if ref and self.values[candidate] == value:
+                    position = candidate
+                    break
+
+        if position is None:
+            if self.free:
+                position = self.free.pop()
+                self.values[position] = value
+                self.refs[position] = 0
+            else:
+                position = len(self.values)
+                self.values.append(value)
+                self.refs.append(0)
+            try:
+                self.index[value] = position
+            except TypeError:
+                pass
+
+        self.refs[position] += 1
+        return position
+
+    def release(self, position):
+        self.refs[position] -= 1
+        if not self.refs[position]:
+            try:
+                if self.index.get(self.values[position]) == position:
+                    del self.index[self.values[position]]
+            except TypeError:
+                pass
+            self.values[position] = None
+            self.free.append(position)
+
+    def __getitem__(self, position):
+        return self.values[position]
+
+    def __len__(self):
+        return len(self.values) - len(self.free)
+
 
 class StatusCache(object):
     keys = [
@@ -86,86 +173,373 @@ class StatusCache(object):
         status_error,
     ]
 
-    authors = []
-    revisions = []
+    key_index = dict((key, index) for index, key in enumerate(keys))
 
-    def __init__(self):
-        self.cache = {}
+    def __init__(self, max_entries=None, max_bytes=None, on_evict=None):
+        """
+        @type   max_entries: integer
+        @param  max_entries: The most statuses to keep, None for no limit
 
-    def __setitem__(self, path, status):
-        try:
-            content_index = self.keys.index(status.simple_content_status())
-            metadata_index = self.keys.index(status.simple_metadata_status())
+        @type   max_bytes: integer
+        @param  max_bytes: The most memory (roughly) to use, None for no limit
 
-            try:
-                author_index = self.authors.index(status.author)
-            except ValueError as e:
-                self.authors.append(status.author)
-                author_index = len(self.authors) - 1
+        @type   on_evict: callable
+        @param  on_evict: Called with each path evicted to stay within the
+            limits, before the directories above it go too
 
-            try:
-                revision_index = self.revisions.index(status.revision)
-            except ValueError as e:
-                self.revisions.append(status.revision)
-                revision_index = len(self.revisions) - 1
-
-            self.cache[path] = (
-                status.__class__,
-                content_index,
-                metadata_index,
-                revision_index,
-                author_index,
-                status.date,
-            )
-        except Exception as e:
-            log.debug(e)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.size = 0
+        self.evicted = 0
+        self.uncacheable = 0
+
+        # Maps each cached path to its row in the columns below, the least
+        # recently used first, see _prune()
+        self.rows = OrderedDict()
+
+        # Statuses are stored by column, as small integers referring to keys
+        # or to the tables below.  Rows of deleted paths are reused.
+        self.class_column = array("H")
+        self.content_column = array("B")
+        self.metadata_column = array("B")
+        self.single_column = array("B")
+        self.revision_column = array("L")
+        self.author_column = array("L")
+        self.date_column = array("q")
+        self.free_rows = []
+
+        # Each distinct status class, author and revision is kept once
+        self.classes = InternTable()
+        self.authors = InternTable()
+        self.revisions = InternTable()
+
+        # Maps each directory on the way to a cached path to a list of the
+        # paths directly under it, so that children and subtrees are found
+        # without scanning every key
+        self.tree = {}
+
+        # Maps each directory to the number of items under it (at any depth)
+        # with each single status, indexed like keys
+        self.counts = {}
+
+    def __setitem__(self, path, status):
+        content_index = self.key_index.get(status.simple_content_status())
+        metadata_index = self.key_index.get(status.simple_metadata_status())
+        single_index = self.key_index.get(status.single)
+        date = status.date
+        if date is None:
+            date = NO_DATE
+        elif isinstance(date, six.integer_types + (float,)):
+            date = int(date)
+        else:
+            date = None
+
+        if None in (content_index, metadata_index, single_index, date):
+            # A status the columns cannot hold, e.g. one of a kind they have
+            # no key for, is not cached and is looked up again next time
+            if not self.uncacheable:
+                log.debug("Not caching statuses such as %s" % status)
+            self.uncacheable += 1
+            return
+
+        row = self.rows.get(path)
+        if row is None:
+            self._link(path)
+            self.size += ENTRY_SIZE + len(path)
+            row = self.rows[path] = self._new_row()
+            self._count(path, single_index, 1)
+        else:
+            self.rows.move_to_end(path)
+            self._release(row)
+            previous = self.single_column[row]
+            if previous != single_index:
+                self._count(path, previous, -1)
+                self._count(path, single_index, 1)
+
+        self.class_column[row] = self.classes.add(status.__class__)
+        self.content_column[row] = content_index
+        self.metadata_column[row] = metadata_index
+        self.single_column[row] = single_index
+        self.revision_column[row] = self.revisions.add(status.revision)
+        self.author_column[row] = self.authors.add(status.author)
+        self.date_column[row] = date
+
+        self._prune(path)
 
     def __getitem__(self, path):
-        try:
-            (
-                statusclass,
-                content_index,
-                metadata_index,
-                revision_index,
-                author_index,
-                date,
-            ) = self.cache[path]
-
-            content = self.keys[content_index]
-            metadata = self.keys[metadata_index]
-            revision = self.revisions[revision_index]
-            author = self.authors[author_index]
-
-            status = Status(
-                path, content, metadata, revision=revision, author=author, date=date
-            )
-            status.__class__ = statusclass
-            return status
-        except Exception as e:
-            log.debug(e)
+        row = self.rows.get(path)
+        if row is None:
+            log.debug("%s is not cached" % path)
+            return None
+
+        self.rows.move_to_end(path)
+        date = self.date_column[row]
+        return self.classes[self.class_column[row]].restore(
+            path,
+            self.keys[self.content_column[row]],
+            self.keys[self.metadata_column[row]],
+            self.keys[self.single_column[row]],
+            self.revisions[self.revision_column[row]],
+            self.authors[self.author_column[row]],
+            None if date == NO_DATE else date,
+        )
 
     def __delitem__(self, path):
         try:
-            del self.cache[path]
+            row = self.rows.pop(path)
         except KeyError as e:
             log.debug(e)
+            return
+
+        self._count(path, self.single_column[row], -1)
+        self._release(row)
+        self.free_rows.append(row)
+        self.size -= ENTRY_SIZE + len(path)
+        self._unlink(path)
+
+    def _new_row(self):
+        if self.free_rows:
+            return self.free_rows.pop()
+
+        for column in (
+            self.class_column,
+            self.content_column,
+            self.metadata_column,
+            self.single_column,
+            self.revision_column,
+            self.author_column,
+            self.date_column,
+        ):
+            column.append(0)
+        return len(self.date_column) - 1
+
+    def _release(self, row):
+        self.classes.release(self.class_column[row])
+        self.revisions.release(self.revision_column[row])
+        self.authors.release(self.author_column[row])
+
+    def _over_budget(self, fraction=1.0):
+        return (
+            self.max_entries is not None
+            and len(self.rows) > self.max_entries * fraction
+        ) or (self.max_bytes is not None and self.size > self.max_bytes * fraction)
+
+    def _prune(self, keep):
+        """
+        Evicts the least recently used statuses once the cache is over one
+        of its budgets, until it is well within them.  The cached statuses of
+        the directories above an evicted path go too, since their summary
+        depends on it.  Rows are kept in the order they were used, so the
+        next one to evict is always the first.
+
+        """
+        if not self._over_budget():
+            return
+
+        rows = self.rows
+        while self._over_budget(EVICTION_TARGET):
+            path = next(iter(rows))
+            if path == keep:
+                # Nothing else is left
+                break
+
+            if self.on_evict is not None:
+                self.on_evict(path)
+            cached = len(rows)
+            self.invalidate(path)
+            self.evicted += cached - len(rows)
 
     def __contains__(self, path):
-        return path in self.cache
+        return path in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _link(self, path):
+        if path in self.tree:
+            # Already on the way to a cached path
+            return
+
+        child = path
+        while True:
+            parent = parent_path(child)
+            if parent == child:
+                break
+
+            siblings = self.tree.get(parent)
+            if siblings is not None:
+                siblings.append(child)
+                break
+
+            self.tree[parent] = [child]
+            if parent in self.rows:
+                # Cached paths are on the way already
+                break
+            child = parent
+
+    def _count(self, path, single_index, delta):
+        child = path
+        while True:
+            parent = parent_path(child)
+            if parent == child:
+                break
+
+            counts = self.counts.get(parent)
+            if counts is None:
+                counts = self.counts[parent] = array("l", [0]) * len(self.keys)
+            counts[single_index] += delta
+            if delta < 0 and not any(counts):
+                del self.counts[parent]
+
+            child = parent
+
+    def summary(self, path, recurse=True, single=None):
+        """
+        Returns the summary status of a cached path from the counts kept for
+        the items under it, without looking at them, or only from the items
+        directly under it if recurse is False.  Returns None if the path is
+        not cached, unless its own single status is given.
+
+        """
+        row = self.rows.get(path)
+        if row is not None:
+            single = self.keys[self.single_column[row]]
+        elif single is None:
+            return None
+
+        status_set = set([single])
+        counts = self.counts.get(path)
+        if not recurse:
+            status_set.update(
+                self.keys[self.single_column[self.rows[child]]]
+                for child in self.children(path)
+            )
+        elif counts:
+            status_set.update(
+                self.keys[index] for index, count in enumerate(counts) if count
+            )
+
+        return Status.summarize(single, status_set)
+
+    def _unlink(self, path):
+        child = path
+        while child not in self.rows and not self.tree.get(child):
+            self.tree.pop(child, None)
+            parent = parent_path(child)
+            siblings = self.tree.get(parent)
+            if parent == child or siblings is None:
+                break
+
+            siblings.remove(child)
+            child = parent
+
+    def content(self, path):
+        """
+        Returns the simple content status of a cached path, or None if it is
+        not cached, without making a status object.
+
+        """
+        row = self.rows.get(path)
+        if row is None:
+            return None
+        return self.keys[self.content_column[row]]
+
+    def children(self, path):
+        """
+        Returns the cached paths directly under the given path.
+
+        """
+        return [child for child in self.tree.get(path, ()) if child in self.rows]
+
+    def subtree(self, path):
+        """
+        Returns every cached path under the given path, at any depth.
+
+        """
+        paths = []
+        pending = [path]
+        while pending:
+            for child in self.tree.get(pending.pop(), ()):
+                if child in self.rows:
+                    paths.append(child)
+                pending.append(child)
 
-    def find_path_statuses(self, path):
+        return paths
+
+    def invalidate(self, path, recurse=False):
+        """
+        Forget the cached status of a path and of all its ancestors, since the
+        summary of a directory depends on its children.
+
+        @type   path: string
+        @param  path: The path that changed
+
+        @type   recurse: boolean
+        @param  recurse: Also forget everything below the path
+
+        """
+        if recurse:
+            for key in self.subtree(path):
+                del self[key]
+
+        path_to_check = path
+        while path_to_check:
+            if path_to_check in self.rows:
+                del self[path_to_check]
+            parent = parent_path(path_to_check)
+            if parent == path_to_check:
+                break
+            path_to_check = parent
+
+    def find_path_statuses(self, path, recurse=True):
+        """
+        Returns the status of the path followed by those of everything under it,
+        or only of the items directly under it if recurse is False.
+
+        """
         statuses = []
-        if os.path.isdir(path):
-            for key, value in list(self.cache.items()):
-                if key.startswith(path):
-                    statuses.append(self.__getitem__(key))
-        else:
+        if path in self.rows:
             statuses.append(self.__getitem__(path))
 
+        if recurse:
+            paths = self.subtree(path)
+        else:
+            paths = self.children(path)
+
+        for child in paths:
+            statuses.append(self.__getitem__(child))
+
         return statuses
 
 
+def bounded_status_cache():
+    """
+    Returns a status cache for one working copy, limited by the [checker]
+    max_cached_statuses and max_cache_size (in MB) settings, 0 meaning no
+    limit.
+
+    """
+    max_entries = int(settings.get("checker", "max_cached_statuses"))
+    max_size = int(settings.get("checker", "max_cache_size")) * 1024 * 1024
+    return StatusCache(max_entries or None, max_size or None)
+
+
 class Status(object):
+    __slots__ = (
+        "path",
+        "content",
+        "metadata",
+        "remote_content",
+        "remote_metadata",
+        "single",
+        "summary",
+        "revision",
+        "author",
+        "date",
+    )
+
     @staticmethod
     def status_unknown(path):
         return Status(path, status_unknown, summary=status_unknown)
@@ -233,6 +607,26 @@ class Status(object):
         self.author = author
         self.date = date
 
+    @classmethod
+    def restore(cls, path, content, metadata, single, revision, author, date):
+        """
+        Returns a status made from the fields a StatusCache keeps, without
+        working the single status out again.
+
+        """
+        status = cls.__new__(cls)
+        status.path = path
+        status.content = content
+        status.metadata = metadata
+        status.remote_content = None
+        status.remote_metadata = None
+        status.single = single
+        status.summary = None
+        status.revision = revision
+        status.author = author
+        status.date = date
+        return status
+
     def _make_single_status(self):
         """
         Given our text_status and a prop_status, simplify to a single "simple"
@@ -258,24 +652,28 @@ class Status(object):
         else:
             return self.metadata
 
+    @staticmethod
+    def summarize(single, status_set):
+        """
+        Given the single status of a directory and the set of single statuses
+        of the items under it, returns the summary status of the directory.
+        """
+        if status_complicated in status_set:
+            return status_complicated
+        elif single in ["added", "modified", "deleted"]:
+            # These take priority over child statuses
+            return single
+        elif len(set(MODIFIED_CHILD_STATUSES) & status_set):
+            return status_modified
+
+        return single
+
     def make_summary(self, child_statuses=[]):
         """Summarises statuses for directories."""
         summary = status_unknown
 
         status_set = set([st.single for st in child_statuses])
-
-        if not status_set:
-            self.summary = self.single
-
-        if status_complicated in status_set:
-            self.summary = status_complicated
-        elif self.single in ["added", "modified", "deleted"]:
-            # These take priority over child statuses
-            self.summary = self.single
-        elif len(set(MODIFIED_CHILD_STATUSES) & status_set):
-            self.summary = status_modified
-        else:
-            self.summary = self.single
+        self.summary = Status.summarize(self.single, status_set)
 
         return summary
 
@@ -301,26 +699,28 @@ class Status(object):
         )
 
     def __getstate__(self):
-        attrs = self.__dict__.copy()
-        # Force strings to Unicode to avoid json implicit conversion.
-        for key in attrs:
-            if isinstance(attrs[key], (six.string_types, six.text_type)):
-                attrs[key] = S(attrs[key]).unicode()
+        attrs = {}
+        for key in Status.__slots__:
+            value = getattr(self, key, None)
+            # Force strings to Unicode to avoid json implicit conversion.
+            if isinstance(value, (six.string_types, six.text_type)):
+                value = S(value).unicode()
+            attrs[key] = value
         attrs["__type__"] = type(self).__name__
         attrs["__module__"] = type(self).__module__
         return attrs
 
     def __setstate__(self, state_dict):
-        del state_dict["__type__"]
-        del state_dict["__module__"]
-        # Store strings in native str type.
-        for key in state_dict:
-            if isinstance(state_dict[key], (six.string_types, six.text_type)):
-                state_dict[key] = str(S(state_dict[key]))
-        self.__dict__ = state_dict
+        for key in Status.__slots__:
+            value = state_dict.get(key)
+            # Store strings in native str type.
+            if isinstance(value, (six.string_types, six.text_type)):
+                value = str(S(value))
+            setattr(self, key, value)
 
 
 class SVNStatus(Status):
+    __slots__ = ()
 
     vcs_type = rabbitvcs.vcs.VCS_SVN
 
@@ -378,6 +778,7 @@ class SVNStatus(Status):
 
 
 class GitStatus(Status):
+    __slots__ = ()
 
     vcs_type = "git"
 
@@ -401,6 +802,8 @@ class GitStatus(Status):
 
 
 class MercurialStatus(Status):
+    __slots__ = ()
+
     vcs_type = "mercurial"
 
     content_status_map = {
@@ -512,5 +915,109 @@ class TestStatusObjects(unittest.TestCase):
 TestStatusObjects.__initclass__()
 
 
+class TestStatusCache(unittest.TestCase):
+    base = "/path/to/test"
+
+    def setUp(self):
+        self.cache = StatusCache()
+        for path in ["", "/a", "/a/b", "/a/b/c", "/ab", "/d/e"]:
+            self.cache[self.base + path] = Status(self.base + path, status_normal)
+
+    def paths(self, statuses):
+        return sorted(status.path[len(self.base) :] for status in statuses)
+
+    def testfind_recurse(self):
+        statuses = self.cache.find_path_statuses(self.base + "/a")
+        self.assertEqual(self.paths(statuses), ["/a", "/a/b", "/a/b/c"])
+
+    def testfind_children(self):
+        statuses = self.cache.find_path_statuses(self.base, recurse=False)
+        # /d has no status of its own, so /d/e is not a direct child
+        self.assertEqual(self.paths(statuses), ["", "/a", "/ab"])
+
+    def testinvalidate(self):
+        self.cache.invalidate(self.base + "/a/b", recurse=True)
+        self.assertEqual(len(self.cache), 2)
+        self.assertTrue(self.base + "/ab" in self.cache)
+        self.assertFalse(self.base in self.cache)
+        self.assertEqual(self.cache.subtree(self.base + "/a"), [])
+
+    def testsummary(self):
+        path = self.base + "/a/b/c"
+        self.cache[path] = Status(path, status_modified)
+        self.assertEqual(self.cache.summary(self.base), status_modified)
+        self.assertEqual(self.cache.summary(self.base + "/ab"), status_normal)
+        self.assertEqual(self.cache.summary(self.base, recurse=False), status_normal)
+        self.assertEqual(
+            self.cache.summary(self.base + "/a/b", recurse=False), status_modified
+        )
+
+        self.cache[path] = Status(path, status_normal)
+        self.assertEqual(self.cache.summary(self.base), status_normal)
+
+        self.cache[path] = Status(path, status_complicated)
+        del self.cache[self.base + "/a/b"]
+        self.assertEqual(self.cache.summary(self.base + "/a"), status_complicated)
+
+        self.cache.invalidate(path)
+        self.cache[self.base] = Status(self.base, status_normal)
+        self.assertEqual(self.cache.summary(self.base), status_normal)
+        counts = self.cache.counts[self.base]
+        self.assertEqual(counts[StatusCache.key_index[status_normal]], 2)
+        self.assertEqual(sum(counts), 2)
+        self.assertEqual(self.cache.summary(self.base + "/x"), None)
+        # /d is not cached, its items are
+        self.cache[self.base + "/d/e"] = Status(self.base + "/d/e", status_modified)
+        self.assertEqual(
+            self.cache.summary(self.base + "/d", False, status_normal), status_modified
+        )
+        self.assertEqual(self.cache.content(self.base + "/ab"), status_normal)
+        self.assertEqual(self.cache.content(self.base + "/x"), None)
+
+    def testinterning(self):
+        status = Status(self.base + "/f", status_normal, revision=7, author="me")
+        self.cache[status.path] = status
+        self.cache[status.path + "2"] = status
+        self.assertEqual(self.cache.authors.values.count("me"), 1)
+        self.assertEqual(self.cache[status.path].revision, 7)
+
+        # Let go of once no status uses it
+        del self.cache[status.path]
+        del self.cache[status.path + "2"]
+        self.assertFalse("me" in self.cache.authors.values)
+
+    def testuncacheable(self):
+        path = self.base + "/f"
+        self.cache[path] = Status(path, status_normal, date="yesterday")
+        self.cache[path] = Status(path, status_normal, date=[1])
+        self.assertFalse(path in self.cache)
+        self.assertEqual(self.cache.uncacheable, 2)
+
+    def testlru(self):
+        evicted = []
+        cache = StatusCache(max_entries=4, on_evict=evicted.append)
+        for path in ["", "/a", "/a/b", "/c"]:
+            cache[self.base + path] = Status(self.base + path, status_normal)
+
+        cache[self.base]
+        cache[self.base + "/c"]
+        cache[self.base + "/d"] = Status(self.base + "/d", status_normal)
+        # /a goes first, with the directories above it
+        self.assertEqual(
+            sorted(cache.rows.keys()),
+            [self.base + "/a/b", self.base + "/c", self.base + "/d"],
+        )
+        self.assertEqual(cache.evicted, 2)
+        self.assertEqual(evicted, [self.base + "/a"])
+
+        cache = StatusCache(max_bytes=3 * (ENTRY_SIZE + len(self.base) + 2))
+        for path in ["/a", "/b", "/c", "/d"]:
+            cache[self.base + path] = Status(self.base + path, status_normal)
+        # Down to well within the budget
+        self.assertEqual(
+            sorted(cache.rows.keys()), [self.base + "/c", self.base + "/d"]
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,294 @@
+#
+# Copyright (C) 2009 Jason Heeris <jason.heeris@gmail.com>
+# Copyright (C) 2009 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2009 by Adam Plumb <adamplumb@gmail.com>#
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Encodings for status objects sent between the checker service and its
+clients, and saved in the status store (see rabbitvcs.vcs.store).
+
+Two encodings are available:
+
+    json       One JSON object per status, carrying the class name and module
+               of the status along with its attributes. Always supported.
+
+    compact-1  A binary encoding for lists of statuses. A string table holds
+               every distinct string value once (paths, authors, revisions,
+               status keywords, class names), followed by one fixed-width
+               record per status that refers to the table by index.
+
+The encoding used for batched replies is agreed on by the stub and the service
+when the stub connects (see StatusCheckerService.NegotiateEncoding).
+"""
+
+from __future__ import absolute_import
+
+import sys
+import json
+import struct
+import unittest
+
+import rabbitvcs.vcs.status
+from rabbitvcs.util.strings import S, UTF8_ENCODING, SURROGATE_ESCAPE
+
+from rabbitvcs.util.log import Log
+
+log = Log("rabbitvcs.vcs.statuscodec")
+
+ENCODING_JSON = "json"
+ENCODING_COMPACT = "compact-1"
+
+# In order of preference
+ENCODINGS = [ENCODING_COMPACT, ENCODING_JSON]
+
+COMPACT_MAGIC = b"RVS"
+COMPACT_VERSION = 1
+
+# magic, version, number of strings, number of records
+COMPACT_HEADER = struct.Struct("<3sBII")
+
+# The string attributes of a status, in record order
+COMPACT_FIELDS = [
+    "path",
+    "content",
+    "metadata",
+    "summary",
+    "single",
+    "remote_content",
+    "remote_metadata",
+    "author",
+    "revision",
+]
+
+# type, one string index per field, date, flags
+COMPACT_RECORD = struct.Struct("<I%dIqB" % len(COMPACT_FIELDS))
+
+COMPACT_NONE = 0xFFFFFFFF
+COMPACT_FLAG_NO_DATE = 1
+COMPACT_FLAG_INT_REVISION = 2
+
+
+def find_class(module, name):
+    """Given a module name and a class name, return the actual type object."""
+    # From Python stdlib pickle module source
+    __import__(module)
+    mod = sys.modules[module]
+    klass = getattr(mod, name)
+    return klass
+
+
+def encode_status(status):
+    """Before encoding a status object to JSON, we need to turn it into
+    something simpler.
+    """
+    return status.__getstate__()
+
+
+def decode_status(json_dict):
+    """Once we get a JSON encoded string out the other side of DBUS, we need to
+    reconstitute the original object. This method is based on the pickle module
+    in the Python stdlib.
+    """
+    cl = find_class(json_dict["__module__"], json_dict["__type__"])
+    st = None
+    if cl in rabbitvcs.vcs.status.STATUS_TYPES:
+        st = cl.__new__(cl)
+        st.__setstate__(json_dict)
+    elif "path" in json_dict:
+        log.warning("Could not deduce status class: %s" % json_dict["__type__"])
+        st = rabbitvcs.vcs.status.Status.status_error(json_dict["path"])
+    else:
+        raise TypeError("RabbitVCS status object has no path")
+    return st
+
+
+def negotiate_encoding(requested):
+    """Returns the first of the requested encodings that we support, falling
+    back to JSON.
+    """
+    for encoding in requested:
+        if encoding in ENCODINGS:
+            return encoding
+    return ENCODING_JSON
+
+
+def _type_name(cl):
+    return "%s:%s" % (cl.__module__, cl.__name__)
+
+
+STATUS_CLASSES = dict((_type_name(cl), cl) for cl in rabbitvcs.vcs.status.STATUS_TYPES)
+
+
+def encode_statuses(statuses, encoding=ENCODING_COMPACT):
+    """Encodes a list of status objects as bytes."""
+    if encoding == ENCODING_JSON:
+        return S(json.dumps(statuses, default=encode_status)).bytes()
+
+    strings = []
+    string_index = {}
+
+    def intern(value):
+        if value is None:
+            return COMPACT_NONE
+        value = S(value)
+        try:
+            return string_index[value]
+        except KeyError:
+            string_index[value] = len(strings)
+            strings.append(value)
+            return string_index[value]
+
+    records = []
+    for status in statuses:
+        flags = 0
+        date = status.date
+        if date is None:
+            flags |= COMPACT_FLAG_NO_DATE
+            date = 0
+
+        revision = status.revision
+        if isinstance(revision, int):
+            flags |= COMPACT_FLAG_INT_REVISION
+
+        records.append(
+            COMPACT_RECORD.pack(
+                intern(_type_name(type(status))),
+                intern(status.path),
+                intern(status.content),
+                intern(status.metadata),
+                intern(status.summary),
+                intern(status.single),
+                intern(status.remote_content),
+                intern(status.remote_metadata),
+                intern(status.author),
+                intern(revision),
+                int(date),
+                flags,
+            )
+        )
+
+    chunks = [
+        COMPACT_HEADER.pack(COMPACT_MAGIC, COMPACT_VERSION, len(strings), len(records))
+    ]
+    for value in strings:
+        data = value.bytes()
+        chunks.append(struct.pack("<I", len(data)))
+        chunks.append(data)
+    chunks.extend(records)
+
+    return b"".join(chunks)
+
+
+def decode_statuses(data, encoding=ENCODING_COMPACT):
+    """Decodes bytes made by encode_statuses() back into status objects."""
+    data = bytes(data)
+
+    if encoding == ENCODING_JSON:
+        return json.loads(S(data), object_hook=decode_status)
+
+    magic, version, string_count, record_count = COMPACT_HEADER.unpack_from(data)
+    if magic != COMPACT_MAGIC or version != COMPACT_VERSION:
+        raise ValueError("Unsupported status encoding: %r %r" % (magic, version))
+
+    offset = COMPACT_HEADER.size
+    strings = []
+    for index in range(string_count):
+        (length,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        strings.append(
+            data[offset : offset + length].decode(UTF8_ENCODING, SURROGATE_ESCAPE)
+        )
+        offset += length
+
+    classes = {}
+    statuses = []
+    for fields in COMPACT_RECORD.iter_unpack(data[offset:]):
+        type_index = fields[0]
+        flags = fields[-1]
+
+        cl = classes.get(type_index)
+        if cl is None:
+            cl = STATUS_CLASSES.get(strings[type_index])
+            if cl is None:
+                log.warning("Could not deduce status class: %s" % strings[type_index])
+            classes[type_index] = cl
+
+        state = {}
+        for name, index in zip(COMPACT_FIELDS, fields[1:-2]):
+            state[name] = None if index == COMPACT_NONE else strings[index]
+
+        if flags & COMPACT_FLAG_INT_REVISION:
+            state["revision"] = int(state["revision"])
+        state["date"] = None if flags & COMPACT_FLAG_NO_DATE else fields[-2]
+
+        if cl is None:
+            statuses.append(rabbitvcs.vcs.status.Status.status_error(state["path"]))
+            continue
+
+        status = cl.__new__(cl)
+        for name, value in state.items():
+            setattr(status, name, value)
+        statuses.append(status)
+
+    if len(statuses) != record_count:
+        raise ValueError(
+            "Truncated status data (%d of %d records)" % (len(statuses), record_count)
+        )
+
+    return statuses
+
+
+class TestStatusCodec(unittest.TestCase):
+    def make_statuses(self):
+        svn_status = rabbitvcs.vcs.status.Status(
+            "/path/to/test/b\udcff",
+            "normal",
+            "modified",
+            summary="modified",
+            revision=42,
+            author="someone",
+            date=1234567890,
+        )
+        svn_status.__class__ = rabbitvcs.vcs.status.SVNStatus
+
+        return [
+            rabbitvcs.vcs.status.Status("/path/to/test", "normal"),
+            svn_status,
+            rabbitvcs.vcs.status.Status.status_calc("/path/to/test/c"),
+        ]
+
+    def assert_round_trip(self, encoding):
+        statuses = self.make_statuses()
+        decoded = decode_statuses(encode_statuses(statuses, encoding), encoding)
+
+        self.assertEqual(len(decoded), len(statuses))
+        for before, after in zip(statuses, decoded):
+            self.assertEqual(type(before), type(after))
+            self.assertEqual(before.__getstate__(), after.__getstate__())
+
+    def test_compact_round_trip(self):
+        self.assert_round_trip(ENCODING_COMPACT)
+
+    def test_json_round_trip(self):
+        self.assert_round_trip(ENCODING_JSON)
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate_encoding(["compact-9", "compact-1"]), "compact-1")
+        self.assertEqual(negotiate_encoding(["compact-9"]), ENCODING_JSON)
+
+
+if __name__ == "__main__":
+    unittest.main()
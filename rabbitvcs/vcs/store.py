@@ -0,0 +1,418 @@
+#
+# This is an extension to the Nautilus file manager to allow better
+# integration with the Subversion source control system.
+#
+# Copyright (C) 2006-2008 by Jason Field <jason@jasonfield.com>
+# Copyright (C) 2007-2008 by Bruce van der Kooij <brucevdkooij@gmail.com>
+# Copyright (C) 2008-2010 by Adam Plumb <adamplumb@gmail.com>
+#
+# RabbitVCS is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# RabbitVCS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with RabbitVCS;  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Persistent status store.
+
+The statuses of a whole repository are saved to an SQLite database in our
+home folder, along with a validation key describing the state of the
+repository metadata (e.g. the Git index and HEAD, or the SVN wc.db).  When the
+checker service starts again, the statuses of a repository whose key still
+matches are used right away, and the repository is rescanned in the
+background to catch changes to the working tree made in the meantime.
+
+Statuses are written by a thread of the store, so that scans do not wait for
+the disk, and those of repositories that have not been scanned for a long
+time, or that are gone, are dropped when it starts.
+"""
+
+from __future__ import absolute_import
+
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+import rabbitvcs.vcs.status
+from rabbitvcs.vcs.statuscodec import encode_statuses, decode_statuses
+from rabbitvcs.util import helper
+from rabbitvcs.util.settings import SettingsManager
+
+from rabbitvcs.util.log import Log
+
+log = Log("rabbitvcs.vcs.store")
+
+settings = SettingsManager()
+
+STORE_FILENAME = "statuses.sqlite"
+
+# Statuses are written at most this often (in seconds) for each repository,
+# unless its validation key changes
+SAVE_INTERVAL = 60
+
+# The statuses of a repository that were last written this long ago (in
+# seconds), or whose working copy is gone, are dropped
+EXPIRE_AFTER = 30 * 24 * 60 * 60
+
+
+class StatusStore(object):
+    def __init__(
+        self,
+        path,
+        save_interval=SAVE_INTERVAL,
+        expire_after=EXPIRE_AFTER,
+        background=True,
+    ):
+        """
+        @type   path: string
+        @param  path: The database file
+
+        @type   background: boolean
+        @param  background: Whether statuses are written by a thread of
+            their own, rather than by write_due() and flush()
+
+        """
+        self.path = path
+        self.save_interval = save_interval
+        self.expire_after = expire_after
+        self.background = background
+        self.connection = None
+
+        # Protects the state below; the connection has a lock of its own so
+        # that reads are not held up by the encoding of a write
+        self.lock = threading.Lock()
+        self.connection_lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.writer = None
+        self.dirty = False
+        self.closed = False
+
+        # Repository root -> (time, key) of the last write
+        self.saved = {}
+
+        # Repository root -> (key, statuses) not written yet
+        self.unsaved = {}
+
+        # Repositories loaded from the store that have not been rescanned
+        self.unconfirmed = set()
+
+    def _connect(self):
+        # Called with connection_lock held
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS statuses ("
+                "root TEXT PRIMARY KEY, key TEXT, saved REAL, data BLOB)"
+            )
+        return self.connection
+
+    def load(self, root, key):
+        """
+        Returns the statuses saved for a repository, or None if there are
+        none or they were saved with a different validation key.
+
+        """
+        try:
+            with self.connection_lock:
+                row = (
+                    self._connect()
+                    .execute("SELECT key, data FROM statuses WHERE root = ?", (root,))
+                    .fetchone()
+                )
+        except sqlite3.Error as e:
+            log.debug("Unable to read the status store: %s" % e)
+            return None
+
+        if row is None or row[0] != key:
+            return None
+
+        try:
+            statuses = decode_statuses(bytes(row[1]))
+        except Exception as e:
+            log.debug("Discarding unreadable statuses of %s: %s" % (root, e))
+            return None
+
+        with self.lock:
+            self.saved[root] = (time.time(), key)
+            self.unconfirmed.add(root)
+
+        return statuses
+
+    def save(self, root, key, statuses):
+        """
+        Queues the statuses of a whole repository to be written.  Writes are
+        made by a thread, spaced out by save_interval, and the last one is
+        made by close() at the latest.
+
+        @type   key: string
+        @param  key: The validation key, taken before the statuses were
+            computed
+
+        """
+        with self.lock:
+            self.unconfirmed.discard(root)
+            self.unsaved[root] = (key, statuses)
+            if not self.background or self.closed:
+                return
+
+            self.dirty = True
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._run, name="StatusStore")
+                self.writer.daemon = True
+                self.writer.start()
+            self.wakeup.notify()
+
+    def _run(self):
+        self.expire()
+        while True:
+            wait = self.write_due()
+            with self.lock:
+                if not self.dirty and not self.closed:
+                    self.wakeup.wait(wait)
+                self.dirty = False
+                if self.closed:
+                    return
+
+    def write_due(self, now=None):
+        """
+        Writes the statuses whose turn has come.  Returns the number of
+        seconds until the next of those held back is due, or None if there
+        are none.
+
+        """
+        if now is None:
+            now = time.time()
+
+        due = []
+        wait = None
+        with self.lock:
+            for root, (key, statuses) in list(self.unsaved.items()):
+                last = self.saved.get(root)
+                if (
+                    last is not None
+                    and last[1] == key
+                    and now - last[0] < self.save_interval
+                ):
+                    left = last[0] + self.save_interval - now
+                    wait = left if wait is None else min(wait, left)
+                    continue
+
+                del self.unsaved[root]
+                self.saved[root] = (now, key)
+                due.append((root, key, statuses))
+
+        for root, key, statuses in due:
+            self._write(root, key, statuses, now)
+
+        return wait
+
+    def flush(self):
+        """
+        Writes the statuses that were held back by save().
+
+        """
+        now = time.time()
+        with self.lock:
+            unsaved = self.unsaved
+            self.unsaved = {}
+            for root, (key, statuses) in unsaved.items():
+                self.saved[root] = (now, key)
+
+        for root, (key, statuses) in unsaved.items():
+            self._write(root, key, statuses, now)
+
+    def _write(self, root, key, statuses, now):
+        data = sqlite3.Binary(encode_statuses(statuses))
+        try:
+            with self.connection_lock:
+                connection = self._connect()
+                with connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO statuses VALUES (?, ?, ?, ?)",
+                        (root, key, now, data),
+                    )
+        except sqlite3.Error as e:
+            log.debug("Unable to write the status store: %s" % e)
+
+    def expire(self, now=None):
+        """
+        Drops the statuses of the repositories that were last written more
+        than expire_after seconds ago, or whose working copy is gone.
+
+        """
+        if now is None:
+            now = time.time()
+
+        try:
+            with self.connection_lock:
+                rows = self._connect().execute("SELECT root, saved FROM statuses")
+                rows = rows.fetchall()
+
+            stale = [
+                (root,)
+                for root, saved in rows
+                if saved < now - self.expire_after or not os.path.isdir(root)
+            ]
+            if not stale:
+                return
+
+            with self.connection_lock:
+                connection = self._connect()
+                with connection:
+                    connection.executemany("DELETE FROM statuses WHERE root = ?", stale)
+        except sqlite3.Error as e:
+            log.debug("Unable to expire the status store: %s" % e)
+            return
+
+        log.debug("Dropped the statuses of %d repositories" % len(stale))
+
+    def take_unconfirmed(self):
+        """
+        Returns the repositories whose statuses came from the store and have
+        not been rescanned since, and forgets about them.
+
+        """
+        with self.lock:
+            unconfirmed = self.unconfirmed
+            self.unconfirmed = set()
+        return unconfirmed
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            writer = self.writer
+            self.wakeup.notify()
+
+        if writer is not None:
+            writer.join()
+
+        self.flush()
+        with self.connection_lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Returns the status store shared by the backends, or None if it is turned
+    off ([checker] persistent_cache) or SQLite is not available.
+
+    """
+    global _store
+
+    if sqlite3 is None or not settings.get("checker", "persistent_cache"):
+        return None
+
+    with _store_lock:
+        if _store is None:
+            _store = StatusStore(os.path.join(helper.get_home_folder(), STORE_FILENAME))
+        return _store
+
+
+def file_key(path):
+    """
+    Returns a validation key made of the modification time and size of a
+    file, or of "missing" if it does not exist.
+
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "missing"
+    return "%d:%d" % (st.st_mtime_ns, st.st_size)
+
+
+class TestStatusStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = StatusStore(
+            os.path.join(self.tmpdir, STORE_FILENAME), background=False
+        )
+        self.statuses = [
+            rabbitvcs.vcs.status.Status(self.tmpdir, "modified"),
+            rabbitvcs.vcs.status.Status(os.path.join(self.tmpdir, "a"), "modified"),
+        ]
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_load(self):
+        self.assertEqual(self.store.load(self.tmpdir, "key"), None)
+        self.store.save(self.tmpdir, "key", self.statuses)
+        self.store.close()
+
+        store = StatusStore(self.store.path)
+        self.addCleanup(store.close)
+        self.assertEqual(store.load(self.tmpdir, "other key"), None)
+        statuses = store.load(self.tmpdir, "key")
+        self.assertEqual(
+            [st.path for st in statuses], [self.tmpdir, self.statuses[1].path]
+        )
+        self.assertEqual(store.take_unconfirmed(), set([self.tmpdir]))
+        self.assertEqual(store.take_unconfirmed(), set())
+
+    def load(self):
+        store = StatusStore(self.store.path)
+        statuses = store.load(self.tmpdir, "key")
+        store.close()
+        return statuses
+
+    def test_save_interval(self):
+        self.store.save(self.tmpdir, "key", self.statuses)
+        self.assertEqual(self.load(), None)
+        self.assertEqual(self.store.write_due(), None)
+
+        self.store.save(self.tmpdir, "key", self.statuses[:1])
+        self.assertTrue(self.store.write_due() > 0)
+        self.assertEqual(len(self.load()), 2)
+
+        self.store.flush()
+        self.assertEqual(len(self.load()), 1)
+
+    def test_background(self):
+        store = StatusStore(self.store.path)
+        store.save(self.tmpdir, "key", self.statuses)
+        store.save(self.tmpdir, "key", self.statuses[:1])
+        store.close()
+        self.assertEqual(store.writer.is_alive(), False)
+        self.assertEqual(len(self.load()), 1)
+
+    def test_expire(self):
+        gone = os.path.join(self.tmpdir, "gone")
+        self.store.save(self.tmpdir, "key", self.statuses)
+        self.store.save(gone, "key", self.statuses)
+        self.store.flush()
+
+        self.store.expire()
+        self.assertEqual(len(self.load()), 2)
+        self.assertEqual(self.store.load(gone, "key"), None)
+
+        self.store.expire(time.time() + EXPIRE_AFTER + 1)
+        self.assertEqual(self.load(), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
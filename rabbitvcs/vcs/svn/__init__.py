@@ -36,8 +36,11 @@ import pysvn
 import rabbitvcs.vcs
 import rabbitvcs.vcs.status
 import rabbitvcs.vcs.log
+from rabbitvcs.vcs.roots import find_root
+from rabbitvcs.vcs.store import get_store, file_key
 from rabbitvcs.util import helper
 from rabbitvcs.util.log import Log
+from rabbitvcs.util.stats import statistics
 from rabbitvcs.util.decorators import structure_map
 from rabbitvcs.util.strings import *
 import six
@@ -261,53 +264,129 @@ class SVN(object):
         pysvn.node_kind.unknown: "unknown",
     }
 
-    def __init__(self):
+    DEPTHS = {
+        rabbitvcs.vcs.DEPTH_EMPTY: pysvn.depth.empty,
+        rabbitvcs.vcs.DEPTH_IMMEDIATES: pysvn.depth.immediates,
+        rabbitvcs.vcs.DEPTH_INFINITY: pysvn.depth.infinity,
+    }
+
+    def __init__(self, root=None):
         self.client = pysvn.Client()
         self.interface = "pysvn"
         self.vcs = rabbitvcs.vcs.VCS_SVN
-        self.cache = rabbitvcs.vcs.status.StatusCache()
+        self.cache = rabbitvcs.vcs.status.bounded_status_cache()
+
+        # Cached path -> depth it was scanned to, for the folders whose
+        # contents are not all cached.  A cached path missing from here has
+        # everything under it cached as well, since dropping any of those
+        # drops the path too.
+        self.shallow = {}
+
+        # The working copy this client caches statuses for, if any
+        self.root = root
+        self.loaded = False
+
+    def load(self):
+        """
+        Fills the cache with the statuses saved for the working copy, if
+        they are still valid.
+
+        """
+        self.loaded = True
+
+        store = get_store()
+        if not self.root or not store:
+            return
+
+        statuses = store.load(self.root, self._validation_key())
+        if statuses is not None:
+            for st in statuses:
+                self.cache[st.path] = st
+
+    def _validation_key(self):
+        return "svn:%s" % file_key(os.path.join(self.root, ".svn", "wc.db"))
 
-    def statuses(self, path, recurse=True, update=False, invalidate=False):
+    def statuses(self, path, recurse=True, update=False, invalidate=False, depth=None):
         """
 
         Look up the status for path.
 
+        @type   depth: string
+        @param  depth: One of the rabbitvcs.vcs.DEPTH_* constants, taken from
+            recurse if None
+
         """
 
+        if not self.loaded:
+            self.load()
+
+        if depth is None:
+            depth = rabbitvcs.vcs.recurse_depth(recurse)
+
         spath = S(path)
         if spath in self.cache:
             if invalidate:
                 del self.cache[spath]
-            else:
-                return self.cache.find_path_statuses(spath)
+                statistics.cache(self.root, "evictions")
+            elif self.is_cached(spath, depth):
+                statistics.cache(self.root, "hits")
+                if depth == rabbitvcs.vcs.DEPTH_EMPTY:
+                    return [self.cache[spath]]
+                return self.cache.find_path_statuses(
+                    spath, depth == rabbitvcs.vcs.DEPTH_INFINITY
+                )
 
+        statistics.cache(self.root, "misses")
         on_error = rabbitvcs.vcs.status.Status.status_unknown(path)
 
         if not self.is_in_a_or_a_working_copy(path):
             return [on_error]
 
+        # A scan of the whole working copy is saved, see load()
+        store = None
+        if (
+            self.root
+            and spath == self.root
+            and depth == rabbitvcs.vcs.DEPTH_INFINITY
+            and not update
+        ):
+            store = get_store()
+            key = store and self._validation_key()
+
         try:
             pysvn_statuses = self.client_status(
-                path, depth=pysvn.depth.infinity, update=update
+                path, depth=self.DEPTHS[depth], update=update
             )
             if not len(pysvn_statuses):
                 # This is NOT in the PySVN documentation, but sometimes it
                 # returns an empty list if the file goes missing...
                 return [on_error]
             else:
+                evicted = self.cache.evicted
                 statuslist = []
+                all_statuses = []
                 for st in pysvn_statuses:
+                    st_path = S(st.path)
+                    rabbitvcs_status = rabbitvcs.vcs.status.SVNStatus(st)
+                    self._cache_status(st_path, rabbitvcs_status, spath, depth)
+                    all_statuses.append(rabbitvcs_status)
+
                     # If not recursing, only return the item in question (if a file)
                     # or items directly under the path (if a directory)
-                    st_path = S(st.path)
                     cmp_path = os.path.join(path, os.path.basename(st_path))
-                    if not recurse and cmp_path != st_path and st_path != path:
+                    if (
+                        depth != rabbitvcs.vcs.DEPTH_INFINITY
+                        and cmp_path != st_path
+                        and st_path != path
+                    ):
                         continue
 
-                    rabbitvcs_status = rabbitvcs.vcs.status.SVNStatus(st)
-                    self.cache[st_path] = rabbitvcs_status
                     statuslist.append(rabbitvcs_status)
 
+                statistics.cache(self.root, "evictions", self.cache.evicted - evicted)
+                if store:
+                    store.save(self.root, key, all_statuses)
+
                 return statuslist
         except pysvn.ClientError as ex:
             # TODO: uncommenting these might not be a good idea
@@ -316,6 +395,19 @@ class SVN(object):
             log.exception(ex)
             return [on_error]
 
+    def _cache_status(self, st_path, status, spath, depth):
+        if depth == rabbitvcs.vcs.DEPTH_INFINITY:
+            self.shallow.pop(st_path, None)
+        elif st_path in self.cache and st_path not in self.shallow:
+            # Still has everything under it cached
+            pass
+        elif st_path == spath:
+            self.shallow[st_path] = depth
+        elif isdir(st_path):
+            self.shallow[st_path] = rabbitvcs.vcs.DEPTH_EMPTY
+
+        self.cache[st_path] = status
+
     def client_info(self, path):
         if islink(path):
             path = realpath(path)
@@ -325,27 +417,58 @@ class SVN(object):
         return self.client.status(*pure_unicode(args), **pure_unicode(kwargs))
 
     def find_repository_path(self, path):
-        path_to_check = path
-        while path_to_check != "/" and path_to_check != "":
-            if os.path.isdir(os.path.join(path_to_check, ".svn")):
-                return path_to_check
+        return find_root(path, ".svn")
 
-            path_to_check = os.path.split(path_to_check)[0]
+    def invalidate(self, path, recurse=False):
+        spath = S(path)
+        cached = len(self.cache)
+        self.cache.invalidate(spath, recurse)
+        statistics.cache(self.root, "evictions", cached - len(self.cache))
 
-        return None
+        self.shallow.pop(spath, None)
+        if recurse and self.shallow:
+            prefix = spath.rstrip("/") + "/"
+            for shallow_path in list(self.shallow.keys()):
+                if shallow_path.startswith(prefix):
+                    del self.shallow[shallow_path]
+
+    def is_cached(self, spath, depth):
+        """
+        Whether the statuses of the path and of the items under it, down to
+        the given depth, are cached.
+
+        """
+        if spath not in self.cache:
+            return False
+
+        scanned = self.shallow.get(spath, rabbitvcs.vcs.DEPTH_INFINITY)
+        return rabbitvcs.vcs.DEPTHS.index(scanned) >= rabbitvcs.vcs.DEPTHS.index(depth)
+
+    def status(
+        self, path, summarize=True, invalidate=False, depth=rabbitvcs.vcs.DEPTH_INFINITY
+    ):
+        if not self.loaded:
+            self.load()
+
+        if not summarize:
+            depth = rabbitvcs.vcs.DEPTH_EMPTY
+        recurse = depth == rabbitvcs.vcs.DEPTH_INFINITY
 
-    def status(self, path, summarize=True, invalidate=False):
         spath = S(path)
         if spath in self.cache:
             if invalidate:
                 del self.cache[spath]
-            else:
+                statistics.cache(self.root, "evictions")
+            elif self.is_cached(spath, depth):
+                statistics.cache(self.root, "hits")
                 st = self.cache[spath]
-                if summarize:
+                if depth == rabbitvcs.vcs.DEPTH_EMPTY:
                     st.summary = st.single
+                else:
+                    st.summary = self.cache.summary(spath, recurse)
                 return st
 
-        all_statuses = self.statuses(path, recurse=summarize)
+        all_statuses = self.statuses(path, depth=depth)
 
         if summarize:
             path_status = None
@@ -354,7 +477,15 @@ class SVN(object):
                     path_status = st
                     break
 
-            path_status.make_summary(all_statuses)
+            if path_status is None:
+                path_status = all_statuses[0]
+            elif depth == rabbitvcs.vcs.DEPTH_EMPTY:
+                path_status.summary = path_status.single
+            elif spath in self.cache:
+                # The counts kept by the cache give the summary directly
+                path_status.summary = self.cache.summary(spath, recurse)
+            else:
+                path_status.make_summary(all_statuses)
         else:
             path_status = all_statuses[0]
 